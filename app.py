@@ -1,38 +1,51 @@
 import os
-import time
 from pathlib import Path
 from datetime import datetime
 import streamlit as st
 
 # Backend imports (do not modify backend logic)
-from core.llm import call_llm
-from utils.topic_manager import create_topic, add_message, load_topics, save_topics, ensure_topic_store
-from utils.memory_manager import append_message as update_memory, ensure_memory_store
+from core import metrics, routing, scheduler
+from core.config import max_turns as default_max_turns
+from core.worker import ConversationWorker
+from utils.topic_manager import (
+    list_topics, delete_topic, get_messages_page, get_last_message, ensure_topic_store, search_messages,
+)
+from utils.memory_manager import ensure_memory_store
+from utils import doc_index, exporter
 
 # Paths
-STUDENT_PROMPT_FILE = Path("agents/student.txt")
-TEACHER_PROMPT_FILE = Path("agents/teacher.txt")
 UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
 
 # Page config
 st.set_page_config(page_title="Student–Teacher AI", page_icon="🎓", layout="wide")
 
+
+@st.cache_resource(show_spinner=False)
+def init_stores():
+    """Create upload dir and data stores once per process, not on every rerun."""
+    UPLOAD_DIR.mkdir(exist_ok=True)
+    ensure_topic_store()
+    ensure_memory_store()
+    return True
+
+
 # Ensure data stores exist before any access (important for fresh deployments)
-ensure_topic_store()
-ensure_memory_store()
+init_stores()
 
 # Session defaults
 for key, default in {
     "topic_id": None,
     "topic": "",
-    "max_turns": 6,
+    "max_turns": default_max_turns(),
     "turn_count": 0,
     "stop_requested": False,
     "auto_run": False,
     "status": "idle",
     "manual_mode": False,
     "selected_topic_id": None,
+    "last_error": "",
+    "saved_calls": 0,
+    "topic_page": 0,
 }.items():
     if key not in st.session_state:
         st.session_state[key] = default
@@ -42,62 +55,81 @@ if "dark_mode_active" not in st.session_state:
     st.session_state.dark_mode_active = False
 
 
+LIVE_POLL_SECONDS = 0.5
+# Messages rendered per page; older ones stay hidden until requested.
+CHAT_PAGE_SIZE = 8
+TOPIC_PAGE_SIZE = 20
+SEARCH_RESULTS = 10
+
+
 # Helpers
-@st.cache_data(show_spinner=False)
-def read_prompt(path: Path) -> str:
-    return path.read_text(encoding="utf-8") if path.exists() else ""
+@st.cache_resource(show_spinner=False)
+def get_worker() -> ConversationWorker:
+    """One worker per server process; it owns every running conversation."""
+    return ConversationWorker()
+
+
+@st.cache_resource(show_spinner=False)
+def start_metrics_server():
+    """Expose /metrics and /metrics.json once per process when METRICS_PORT is set."""
+    if not metrics.METRICS_PORT:
+        return None
+    return metrics.start_server(metrics.METRICS_PORT)
+
+
+def sync_from_worker():
+    """Mirror the worker's view of the active conversation into the session."""
+    snap = get_worker().snapshot(st.session_state.topic_id) if st.session_state.topic_id else None
+    if snap is None:
+        return None
+    for key in ("turn_count", "max_turns", "status", "auto_run", "stop_requested", "saved_calls"):
+        st.session_state[key] = snap[key]
+    st.session_state.last_error = snap["error"]
+    return snap
 
 
 def get_last_student(topic_id: str):
-    data = load_topics()
-    for topic in data.get("topics", []):
-        if topic.get("topic_id") == topic_id:
-            for msg in reversed(topic.get("messages", [])):
-                if msg.get("role") == "student":
-                    return msg.get("message")
-    return ""
+    return get_last_message(topic_id, "student")
 
 
 def get_last_teacher(topic_id: str):
-    data = load_topics()
-    for topic in data.get("topics", []):
-        if topic.get("topic_id") == topic_id:
-            for msg in reversed(topic.get("messages", [])):
-                if msg.get("role") == "teacher":
-                    return msg.get("message")
-    return ""
+    return get_last_message(topic_id, "teacher")
 
 
-def delete_topic(topic_id: str):
-    data = load_topics()
-    data["topics"] = [t for t in data.get("topics", []) if t.get("topic_id") != topic_id]
-    save_topics(data)
+def load_topic_messages(topic_id: str, offset: int = 0, limit=None):
+    """(messages, total) for one window of a topic; see ``get_messages_page``."""
+    return get_messages_page(topic_id, offset, limit)
 
 
-def load_topic_messages(topic_id: str):
-    data = load_topics()
-    for topic in data.get("topics", []):
-        if topic.get("topic_id") == topic_id:
-            return topic.get("messages", [])
-    return []
+def chat_bubble(role: str, parent=st):
+    icon = "👦" if role == "student" else ("👨‍🏫" if role == "teacher" else "ℹ️")
+    box = parent.container(border=True)
+    box.markdown(f"**{icon} {role.title()}**  ")
+    return box
 
 
-def typing_animation(container, text: str, delay: float = 0.01):
-    displayed = ""
-    for ch in text:
-        displayed += ch
-        container.markdown(displayed)
-        time.sleep(delay)
+def render_messages(messages):
+    for msg in messages:
+        chat_bubble(msg.get("role", "?")).markdown(msg.get("message", ""))
 
 
-def render_chat(messages):
-    for msg in messages:
-        role = msg.get("role", "?")
-        content = msg.get("message", "")
-        icon = "👦" if role == "student" else ("👨‍🏫" if role == "teacher" else "ℹ️")
-        with st.container(border=True):
-            st.markdown(f"**{icon} {role.title()}**  ")
-            st.markdown(content)
+def render_chat(topic_id: str, key: str):
+    """Render the newest pages of a topic; earlier pages load on demand.
+
+    Only the shown messages are read from the store. Returns the topic's
+    message count.
+    """
+    pages_key = f"chat_pages_{key}"
+    shown = CHAT_PAGE_SIZE * st.session_state.get(pages_key, 1)
+    messages, total = load_topic_messages(topic_id, -shown, shown)
+    hidden = total - len(messages)
+    if hidden:
+        label = f"Show {min(hidden, CHAT_PAGE_SIZE)} earlier messages ({hidden} hidden)"
+        if st.button(label, key=f"more_{key}"):
+            st.session_state[pages_key] = st.session_state.get(pages_key, 1) + 1
+            st.rerun()
+    render_messages(messages)
+    return total
 
 
 def apply_theme(dark_mode: bool):
@@ -203,93 +235,204 @@ def apply_theme(dark_mode: bool):
         )
 
 
+@st.cache_data(show_spinner=False, max_entries=32)
+def read_artifact(path: str) -> bytes:
+    # Artifact names change with the topic, so a path's bytes never go stale.
+    return Path(path).read_bytes()
+
+
+def export_conversation(topic_id: str, fmt: str):
+    """(file name, bytes) of the topic rendered as ``fmt``, or None if it no longer exists."""
+    path = exporter.artifact(topic_id, fmt)
+    if path is None:
+        return None
+    return f"conversation-{topic_id[:8]}.{fmt}", read_artifact(str(path))
+
+
 def export_conversation_pdf(topic_id: str):
-    return
+    return export_conversation(topic_id, "pdf")
+
+
+def render_downloads(topic_id: str, key: str):
+    fmt_col, button_col = st.columns([1, 2])
+    fmt = fmt_col.selectbox(
+        "Export format", exporter.FORMATS, key=f"export_fmt_{key}", label_visibility="collapsed",
+        format_func={"md": "Markdown", "jsonl": "JSONL", "pdf": "PDF"}.get,
+    )
+    exported = export_conversation(topic_id, fmt)
+    if exported is not None:
+        name, data = exported
+        button_col.download_button(
+            "Download conversation", data, file_name=name, mime=exporter.MIME_TYPES[fmt], key=f"download_{key}",
+        )
 
 
 def save_uploaded_pdf(uploaded_file):
-    return None
+    """Store an upload under UPLOAD_DIR and index it; returns the number of new chunks."""
+    path = UPLOAD_DIR / Path(uploaded_file.name).name
+    path.write_bytes(uploaded_file.getvalue())
+    return doc_index.ingest(path)
 
 
 def list_uploaded_pdfs():
-    return []
+    return sorted(doc_index.get_index().documents().items(), key=lambda item: item[1]["added"])
+
+
+def render_reference_docs():
+    st.subheader("Reference documents")
+    st.caption("Teacher answers are grounded in the most relevant passages.")
+    uploads = st.file_uploader(
+        "Upload PDFs", type=["pdf", "txt", "md"], accept_multiple_files=True, key="reference_uploads",
+    )
+    ingested = st.session_state.setdefault("ingested_uploads", set())
+    for uploaded in uploads or []:
+        if uploaded.file_id in ingested:
+            continue
+        try:
+            with st.spinner(f"Indexing {uploaded.name}..."):
+                save_uploaded_pdf(uploaded)
+        except Exception as exc:
+            st.error(f"Could not index {uploaded.name}: {exc}")
+        ingested.add(uploaded.file_id)
+    for doc_id, doc in list_uploaded_pdfs():
+        name_col, remove_col = st.columns([4, 1])
+        name_col.caption(f"{doc['name']} · {doc['pages']} pages · {doc['chunks']} chunks")
+        if remove_col.button("✕", key=f"remove_doc_{doc_id}", help="Remove from the index"):
+            doc_index.get_index().remove(doc_id)
+            (UPLOAD_DIR / doc["name"]).unlink(missing_ok=True)
+            st.rerun()
+
+
+def release_topic():
+    """Stop this session's conversation so it spends no more LLM calls once it is dropped."""
+    if st.session_state.get("topic_id"):
+        get_worker().forget(st.session_state.topic_id)
 
 
 def reset_session_state():
+    release_topic()
     st.session_state.topic_id = None
     st.session_state.topic = ""
-    st.session_state.max_turns = 6
+    st.session_state.max_turns = default_max_turns()
     st.session_state.turn_count = 0
     st.session_state.stop_requested = False
     st.session_state.auto_run = False
     st.session_state.status = "idle"
     st.session_state.manual_mode = False
     st.session_state.selected_topic_id = None
+    st.session_state.last_error = ""
+    st.session_state.saved_calls = 0
 
 
 def start_topic(topic: str, max_turns: int, manual_mode: bool = False):
     ensure_topic_store()
     ensure_memory_store()
-    st.session_state.topic_id = create_topic(topic, max_turns)
+    release_topic()
+    st.session_state.topic_id = get_worker().start(topic, max_turns, manual_mode=manual_mode)
     st.session_state.topic = topic
     st.session_state.max_turns = max_turns
-    st.session_state.turn_count = 0
-    st.session_state.stop_requested = False
-    st.session_state.auto_run = not manual_mode
-    st.session_state.status = "running"
     st.session_state.manual_mode = manual_mode
-
-    student_prompt = read_prompt(STUDENT_PROMPT_FILE)
-    student_msg = call_llm([
-        {"role": "system", "content": student_prompt},
-        {"role": "user", "content": f"Ask a question about this topic: {topic}"},
-    ])
-    add_message(st.session_state.topic_id, "student", student_msg)
-    update_memory("student", student_msg)
-    st.session_state.turn_count += 1
+    sync_from_worker()
 
 
-def process_next_turn():
-    if st.session_state.stop_requested:
-        st.session_state.auto_run = False
-        st.session_state.status = "stopped"
-        return
+def render_live_updates(topic_id: str, base: int, was_running: bool):
+    """Messages stored after the page was built, plus the reply being streamed.
 
-    if st.session_state.turn_count >= st.session_state.max_turns:
-        st.session_state.auto_run = False
-        st.session_state.status = "complete"
-        return
+    Runs as a polling fragment, so each tick only re-sends this tail rather
+    than the whole conversation.
+    """
+    snap = get_worker().snapshot(topic_id) or {}
+    # Only what was stored after the page's last rendered message.
+    new_messages, _ = load_topic_messages(topic_id, base)
+    if len(new_messages) >= CHAT_PAGE_SIZE:
+        # Fold the tail into the paginated history so this stays small.
+        st.rerun()
+    render_messages(new_messages)
+    if snap.get("partial_text"):
+        chat_bubble(snap["partial_role"]).markdown(snap["partial_text"] + " ▌")
+    turn_count = snap.get("turn_count", st.session_state.turn_count)
+    st.caption(f"Turn {turn_count}/{st.session_state.max_turns}")
+    if was_running and not snap.get("busy"):
+        # The conversation just went idle: refresh the whole page once so the
+        # status strip updates and polling stops.
+        st.rerun()
 
-    teacher_prompt = read_prompt(TEACHER_PROMPT_FILE)
-    student_prompt = read_prompt(STUDENT_PROMPT_FILE)
-    topic_id = st.session_state.topic_id
 
-    # Teacher responds to last student
-    teacher_msg = call_llm([
-        {"role": "system", "content": teacher_prompt},
-        {"role": "user", "content": get_last_student(topic_id)},
-    ])
-    add_message(topic_id, "teacher", teacher_msg)
-    update_memory("teacher", teacher_msg)
-    st.session_state.turn_count += 1
-
-    if st.session_state.turn_count >= st.session_state.max_turns or st.session_state.stop_requested:
-        st.session_state.auto_run = False
-        st.session_state.status = "complete"
+def format_seconds(value):
+    if value is None:
+        return "–"
+    return f"{value * 1000:.0f} ms" if value < 1 else f"{value:.2f} s"
+
+
+def render_metrics_panel():
+    summary = metrics.get_metrics().summary()
+    with st.expander("LLM metrics", expanded=False):
+        c1, c2 = st.columns(2)
+        c1.metric("Calls", summary["calls"])
+        c2.metric("Error rate", f"{summary['error_rate']:.0%}")
+        c1.metric("Latency p50", format_seconds(summary["latency_p50"]))
+        c2.metric("First token p50", format_seconds(summary["ttft_p50"]))
+        st.caption(
+            f"p95 latency {format_seconds(summary['latency_p95'])} · "
+            f"tokens {summary['prompt_tokens']} in / {summary['completion_tokens']} out · "
+            f"cache hits {summary['cache_hits']}"
+        )
+        if summary["stalls"]:
+            st.caption(f"Repeating conversations: {summary['stalls']} · LLM calls saved {summary['saved_calls']}")
+        for role, counts in sorted(summary["by_role"].items()):
+            st.caption(f"{role}: {counts['calls']} calls, {counts['errors']} errors")
+        st.caption(" · ".join(f"{role} → {', '.join(routing.route(role))}" for role in ("student", "teacher")))
+        for model, health in routing.get_health().snapshot().items():
+            if health["cooldown_seconds"]:
+                st.caption(f"{model}: skipped for {health['cooldown_seconds']:.0f} s ({health['reason']})")
+        if summary["failovers"]:
+            st.caption(f"Failovers to a backup model: {summary['failovers']}")
+        for priority, queue in summary["queue"].items():
+            st.caption(
+                f"{priority} queue: {queue['waiting']} waiting · wait p50 {format_seconds(queue['wait_p50'])}, "
+                f"p95 {format_seconds(queue['wait_p95'])}"
+            )
+        for model, limits in scheduler.get_scheduler().stats()["models"].items():
+            if limits["tokens_limit"] is not None:
+                st.caption(
+                    f"{model}: {limits['tokens_remaining']}/{limits['tokens_limit']} tokens, "
+                    f"{limits['requests_remaining']}/{limits['requests_limit']} requests left"
+                )
+        server = start_metrics_server()
+        if server is not None:
+            st.caption(f"Prometheus: http://localhost:{server.server_port}/metrics (JSON: /metrics.json)")
+
+
+def format_topic_label(entry) -> str:
+    when = datetime.fromtimestamp(entry["last_activity"]).strftime("%b %d %H:%M") if entry["last_activity"] else "—"
+    archived = " · archived" if entry.get("archived") else ""
+    return f"{entry['topic']} ({entry['topic_id'][:8]}) · {entry['turns']} msgs · {when}{archived}"
+
+
+def open_search_hit(hit):
+    """Show the hit's topic with enough chat pages loaded to include the matching message."""
+    topic_id = hit["topic_id"]
+    view = "live" if topic_id == st.session_state.topic_id else "past"
+    pages_key = f"chat_pages_{view}_{topic_id}"
+    needed = -(-(hit["turns"] - hit["position"]) // CHAT_PAGE_SIZE)
+    st.session_state[pages_key] = max(st.session_state.get(pages_key, 1), needed)
+    st.session_state.selected_topic_id = topic_id
+    st.session_state.topic_select = None
+
+
+def render_search():
+    query = st.text_input("Search conversations", key="search_query", placeholder="e.g. photosynthesis")
+    if not query.strip():
         return
-
-    # Student follow-up
-    student_msg = call_llm([
-        {"role": "system", "content": student_prompt},
-        {"role": "user", "content": teacher_msg},
-    ])
-    add_message(topic_id, "student", student_msg)
-    update_memory("student", student_msg)
-    st.session_state.turn_count += 1
-
-    if st.session_state.turn_count >= st.session_state.max_turns:
-        st.session_state.auto_run = False
-        st.session_state.status = "complete"
+    hits = search_messages(query, SEARCH_RESULTS)
+    if not hits:
+        st.caption("No matching messages.")
+        return
+    for i, hit in enumerate(hits):
+        archived = " · archived" if hit.get("archived") else ""
+        st.markdown(f"**{hit['topic']}** · {hit['role']} · message {hit['position'] + 1}/{hit['turns']}{archived}")
+        st.caption(hit["snippet"])
+        st.button("Open", key=f"search_hit_{i}", on_click=open_search_hit, args=(hit,))
 
 
 def render_memory_viewer():
@@ -330,19 +473,44 @@ with st.sidebar:
     st.session_state.dark_mode_active = dark_mode
     apply_theme(dark_mode)
 
+    render_search()
+
     st.subheader("Topic history")
     st.caption("Re-open or delete a previous topic. Messages show in read-only mode.")
-    topics_data = load_topics()
-    topic_options = {t["topic"] + " (" + t["topic_id"][:8] + ")": t["topic_id"] for t in topics_data.get("topics", [])}
-    selected_label = st.selectbox("Select topic", options=["<none>"] + list(topic_options.keys()))
-    if selected_label != "<none>":
-        st.session_state.selected_topic_id = topic_options[selected_label]
+    # Only the catalog page is read here, never the messages.
+    entries, total = list_topics(st.session_state.topic_page, TOPIC_PAGE_SIZE)
+    page_count = max(1, -(-total // TOPIC_PAGE_SIZE))
+    if st.session_state.topic_page >= page_count:
+        st.session_state.topic_page = page_count - 1
+        st.rerun()
+    labels = {e["topic_id"]: format_topic_label(e) for e in entries}
+    selected = st.selectbox(
+        "Select topic",
+        options=[None] + list(labels),
+        format_func=lambda topic_id: "<none>" if topic_id is None else labels[topic_id],
+        key="topic_select",
+    )
+    if page_count > 1:
+        prev_col, info_col, next_col = st.columns([1, 2, 1])
+        if prev_col.button("◀", disabled=st.session_state.topic_page == 0, key="topic_prev"):
+            st.session_state.topic_page -= 1
+            st.rerun()
+        info_col.caption(f"Page {st.session_state.topic_page + 1}/{page_count} · {total} topics")
+        if next_col.button("▶", disabled=st.session_state.topic_page >= page_count - 1, key="topic_next"):
+            st.session_state.topic_page += 1
+            st.rerun()
+    if selected is not None:
+        st.session_state.selected_topic_id = selected
         if st.button("Delete selected topic"):
             delete_topic(st.session_state.selected_topic_id)
             st.session_state.selected_topic_id = None
             st.rerun()
 
     st.divider()
+    render_reference_docs()
+
+    st.divider()
+    render_metrics_panel()
     st.caption("Live mode toggles are in the main area.")
 
 # Main inputs
@@ -370,33 +538,31 @@ with st.container():
             start_topic(topic_text.strip(), int(max_turns), manual_mode=st.session_state.manual_mode)
             st.rerun()
 
-    if stop_clicked:
-        st.session_state.stop_requested = True
-        st.session_state.auto_run = False
-        st.session_state.status = "stopped"
+    if stop_clicked and st.session_state.topic_id:
+        get_worker().stop(st.session_state.topic_id)
 
     if reset_clicked:
         reset_session_state()
         st.rerun()
 
     if step_clicked and st.session_state.topic_id:
-        st.session_state.auto_run = False
-        st.session_state.stop_requested = False
-        process_next_turn()
+        get_worker().step(st.session_state.topic_id)
         st.rerun()
 
     if resume_clicked and st.session_state.topic_id:
-        st.session_state.stop_requested = False
-        st.session_state.auto_run = True
-        st.session_state.status = "running"
+        get_worker().resume(st.session_state.topic_id)
         st.rerun()
 
+live_snapshot = sync_from_worker()
+
 # Status and context strip
 status_colors = {
     "idle": "#6c757d",
     "running": "#198754",
     "stopped": "#dc3545",
     "complete": "#0d6efd",
+    "error": "#fd7e14",
+    "stalled": "#6f42c1",
 }
 
 with st.container(border=True):
@@ -410,31 +576,35 @@ with st.container(border=True):
         mode = "Manual" if st.session_state.manual_mode else "Auto"
         st.markdown(f"**Active topic:** {topic_label} &nbsp;|&nbsp; **Mode:** {mode}")
 
-st.info("Tip: keep max turns modest (6-10) for quicker iterations. You can stop or step manually anytime.")
+if st.session_state.status == "error" and st.session_state.last_error:
+    st.error(f"LLM request failed: {st.session_state.last_error}. Use Step once or Resume auto to retry.")
+if st.session_state.status == "stalled":
+    st.warning(
+        f"Stopped early: the student kept asking the same question "
+        f"({st.session_state.saved_calls} LLM calls saved). Resume auto to continue anyway."
+    )
 
-# Auto-run loop (one iteration per rerun)
-if st.session_state.auto_run and st.session_state.topic_id:
-    process_next_turn()
-    if st.session_state.auto_run:
-        st.rerun()
+st.info("Tip: keep max turns modest (6-10) for quicker iterations. You can stop or step manually anytime.")
 
-# Display current conversation
+# Display current conversation: the newest page of stored messages, then a
+# fragment that polls for the live tail while the worker is busy.
 if st.session_state.topic_id:
-    st.subheader(f"Live conversation (turn {st.session_state.turn_count}/{st.session_state.max_turns})")
+    topic_id = st.session_state.topic_id
+    st.subheader("Live conversation")
     st.caption("Real-time exchange between student and teacher for the active topic.")
-    msgs = load_topic_messages(st.session_state.topic_id)
-    render_chat(msgs)
-
-# Typing animation for the latest message
-    if msgs:
-        anim_spot = st.empty()
-        typing_animation(anim_spot, msgs[-1]["message"][:400], delay=0.005)
+    total = render_chat(topic_id, key=f"live_{topic_id}")
+    running = bool(live_snapshot and live_snapshot["busy"])
+    live_view = st.fragment(run_every=LIVE_POLL_SECONDS if running else None)(render_live_updates)
+    live_view(topic_id, total, running)
+    if total and not running:
+        render_downloads(topic_id, key=f"live_{topic_id}")
 
 # Past conversation view (read-only)
 if st.session_state.selected_topic_id and st.session_state.selected_topic_id != st.session_state.topic_id:
     st.subheader("Past conversation")
     st.caption("Selected topic from history; read-only view.")
-    render_chat(load_topic_messages(st.session_state.selected_topic_id))
+    render_chat(st.session_state.selected_topic_id, key=f"past_{st.session_state.selected_topic_id}")
+    render_downloads(st.session_state.selected_topic_id, key=f"past_{st.session_state.selected_topic_id}")
 
 st.info("Run with: streamlit run app.py")
 
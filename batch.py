@@ -0,0 +1,197 @@
+"""Headless bulk conversation generation.
+
+Reads one topic per line from a file (or ``-`` for stdin), runs the
+conversations concurrently and appends each finished transcript as one
+JSON line to the output file:
+
+    python batch.py topics.txt -o transcripts.jsonl --concurrency 8 --max-turns 6
+
+Every reply is checkpointed to ``<output>.ckpt/<key>.json`` as soon as it
+arrives. Rerunning the same command after a crash or Ctrl-C skips topics
+already in the output and resumes the others from their last checkpointed
+message, so no finished LLM call is repeated. A topic's key is derived from
+its line position and text, so keep the input file unchanged between runs.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from core import metrics
+from core.config import max_turns as default_max_turns
+from core.routing import route
+from core.http_client import close_async_client
+from core.runner import DEFAULT_CONCURRENCY, arun_topic, load_prompts
+from utils.file_lock import atomic_write_json
+
+
+def read_topics(source):
+    """Non-empty, non-comment lines of ``source`` (a path or ``-`` for stdin)."""
+    if source == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        lines = Path(source).read_text(encoding="utf-8").splitlines()
+    topics = [line.strip() for line in lines]
+    return [t for t in topics if t and not t.startswith("#")]
+
+
+def topic_key(index, topic):
+    return hashlib.sha1(f"{index}\0{topic}".encode("utf-8")).hexdigest()[:16]
+
+
+def finished_keys(output):
+    """Keys already written to ``output``; a torn last line from a crash is cut off."""
+    keys = set()
+    if not output.exists():
+        return keys
+    with open(output, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            keys.add(json.loads(line)["key"])
+        except (ValueError, KeyError):
+            continue
+    return keys
+
+
+def models_used(history):
+    """{role: [models that answered, in order of first use]} for a conversation.
+
+    Messages from checkpoints written before models were recorded fall
+    back to the role's primary model.
+    """
+    models = {}
+    for msg in history:
+        model = msg.get("model") or route(msg["role"])[0]
+        used = models.setdefault(msg["role"], [])
+        if model not in used:
+            used.append(model)
+    return models
+
+
+class BatchRun:
+    def __init__(self, output, checkpoint_dir, max_turns, concurrency):
+        self.output = Path(output)
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.max_turns = max_turns
+        self.concurrency = concurrency
+        self.done = 0
+        self.failed = []
+        self.llm_calls = 0
+        self.saved_calls = 0
+
+    def _checkpoint_path(self, key):
+        return self.checkpoint_dir / f"{key}.json"
+
+    def load_checkpoint(self, key):
+        try:
+            return json.loads(self._checkpoint_path(key).read_text(encoding="utf-8"))["messages"]
+        except (OSError, ValueError, KeyError):
+            return []
+
+    def _on_message(self, key, topic, history):
+        def record(state, role, message):
+            atomic_write_json(self._checkpoint_path(key), {
+                "key": key,
+                "topic": topic,
+                "messages": history,
+            }, indent=None)
+        return record
+
+    def _write_result(self, out, key, index, topic, state, history):
+        out.write(json.dumps({
+            "key": key,
+            "index": index,
+            "topic": topic,
+            "models": models_used(history),
+            "max_turns": self.max_turns,
+            "status": state.status,
+            "turns": len(history),
+            "messages": history,
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+        }, ensure_ascii=False) + "\n")
+        out.flush()
+        os.fsync(out.fileno())
+        try:
+            self._checkpoint_path(key).unlink()
+        except OSError:
+            pass
+
+    async def _run_one(self, out, semaphore, prompts, index, topic, key):
+        history = self.load_checkpoint(key)
+        try:
+            state = await arun_topic(
+                topic, self.max_turns, prompts, semaphore,
+                history=history, topic_id=key, on_message=self._on_message(key, topic, history),
+            )
+        except Exception as exc:
+            # The checkpoint stays behind, so the next run picks this topic up again.
+            self.failed.append((topic, exc))
+            print(f"[failed] {topic}: {exc}", file=sys.stderr)
+            return
+        self._write_result(out, key, index, topic, state, history)
+        self.done += 1
+        self.saved_calls += state.saved_calls
+        stalled = f", stalled, {state.saved_calls} calls saved" if state.status == "stalled" else ""
+        print(f"[done {self.done}] {topic} ({len(history)} messages{stalled})", file=sys.stderr)
+
+    async def run(self, topics):
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        skip = finished_keys(self.output)
+        pending = [(i, t, topic_key(i, t)) for i, t in enumerate(topics)]
+        pending = [p for p in pending if p[2] not in skip]
+        print(f"{len(topics)} topics, {len(topics) - len(pending)} already done, {len(pending)} to run", file=sys.stderr)
+
+        prompts = load_prompts()
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+        # Every request core.llm sent, summaries and failed attempts included.
+        calls_before = metrics.get_metrics().summary()["calls"]
+        with open(self.output, "a", encoding="utf-8") as out:
+            try:
+                await asyncio.gather(*(self._run_one(out, semaphore, prompts, i, t, k) for i, t, k in pending))
+            finally:
+                await close_async_client()
+                self.llm_calls = metrics.get_metrics().summary()["calls"] - calls_before
+        return pending
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate student/teacher conversations in bulk.")
+    parser.add_argument("topics", help="file with one topic per line, or - for stdin")
+    parser.add_argument("-o", "--output", default="transcripts.jsonl", help="JSONL file to append transcripts to")
+    parser.add_argument("--checkpoint-dir", help="default: <output>.ckpt")
+    parser.add_argument("--max-turns", type=int, default=None, help="default: MAX_TURNS from the config")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="conversations in flight")
+    args = parser.parse_args(argv)
+
+    batch = BatchRun(
+        args.output,
+        args.checkpoint_dir or f"{args.output}.ckpt",
+        args.max_turns or default_max_turns(),
+        args.concurrency,
+    )
+    start = time.perf_counter()
+    try:
+        asyncio.run(batch.run(read_topics(args.topics)))
+    except KeyboardInterrupt:
+        print("\nInterrupted; rerun the same command to resume.", file=sys.stderr)
+        return 130
+    print(
+        f"{batch.done} finished, {len(batch.failed)} failed, {batch.llm_calls} LLM calls "
+        f"({batch.saved_calls} saved by stopping repeating conversations) "
+        f"in {time.perf_counter() - start:.1f} s -> {args.output}",
+        file=sys.stderr,
+    )
+    return 1 if batch.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""Ingestion throughput and query latency of the document index.
+
+Builds a throwaway index from synthetic text documents in steps, checks
+that each new document only appends to it, then times top-k queries
+against the memory-mapped index. Exits non-zero when the p50 query time
+exceeds ``--budget-ms``.
+
+    python -m bench.bench_retrieval
+    python -m bench.bench_retrieval --docs 200 --words 20000 --budget-ms 50
+"""
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from utils.doc_index import DocIndex
+
+VOCABULARY = (
+    "energy light plant water cell orbit gravity mass force atom photon glucose river climate "
+    "market price vector matrix proof theorem poem rhythm history empire enzyme protein membrane "
+    "voltage current circuit magnet wave frequency entropy reaction acid base molecule genome"
+).split()
+
+
+def write_docs(workdir, docs, words, seed=7):
+    rng = random.Random(seed)
+    paths = []
+    for i in range(docs):
+        path = Path(workdir) / f"doc-{i:04d}.txt"
+        path.write_text(" ".join(rng.choice(VOCABULARY) + str(rng.randrange(200)) for _ in range(words)))
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark document ingestion and retrieval.")
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--words", type=int, default=8000, help="words per document")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--budget-ms", type=float, default=25.0, help="max p50 query latency")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-retrieval-")
+    paths = write_docs(workdir, args.docs, args.words)
+    index = DocIndex(Path(workdir) / "index")
+    failures = []
+
+    start = time.perf_counter()
+    chunks = 0
+    for path in paths:
+        before = index.meta()["rows"]
+        added = index.add(path)
+        if index.meta()["rows"] != before + added:
+            failures.append(f"{path.name} did not append incrementally")
+        chunks += added
+    ingest = time.perf_counter() - start
+    if index.add(paths[0]):
+        failures.append("re-adding an unchanged document re-indexed it")
+    print(f"ingested {args.docs} docs, {chunks} chunks in {ingest:.2f} s ({chunks / ingest:.0f} chunks/s)")
+
+    start = time.perf_counter()
+    index.search("warm up", args.k)
+    print(f"first query (maps the index, computes norms) {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    rng = random.Random(11)
+    samples = []
+    for _ in range(args.queries):
+        query = " ".join(rng.choice(VOCABULARY) + str(rng.randrange(200)) for _ in range(8))
+        start = time.perf_counter()
+        index.search(query, args.k)
+        samples.append((time.perf_counter() - start) * 1000)
+    p50 = statistics.median(samples)
+    print(f"query p50 {p50:.2f} ms  max {max(samples):.2f} ms over {chunks} chunks (dim {index.dim})")
+    if p50 > args.budget_ms:
+        failures.append(f"query p50 {p50:.2f} ms over budget {args.budget_ms:.0f} ms")
+
+    for failure in failures:
+        print("  FAIL", failure)
+    print("OK" if not failures else "FAILED")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
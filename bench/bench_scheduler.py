@@ -0,0 +1,116 @@
+"""Batch load against a rate-limited key, with interactive calls mixed in.
+
+Starts the mock LLM with Groq-style ``--rpm``/``--tpm`` limits, keeps it
+saturated from ``--batch-workers`` batch coroutines (one topic each) and
+sends one interactive call every ``--interactive-every`` seconds from
+another thread. Reports how much of the limit the batch used, how many
+requests the server rejected with 429 and how long interactive calls
+queued. Exits non-zero if any request was rejected beyond ``--max-429``
+or the interactive p95 wait exceeds ``--budget-ms``.
+
+    python -m bench.bench_scheduler
+    python -m bench.bench_scheduler --seconds 30 --rpm 600 --batch-workers 32
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from bench.mock_server import MockConfig, start_server  # noqa: E402
+
+MODEL = "mock-model"
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def batch_load(llm, workers, deadline, counts):
+    async def worker(i):
+        n = 0
+        while time.monotonic() < deadline:
+            n += 1
+            await llm.acall_llm([{"role": "user", "content": f"batch {i} question {n}"}], model=MODEL,
+                                use_cache=False, role="student", topic=f"batch-{i}", priority="batch",
+                                max_tokens=64)
+            counts["batch"] += 1
+
+    from core.http_client import close_async_client
+
+    try:
+        await asyncio.gather(*(worker(i) for i in range(workers)))
+    finally:
+        await close_async_client()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the rate-limit scheduler.")
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--rpm", type=int, default=240)
+    parser.add_argument("--tpm", type=int, default=30000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--batch-workers", type=int, default=16)
+    parser.add_argument("--interactive-every", type=float, default=0.5, help="seconds between interactive calls")
+    parser.add_argument("--max-429", type=int, default=0, help="rejected requests tolerated")
+    parser.add_argument("--budget-ms", type=float, default=250.0, help="max interactive p95 queue wait")
+    args = parser.parse_args()
+
+    config = MockConfig(latency=args.latency, rpm=args.rpm, tpm=args.tpm)
+    server, url = start_server(config)
+    os.environ.setdefault("GROQ_API_KEY", "mock")
+    import core.llm as llm
+    from core import metrics
+
+    llm.BASE_URL = url
+    counts = {"batch": 0}
+    deadline = time.monotonic() + args.seconds
+    batch = threading.Thread(target=lambda: asyncio.run(batch_load(llm, args.batch_workers, deadline, counts)))
+    start = time.monotonic()
+    batch.start()
+
+    interactive = []
+    while time.monotonic() < deadline:
+        time.sleep(args.interactive_every)
+        t0 = time.perf_counter()
+        llm.call_llm([{"role": "user", "content": f"interactive {len(interactive)}"}], model=MODEL,
+                     use_cache=False, role="teacher", topic="ui", priority="interactive", max_tokens=64)
+        interactive.append(time.perf_counter() - t0)
+    batch.join()
+    elapsed = time.monotonic() - start
+    server.shutdown()
+
+    served = config.requests - config.rate_limited
+    allowed = args.rpm + args.rpm * elapsed / 60   # a full bucket plus the refill
+    queue = metrics.get_metrics().summary()["queue"]
+    waits = {p: (q["wait_p50"] or 0.0, q["wait_p95"] or 0.0) for p, q in queue.items()}
+    i_p95 = percentile(interactive, 0.95)
+    print(f"{elapsed:.1f} s, limit {args.rpm} rpm / {args.tpm} tpm, {args.batch_workers} batch workers")
+    print(f"served {served} requests ({counts['batch']} batch, {len(interactive)} interactive), "
+          f"{served / allowed:.0%} of what the limit allowed; {config.rate_limited} rejected with 429")
+    print(f"interactive call p50 {statistics.median(interactive) * 1000:.0f} ms, p95 {i_p95 * 1000:.0f} ms")
+    for priority, (p50, p95) in sorted(waits.items()):
+        print(f"  {priority:<12} queue wait p50 {p50 * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms")
+
+    failures = []
+    if config.rate_limited > args.max_429:
+        failures.append(f"{config.rate_limited} requests rejected with 429 (max {args.max_429})")
+    interactive_wait = waits.get("interactive", (0.0, 0.0))[1]
+    if interactive_wait * 1000 > args.budget_ms:
+        failures.append(f"interactive p95 queue wait {interactive_wait * 1000:.0f} ms over {args.budget_ms:.0f} ms")
+    for failure in failures:
+        print("  FAIL", failure)
+    print("OK" if not failures else "FAILED")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
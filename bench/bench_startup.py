@@ -0,0 +1,110 @@
+"""Import-time budget for the entry points, plus Streamlit rerun overhead.
+
+Each module is imported in a fresh interpreter (best of ``--repeat`` runs)
+and must stay under its budget and keep heavy optional dependencies
+(requests, httpx, dotenv, customtkinter, numpy, pypdf) off its import
+path; those load when first used. Exits non-zero when a check fails, so
+it can gate CI.
+
+    python -m bench.bench_startup
+    python -m bench.bench_startup --scale 2 --reruns 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# module -> budget in milliseconds for a cold import on a warm disk cache
+IMPORT_BUDGETS_MS = {
+    "core.llm": 60,
+    "core.worker": 90,
+    "main": 70,
+    "batch": 150,
+}
+HEAVY_MODULES = ("requests", "httpx", "dotenv", "customtkinter", "tkinter", "numpy", "pypdf")
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+__import__({module!r})
+elapsed = time.perf_counter() - start
+print(json.dumps({{"ms": elapsed * 1000, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(module, repeat):
+    best = None
+    loaded = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        )
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        loaded = result["loaded"]
+        best = result["ms"] if best is None else min(best, result["ms"])
+    return best, loaded
+
+
+def measure_reruns(reruns):
+    """Mean wall time of an idle ``app.py`` rerun under Streamlit's AppTest."""
+    from streamlit.testing.v1 import AppTest
+
+    workdir = tempfile.mkdtemp(prefix="bench-startup-")
+    previous = os.getcwd()
+    os.chdir(workdir)
+    try:
+        at = AppTest.from_file(str(REPO_ROOT / "app.py"), default_timeout=60)
+        start = time.perf_counter()
+        at.run()
+        first = time.perf_counter() - start
+        samples = []
+        for _ in range(reruns):
+            start = time.perf_counter()
+            at.run()
+            samples.append(time.perf_counter() - start)
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+    finally:
+        os.chdir(previous)
+    return first, statistics.mean(samples), statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check import-time budgets of the entry points.")
+    parser.add_argument("--repeat", type=int, default=5, help="imports per module; the best run counts")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every budget (slow machines)")
+    parser.add_argument("--reruns", type=int, default=10, help="idle app.py reruns to time (0 skips)")
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'module':<14} {'import':>10} {'budget':>10}")
+    for module, budget in IMPORT_BUDGETS_MS.items():
+        ms, loaded = measure_import(module, args.repeat)
+        limit = budget * args.scale
+        flag = "" if ms <= limit else "  OVER"
+        print(f"{module:<14} {ms:8.1f} ms {limit:7.0f} ms{flag}")
+        if ms > limit:
+            failures.append(f"{module} imports in {ms:.1f} ms (budget {limit:.0f} ms)")
+        if loaded:
+            failures.append(f"{module} eagerly imports {', '.join(loaded)}")
+
+    if args.reruns:
+        first, mean, median = measure_reruns(args.reruns)
+        print(f"\napp.py first run {first * 1000:.0f} ms, rerun mean {mean * 1000:.1f} ms, median {median * 1000:.1f} ms")
+
+    for failure in failures:
+        print("  FAIL", failure)
+    print("OK" if not failures else "FAILED")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
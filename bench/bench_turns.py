@@ -0,0 +1,277 @@
+"""Benchmark the conversation turn loop against the offline mock LLM.
+
+Drives ``main.run_conversation``, the Streamlit app's conversation worker
+(through Streamlit's headless ``AppTest``) and the storage helpers, and reports
+turns/sec, p50/p99 per-turn latency and how the wall time splits between
+the network (LLM calls) and storage.
+
+    python -m bench.bench_turns --turns 10 --latency 0.05 --tokens-per-sec 500
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from bench.mock_server import MockConfig, start_server  # noqa: E402
+
+
+class Recorder:
+    """Accumulates time per category and timestamps each stored message."""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.commits = []
+
+    def wrap(self, category, fn, commit=False):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                self.totals[category] += time.perf_counter() - start
+                if commit:
+                    self.commits.append(time.perf_counter())
+            if not isinstance(result, (str, bytes, dict, list, type(None))) and hasattr(result, "__next__"):
+                return self._timed_iter(category, result)
+            return result
+        return timed
+
+    def _timed_iter(self, category, iterator):
+        # Streaming calls return immediately; the network time is spent
+        # while the caller pulls tokens.
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.totals[category] += time.perf_counter() - start
+                return
+            self.totals[category] += time.perf_counter() - start
+            yield item
+
+
+@contextlib.contextmanager
+def patched(obj, name, value):
+    original = getattr(obj, name)
+    setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        setattr(obj, name, original)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+
+def summarize(name, recorder, start, end):
+    wall = end - start
+    marks = [start] + recorder.commits
+    latencies = [b - a for a, b in zip(marks, marks[1:])]
+    network = recorder.totals["network"]
+    storage = recorder.totals["storage"]
+    return {
+        "scenario": name,
+        "turns": len(recorder.commits),
+        "wall_s": wall,
+        "turns_per_sec": len(recorder.commits) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "network_s": network,
+        "storage_s": storage,
+        "other_s": max(0.0, wall - network - storage),
+    }
+
+
+def bench_run_conversation(turns, runs):
+    import core.llm as llm
+    import main
+    import utils.memory_manager as memory_manager
+
+    rec = Recorder()
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(patched(main, "MAX_TURNS", turns))
+        stack.enter_context(patched(main, "call_llm", rec.wrap("network", main.call_llm)))
+        # Summaries of older turns go through core.llm directly.
+        stack.enter_context(patched(llm, "call_llm", rec.wrap("network", llm.call_llm)))
+        stack.enter_context(patched(main, "append_message", rec.wrap("storage", main.append_message, commit=True)))
+        stack.enter_context(patched(main, "get_turn_count", rec.wrap("storage", main.get_turn_count)))
+        stack.enter_context(patched(main, "messages_since", rec.wrap("storage", main.messages_since)))
+        start = time.perf_counter()
+        for i in range(runs):
+            memory_manager.save_memory({"conversation": []})
+            with contextlib.redirect_stdout(io.StringIO()):
+                main.run_conversation(f"benchmark topic {i}")
+        end = time.perf_counter()
+    return summarize("main.run_conversation", rec, start, end)
+
+
+def bench_process_next_turn(turns, runs):
+    from streamlit.testing.v1 import AppTest
+
+    import core.llm as llm
+    import utils.memory_manager as memory_manager
+    import utils.topic_manager as topic_manager
+
+    rec = Recorder()
+    with contextlib.ExitStack() as stack:
+        # The conversation worker looks these up on the modules for every
+        # turn, so patching the modules is enough to time its calls.
+        stack.enter_context(patched(llm, "call_llm", rec.wrap("network", llm.call_llm)))
+        stack.enter_context(patched(topic_manager, "add_message", rec.wrap("storage", topic_manager.add_message, commit=True)))
+        stack.enter_context(patched(topic_manager, "create_topic", rec.wrap("storage", topic_manager.create_topic)))
+        stack.enter_context(patched(topic_manager, "list_topics", rec.wrap("storage", topic_manager.list_topics)))
+        stack.enter_context(patched(topic_manager, "get_topic_messages", rec.wrap("storage", topic_manager.get_topic_messages)))
+        stack.enter_context(patched(memory_manager, "append_message", rec.wrap("storage", memory_manager.append_message)))
+        start = time.perf_counter()
+        for i in range(runs):
+            at = AppTest.from_file(str(REPO_ROOT / "app.py"), default_timeout=120)
+            with contextlib.redirect_stdout(io.StringIO()):
+                at.run()
+                at.text_input[0].input(f"benchmark topic {i}")
+                at.number_input[0].set_value(turns)
+                at.button[0].click().run()
+                # Turns advance on the worker thread; rerun to poll its state.
+                while at.session_state.auto_run:
+                    time.sleep(0.01)
+                    at.run()
+            if at.exception:
+                raise RuntimeError(at.exception[0].value)
+        end = time.perf_counter()
+    return summarize("app + conversation worker", rec, start, end)
+
+
+SEED_WORDS = (
+    "energy light plants water cell orbit gravity mass force atom photon glucose "
+    "river climate market price vector matrix proof theorem poem rhythm history empire"
+).split()
+
+
+def seed_text(n):
+    """Deterministic ~60-word message so search has a realistic vocabulary to rank."""
+    words = [SEED_WORDS[(n * 7 + i * i) % len(SEED_WORDS)] for i in range(60)]
+    words[n % 60] = f"photo{n % 50}"
+    return " ".join(words)
+
+
+def bench_storage(topics, messages_per_topic, samples):
+    import utils.memory_manager as memory_manager
+    import utils.topic_manager as topic_manager
+
+    memory_manager.save_memory({"conversation": [
+        {"role": "student", "message": "x" * 200, "turn": i + 1, "time": ""}
+        for i in range(topics * messages_per_topic)
+    ]})
+    topic_manager.save_topics({"topics": [
+        {"topic_id": f"seed-{t}", "topic": f"seed {t}", "max_turns": messages_per_topic,
+         "messages": [{"role": "teacher", "message": seed_text(t * messages_per_topic + i), "time": ""}
+                      for i in range(messages_per_topic)]}
+        for t in range(topics)
+    ]})
+    target = f"seed-{topics - 1}"
+
+    results = {}
+    for name, call in {
+        "topic_manager.add_message": lambda: topic_manager.add_message(target, "student", "z" * 200),
+        "topic_manager.get_topic_messages": lambda: topic_manager.get_topic_messages(target),
+        "topic_manager.load_topics": topic_manager.load_topics,
+        # The sidebar catalog page, straight from the backend (no cache).
+        "backend.list_topics": lambda: topic_manager.get_backend().list_topics(0, 20),
+        # Full-text search, uncached: a common word, a rare pair and a typed prefix.
+        "backend.search common": lambda: topic_manager.get_backend().search("energy", 10),
+        "backend.search rare": lambda: topic_manager.get_backend().search("glucose orbit", 10),
+        "backend.search prefix": lambda: topic_manager.get_backend().search("photo4", 10),
+        "memory_manager.append_message": lambda: memory_manager.append_message("student", "z" * 200),
+        "memory_manager.get_turn_count": memory_manager.get_turn_count,
+    }.items():
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - start)
+        results[name] = {"p50_ms": percentile(timings, 50) * 1000, "p99_ms": percentile(timings, 99) * 1000}
+    backend = topic_manager.get_backend().name
+    return {"scenario": f"storage, {backend} topics ({topics} topics x {messages_per_topic} msgs)", "calls": results}
+
+
+def print_report(results):
+    for result in results:
+        print(f"\n== {result['scenario']}")
+        if "calls" in result:
+            for name, stats in result["calls"].items():
+                print(f"  {name:<34} p50 {stats['p50_ms']:8.2f} ms   p99 {stats['p99_ms']:8.2f} ms")
+            continue
+        print(f"  turns {result['turns']}  wall {result['wall_s']:.2f} s  {result['turns_per_sec']:.2f} turns/s")
+        print(f"  per-turn latency p50 {result['p50_ms']:.1f} ms  p99 {result['p99_ms']:.1f} ms")
+        print(f"  network {result['network_s']:.2f} s  storage {result['storage_s']:.2f} s  other {result['other_s']:.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the turn loop against the mock LLM server.")
+    parser.add_argument("--turns", type=int, default=10, help="max turns per conversation")
+    parser.add_argument("--runs", type=int, default=3, help="conversations per scenario")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0)
+    parser.add_argument("--reply-tokens", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--storage-topics", type=int, default=500)
+    parser.add_argument("--storage-messages", type=int, default=10)
+    parser.add_argument("--storage-samples", type=int, default=50)
+    parser.add_argument("--scenarios", default="main,app,storage")
+    parser.add_argument("--json", dest="json_out", help="also write the results to this file")
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.tokens_per_sec, args.reply_tokens, args.error_rate)
+    server, url = start_server(config)
+    os.environ["LLM_BASE_URL"] = url
+    os.environ.setdefault("GROQ_API_KEY", "mock")
+
+    # Run in a scratch directory so the benchmark never touches real data/.
+    workdir = tempfile.mkdtemp(prefix="bench-turns-")
+    shutil.copytree(REPO_ROOT / "agents", Path(workdir) / "agents")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import core.llm as llm
+
+        llm.BASE_URL = url
+        scenarios = set(args.scenarios.split(","))
+        results = []
+        if "main" in scenarios:
+            results.append(bench_run_conversation(args.turns, args.runs))
+        if "app" in scenarios:
+            results.append(bench_process_next_turn(args.turns, args.runs))
+        if "storage" in scenarios:
+            results.append(bench_storage(args.storage_topics, args.storage_messages, args.storage_samples))
+    finally:
+        if "utils.memory_manager" in sys.modules:
+            # Write-behind data belongs to the scratch directory.
+            sys.modules["utils.memory_manager"].flush_memory()
+        os.chdir(cwd)
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"mock server: {config.requests} requests, {config.errors} injected errors")
+    print_report(results)
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
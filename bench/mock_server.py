@@ -0,0 +1,201 @@
+"""Offline stand-in for the Groq ``/openai/v1/chat/completions`` endpoint.
+
+Speaks the same request/response shapes as the real API, including SSE
+streaming, with configurable latency, token rate and error injection so
+the project's own overhead can be measured without the network. With
+``--rpm``/``--tpm`` it also enforces Groq-style rate limits: every
+response carries ``x-ratelimit-*`` headers and requests over the limit get
+a 429 with ``Retry-After``.
+
+    python -m bench.mock_server --port 8765 --latency 0.2 --tokens-per-sec 300
+    LLM_BASE_URL=http://127.0.0.1:8765/openai/v1/chat/completions streamlit run app.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETIONS_PATH = "/openai/v1/chat/completions"
+WORDS = (
+    "energy force motion light atom cell wave orbit field charge example "
+    "imagine because therefore simple question why how what really"
+).split()
+
+
+class MockConfig:
+    def __init__(self, latency=0.0, tokens_per_sec=0.0, reply_tokens=40, error_rate=0.0,
+                 error_status=429, retry_after=0.0, seed=None, rpm=0, tpm=0):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        # kind -> [limit per minute, level, last refill]; refilled continuously.
+        self.limits = {kind: [limit, float(limit), time.monotonic()]
+                       for kind, limit in (("requests", rpm), ("tokens", tpm)) if limit}
+
+    def roll_error(self):
+        with self.lock:
+            self.requests += 1
+            failed = self.error_rate > 0 and self.random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            return failed
+
+    def charge(self, tokens):
+        """Take one request and ``tokens`` from the limits; returns (headers, seconds to wait or 0)."""
+        headers, wait = {}, 0.0
+        with self.lock:
+            now = time.monotonic()
+            for kind, state in self.limits.items():
+                limit, level, last = state
+                state[1] = level = min(limit, level + (now - last) * limit / 60)
+                state[2] = now
+                need = 1 if kind == "requests" else tokens
+                if level < need:
+                    wait = max(wait, (need - level) * 60 / limit)
+            if wait:
+                self.rate_limited += 1
+            else:
+                for kind, state in self.limits.items():
+                    state[1] -= 1 if kind == "requests" else tokens
+            for kind, (limit, level, _) in self.limits.items():
+                headers[f"x-ratelimit-limit-{kind}"] = str(limit)
+                headers[f"x-ratelimit-remaining-{kind}"] = str(max(0, int(level)))
+                headers[f"x-ratelimit-reset-{kind}"] = f"{(limit - level) * 60 / limit:.2f}s"
+        return headers, wait
+
+    def reply_words(self, messages):
+        last = messages[-1].get("content", "") if messages else ""
+        rng = random.Random(zlib.crc32(last.encode("utf-8")))
+        return [rng.choice(WORDS) for _ in range(self.reply_tokens)]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without TCP_NODELAY the
+    # client's delayed ACK adds ~40 ms to every keep-alive request.
+    disable_nagle_algorithm = True
+    config = MockConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path != COMPLETIONS_PATH:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        cfg = self.config
+        if cfg.latency:
+            time.sleep(cfg.latency)
+        if cfg.roll_error():
+            headers = {"Retry-After": str(cfg.retry_after)} if cfg.error_status == 429 else {}
+            self._send_json(cfg.error_status, {"error": {"message": "injected failure"}}, headers)
+            return
+
+        model = request.get("model", "mock")
+        words = cfg.reply_words(request.get("messages", []))
+        usage = {
+            "prompt_tokens": sum(len(m.get("content", "").split()) for m in request.get("messages", [])),
+            "completion_tokens": len(words),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        delay = 1.0 / cfg.tokens_per_sec if cfg.tokens_per_sec else 0.0
+        limit_headers, wait = cfg.charge(usage["total_tokens"])
+        if wait:
+            limit_headers["Retry-After"] = f"{wait:.2f}"
+            self._send_json(429, {"error": {"message": "rate limit reached"}}, limit_headers)
+            return
+
+        if not request.get("stream"):
+            time.sleep(delay * len(words))
+            self._send_json(200, {
+                "id": "mock",
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            }, limit_headers)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in limit_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        for i, word in enumerate(words):
+            if delay:
+                time.sleep(delay)
+            chunk = {"id": "mock", "object": "chat.completion.chunk", "model": model,
+                     "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}}]}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        final = {"id": "mock", "object": "chat.completion.chunk", "model": model,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                 "x_groq": {"usage": usage}}
+        self._write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """Start the mock server on a daemon thread; returns ``(server, base_url)``."""
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"config": config or MockConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}{COMPLETIONS_PATH}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first byte")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="0 means unthrottled")
+    parser.add_argument("--reply-tokens", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--retry-after", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute, 0 means unlimited")
+    parser.add_argument("--tpm", type=int, default=0, help="tokens per minute, 0 means unlimited")
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.tokens_per_sec, args.reply_tokens,
+                        args.error_rate, args.error_status, args.retry_after, rpm=args.rpm, tpm=args.tpm)
+    server, url = start_server(config, args.host, args.port)
+    print(f"Mock LLM listening on {url} (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
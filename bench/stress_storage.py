@@ -0,0 +1,96 @@
+"""Multi-process stress test for the topic and shared-memory stores.
+
+Starts many writer processes that append to the same topic and to the
+shared conversation at once, then checks that no message was lost or
+duplicated and that no file was corrupted. Exits non-zero on failure.
+
+    python -m bench.stress_storage --procs 8 --messages 50 --backend json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _writer(workdir, backend, topic_id, worker, messages, memory_sync):
+    os.chdir(workdir)
+    sys.path.insert(0, str(REPO_ROOT))
+    os.environ["TOPIC_BACKEND"] = backend
+    os.environ["MEMORY_SYNC"] = "1" if memory_sync else ""
+    from utils import memory_manager, topic_manager
+
+    for i in range(messages):
+        topic_manager.add_message(topic_id, "student", f"w{worker}-m{i}")
+        memory_manager.append_message("student", f"w{worker}-m{i}")
+    memory_manager.flush_memory()
+
+
+def run(procs, messages, backend, memory_sync):
+    workdir = tempfile.mkdtemp(prefix="stress-storage-")
+    os.chdir(workdir)
+    os.environ["TOPIC_BACKEND"] = backend
+    sys.path.insert(0, str(REPO_ROOT))
+    from utils import memory_manager, topic_manager
+
+    topic_manager.TOPIC_BACKEND = backend
+    topic_manager.ensure_topic_store()
+    memory_manager.ensure_memory_store()
+    topic_id = topic_manager.create_topic("stress", procs * messages)
+
+    ctx = multiprocessing.get_context("spawn")
+    workers = [
+        ctx.Process(target=_writer, args=(workdir, backend, topic_id, w, messages, memory_sync))
+        for w in range(procs)
+    ]
+    start = time.perf_counter()
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    expected = {f"w{w}-m{i}" for w in range(procs) for i in range(messages)}
+    failures = [f"writer exit code {p.exitcode}" for p in workers if p.exitcode]
+
+    stored = [m["message"] for m in topic_manager.get_backend().get_topic(topic_id)["messages"]]
+    if len(stored) != len(expected) or set(stored) != expected:
+        failures.append(f"topics: {len(stored)} stored, {len(expected)} expected")
+
+    conversation = json.loads(Path(memory_manager.MEMORY_FILE).read_text(encoding="utf-8"))["conversation"]
+    mem = [e["message"] for e in conversation]
+    if len(mem) != len(expected) or set(mem) != expected:
+        failures.append(f"memory: {len(mem)} stored, {len(expected)} expected")
+    if [e["turn"] for e in conversation] != list(range(1, len(conversation) + 1)):
+        failures.append("memory: turn numbers are not contiguous")
+
+    corrupt = list(Path(workdir, "data").glob("*.corrupt-*"))
+    if corrupt:
+        failures.append(f"quarantined files: {[p.name for p in corrupt]}")
+
+    mode = "sync" if memory_sync else "write-behind"
+    print(f"{procs} procs x {messages} msgs, {backend} topics, {mode} memory: {elapsed:.2f} s")
+    for failure in failures:
+        print("  FAIL", failure)
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-writer stress test for data/ stores.")
+    parser.add_argument("--procs", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--memory-sync", action="store_true", help="flush shared memory on every append")
+    args = parser.parse_args()
+    ok = run(args.procs, args.messages, args.backend, args.memory_sync)
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
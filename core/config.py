@@ -0,0 +1,138 @@
+"""Shared settings and role prompts, parsed once and kept in memory.
+
+Settings come from ``syestem/config.txt`` (``KEY = VALUE`` lines, ``#``
+comments) on top of the defaults below; ``APP_CONFIG`` points at another
+file. Role prompts are the files named by ``ROLE_<ROLE>`` (e.g.
+``ROLE_STUDENT``). Every front end reads through this module, so a turn
+costs no file I/O: at most once every ``CONFIG_RELOAD_INTERVAL`` seconds
+the files are stat'ed and any whose mtime or size changed are re-read.
+"""
+import os
+import threading
+import time
+from pathlib import Path
+
+from utils.file_lock import file_token
+
+CONFIG_FILE = Path(os.getenv("APP_CONFIG", "syestem/config.txt"))
+RELOAD_INTERVAL = float(os.getenv("CONFIG_RELOAD_INTERVAL", "2.0"))
+
+DEFAULTS = {
+    "MODEL_NAME": "llama-3.3-70b-versatile",
+    "MEMORY_FILE": "data/shared_memory.json",
+    "MAX_TURNS": 10,
+    "ROLE_STUDENT": "agents/student.txt",
+    "ROLE_TEACHER": "agents/teacher.txt",
+    # Per-role model routing, see core.routing.
+    "TIER_FAST": "llama-3.1-8b-instant",
+    "ROUTE_STUDENT": "fast, quality",
+    "ROUTE_TEACHER": "quality, fast",
+}
+
+
+def parse_config(text):
+    """``KEY = VALUE`` lines to a dict; integer values become ints."""
+    settings = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        value = value.strip()
+        settings[key.strip()] = int(value) if value.lstrip("-").isdigit() else value
+    return settings
+
+
+class ConfigRegistry:
+    def __init__(self, path=CONFIG_FILE, reload_interval=RELOAD_INTERVAL):
+        self.path = Path(path)
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._settings = dict(DEFAULTS)
+        self._prompts = {}          # role -> (path, token, text)
+        self._config_token = None
+        self._checked = None
+        self.reload()
+
+    def reload(self, force=True):
+        """Re-read whatever changed on disk; ``force=False`` honours the interval."""
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._checked is not None and now - self._checked < self.reload_interval:
+                return
+            self._checked = now
+            token = file_token(self.path)
+            if token != self._config_token:
+                self._config_token = token
+                settings = dict(DEFAULTS)
+                if token is not None:
+                    settings.update(parse_config(self.path.read_text(encoding="utf-8")))
+                self._settings = settings
+            for role in list(self._prompts):
+                self._load_prompt(role)
+
+    def _load_prompt(self, role):
+        path = Path(self._settings.get(f"ROLE_{role.upper()}", f"agents/{role}.txt"))
+        token = file_token(path)
+        cached = self._prompts.get(role)
+        if cached is not None and cached[0] == path and cached[1] == token:
+            return cached[2]
+        text = path.read_text(encoding="utf-8") if token is not None else ""
+        self._prompts[role] = (path, token, text)
+        return text
+
+    def get(self, key, default=None):
+        self.reload(force=False)
+        return self._settings.get(key, default)
+
+    def get_int(self, key, default=0):
+        try:
+            return int(self.get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def prompt(self, role):
+        """System prompt for ``role`` ("student", "teacher", ...)."""
+        self.reload(force=False)
+        cached = self._prompts.get(role)
+        if cached is not None:
+            return cached[2]
+        with self._lock:
+            return self._load_prompt(role)
+
+    def settings(self):
+        self.reload(force=False)
+        return dict(self._settings)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ConfigRegistry()
+    return _registry
+
+
+def get_setting(key, default=None):
+    return get_registry().get(key, default)
+
+
+def get_prompt(role):
+    return get_registry().prompt(role)
+
+
+def max_turns():
+    return get_registry().get_int("MAX_TURNS", DEFAULTS["MAX_TURNS"])
+
+
+def model_name():
+    return get_registry().get("MODEL_NAME", DEFAULTS["MODEL_NAME"])
+
+
+def reload_config():
+    get_registry().reload()
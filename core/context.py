@@ -0,0 +1,187 @@
+"""Assemble the history an agent sees under a fixed token budget.
+
+The newest messages are sent verbatim. Once they no longer fit, older
+messages are folded into a rolling summary that is sent as a second
+system message. Summaries are built incrementally (the previous summary
+plus the newly dropped messages) and cached per conversation key, so the
+summarizer runs once every ``SUMMARY_CHUNK`` messages rather than on
+every turn.
+
+Teacher turns are also grounded in uploaded documents: the top
+``RETRIEVAL_TOP_K`` chunks of the local index (:mod:`utils.doc_index`) for
+the student's latest message are added as another system message.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from core import llm
+from utils import doc_index
+
+TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2048"))
+SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "300"))
+SUMMARY_CHUNK = int(os.getenv("CONTEXT_SUMMARY_CHUNK", "6"))
+MIN_RECENT = int(os.getenv("CONTEXT_MIN_RECENT", "2"))
+MAX_CACHED_SUMMARIES = 512
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+GROUNDED_ROLES = ("teacher",)
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a study session between a student and a teacher. "
+    "Merge the new messages into the existing summary. Keep the questions asked, the key "
+    "explanations and any open confusion. Reply with the updated summary only, in under "
+    "{words} words."
+)
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token, plus message overhead)."""
+    return len(text or "") // 4 + 4
+
+
+def _verbatim_start(entries, available):
+    """Index of the oldest message that still fits in ``available`` tokens."""
+    used = 0
+    start = len(entries)
+    while start > 0:
+        cost = estimate_tokens(entries[start - 1]["message"])
+        if used + cost > available and len(entries) - start >= MIN_RECENT:
+            break
+        used += cost
+        start -= 1
+    return start
+
+
+def _fingerprint(entries, count):
+    if not count:
+        return ""
+    last = entries[count - 1]
+    return hashlib.sha1(f"{count}\0{last['role']}\0{last['message']}".encode("utf-8")).hexdigest()
+
+
+def _transcript(entries):
+    return "\n".join(f"{e['role'].capitalize()}: {e['message']}" for e in entries)
+
+
+def summarize(previous, entries, topic=None):
+    """Fold ``entries`` into the ``previous`` summary with one LLM call."""
+    content = f"Existing summary:\n{previous or '(none)'}\n\nNew messages:\n{_transcript(entries)}"
+    return llm.call_llm([
+        {"role": "system", "content": SUMMARY_PROMPT.format(words=SUMMARY_TOKENS * 3 // 4)},
+        {"role": "user", "content": content},
+    ], max_tokens=SUMMARY_TOKENS, role="summary", topic=topic).strip()
+
+
+class SummaryCache:
+    """Per-conversation rolling summaries: key -> (covered, fingerprint, text).
+
+    ``covered`` is how many leading messages the summary already includes.
+    The fingerprint of the last covered message detects a history that was
+    edited or replaced, in which case the summary is rebuilt from scratch.
+    """
+
+    def __init__(self, max_keys=MAX_CACHED_SUMMARIES):
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, entries):
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+        if cached is None:
+            return 0, ""
+        covered, fingerprint, text = cached
+        if covered > len(entries) or _fingerprint(entries, covered) != fingerprint:
+            return 0, ""
+        return covered, text
+
+    def put(self, key, entries, covered, text):
+        with self._lock:
+            self._entries[key] = (covered, _fingerprint(entries, covered), text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+    def forget(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_summaries = SummaryCache()
+
+
+def get_summary_cache():
+    return _summaries
+
+
+def _summary_for(key, entries, cut):
+    """(covered, summary) with at least ``entries[:cut]`` folded in when possible."""
+    covered, text = _summaries.get(key, entries) if key is not None else (0, "")
+    if covered >= cut:
+        return covered, text
+    # Fold a chunk past what this turn needs so the next few turns reuse it.
+    target = max(cut, min(cut + SUMMARY_CHUNK, len(entries) - MIN_RECENT))
+    try:
+        text = summarize(text, entries[covered:target], topic=key)
+    except llm.LLMError:
+        # Degrade to plain truncation for this turn; retry the fold next time.
+        return cut, text
+    if key is not None:
+        _summaries.put(key, entries, target, text)
+    return target, text
+
+
+def references(query, k=RETRIEVAL_TOP_K):
+    """System message with the document chunks most relevant to ``query``, or None."""
+    if not k or not query or not doc_index.has_documents():
+        return None
+    hits = doc_index.search(query, k)
+    if not hits:
+        return None
+    excerpts = "\n\n".join(f"[{hit['name']}, p. {hit['page']}] {hit['text']}" for hit in hits)
+    return {
+        "role": "system",
+        "content": "Excerpts from the uploaded course documents. Use them when they are "
+                   f"relevant and mention the source:\n\n{excerpts}",
+    }
+
+
+def build_messages(system_prompt, history, role, key=None, budget=None):
+    """Chat messages for ``role``'s next reply, given the conversation so far.
+
+    ``history`` is a list of ``{"role", "message"}`` dicts (topic messages or
+    shared-memory entries). The replying role's own messages become
+    ``assistant`` turns and the other agent's become ``user`` turns. ``key``
+    identifies the conversation for summary caching (e.g. the topic id);
+    without it the summary is rebuilt on every call.
+    """
+    budget = TOKEN_BUDGET if budget is None else budget
+    entries = [e for e in history if e.get("message")]
+    available = budget - estimate_tokens(system_prompt)
+    messages = [{"role": "system", "content": system_prompt}]
+    if role in GROUNDED_ROLES:
+        question = next((e["message"] for e in reversed(entries) if e["role"] != role), "")
+        grounding = references(question)
+        if grounding is not None:
+            messages.append(grounding)
+            available -= estimate_tokens(grounding["content"])
+
+    start = _verbatim_start(entries, available)
+    if start:
+        start, summary = _summary_for(key, entries, _verbatim_start(entries, available - SUMMARY_TOKENS))
+        if summary:
+            messages.append({"role": "system", "content": f"Summary of the conversation so far:\n{summary}"})
+
+    for entry in entries[start:]:
+        messages.append({
+            "role": "assistant" if entry["role"] == role else "user",
+            "content": entry["message"],
+        })
+    return messages
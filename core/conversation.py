@@ -0,0 +1,68 @@
+"""Turn bookkeeping shared by every conversation driver.
+
+The helpers work on any object exposing ``turn_count``, ``max_turns``,
+``stop_requested``, ``auto_run`` and ``status`` attributes, so the
+Streamlit ``st.session_state`` and :class:`ConversationState` are
+interchangeable.
+"""
+from dataclasses import dataclass
+
+from core import metrics
+
+STUDENT_OPENER = "Ask a question about this topic: {topic}"
+
+
+@dataclass
+class ConversationState:
+    topic_id: str = None
+    topic: str = ""
+    max_turns: int = 6
+    turn_count: int = 0
+    stop_requested: bool = False
+    auto_run: bool = False
+    status: str = "idle"
+    last_student: str = ""
+    saved_calls: int = 0
+
+
+def _finish(state, status):
+    state.auto_run = False
+    state.status = status
+
+
+def can_start_turn(state):
+    """Check stop/max-turn limits before a teacher+student round."""
+    if state.stop_requested:
+        _finish(state, "stopped")
+        return False
+    if state.turn_count >= state.max_turns:
+        _finish(state, "complete")
+        return False
+    return True
+
+
+def continues_after_teacher(state):
+    """Record the teacher turn; False means the student follow-up is skipped."""
+    state.turn_count += 1
+    if state.turn_count >= state.max_turns or state.stop_requested:
+        _finish(state, "complete")
+        return False
+    return True
+
+
+def record_student_turn(state):
+    state.turn_count += 1
+    if state.turn_count >= state.max_turns:
+        _finish(state, "complete")
+
+
+def end_stalled(state):
+    """Stop a conversation whose student keeps repeating itself.
+
+    Every remaining turn would have been one LLM call; returns that count.
+    """
+    saved = max(0, state.max_turns - state.turn_count)
+    state.saved_calls += saved
+    _finish(state, "stalled")
+    metrics.get_metrics().record_stall("stop", saved)
+    return saved
@@ -0,0 +1,359 @@
+import json
+import os
+import random
+import threading
+import time
+import weakref
+
+# requests, httpx and asyncio are imported when the first client is built,
+# which keeps them off the import path of every entry point.
+
+
+class LLMError(Exception):
+    """Base class for every error raised by the LLM transport."""
+
+
+class LLMTimeoutError(LLMError):
+    pass
+
+
+class LLMConnectionError(LLMError):
+    pass
+
+
+class LLMResponseError(LLMError):
+    """The endpoint answered 200 but the body was not a usable completion."""
+
+
+class LLMHTTPError(LLMError):
+    def __init__(self, status_code, message, body=None):
+        super().__init__(f"HTTP {status_code}: {message}")
+        self.status_code = status_code
+        self.body = body
+
+
+class LLMRateLimitError(LLMHTTPError):
+    def __init__(self, status_code, message, body=None, retry_after=None):
+        if retry_after is not None:
+            message = f"{message} (retry after {retry_after:.0f} s)"
+        super().__init__(status_code, message, body)
+        self.retry_after = retry_after
+
+
+class LLMServerError(LLMHTTPError):
+    pass
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return float(default)
+
+
+def parse_retry_after(value):
+    """Return the Retry-After header as seconds (int/float or HTTP-date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _error_message(response):
+    try:
+        body = response.json()
+    except ValueError:
+        return response.text[:200], None
+    err = body.get("error") if isinstance(body, dict) else None
+    if isinstance(err, dict):
+        return err.get("message", str(err)), body
+    return str(err or body)[:200], body
+
+
+RETRYABLE_ERRORS = (LLMTimeoutError, LLMConnectionError, LLMRateLimitError, LLMServerError)
+
+# Called as hook(model, status_code, headers) for every response, before
+# errors are raised; core.scheduler follows the x-ratelimit-* headers here.
+RESPONSE_HOOKS = []
+
+
+def _notify(payload, response):
+    for hook in RESPONSE_HOOKS:
+        hook(payload.get("model"), response.status_code, response.headers)
+
+
+class _RetryPolicy:
+    """Timeout/retry settings and error mapping shared by the sync and async clients."""
+
+    def __init__(
+        self,
+        base_url,
+        api_key,
+        connect_timeout=5.0,
+        read_timeout=60.0,
+        max_retries=4,
+        backoff_base=0.5,
+        backoff_max=20.0,
+        max_retry_after=60.0,
+        pool_size=10,
+    ):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.pool_size = pool_size
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        }
+
+    @classmethod
+    def from_env(cls, base_url, api_key):
+        return cls(
+            base_url,
+            api_key,
+            connect_timeout=_env_float("LLM_CONNECT_TIMEOUT", 5),
+            read_timeout=_env_float("LLM_READ_TIMEOUT", 60),
+            max_retries=int(_env_float("LLM_MAX_RETRIES", 4)),
+            backoff_base=_env_float("LLM_BACKOFF_BASE", 0.5),
+            backoff_max=_env_float("LLM_BACKOFF_MAX", 20),
+            max_retry_after=_env_float("LLM_MAX_RETRY_AFTER", 60),
+            pool_size=int(_env_float("LLM_POOL_SIZE", 10)),
+        )
+
+    def gives_up(self, attempt, max_retries, exc, give_up=None):
+        """True if ``exc`` should be raised rather than retried.
+
+        A ``Retry-After`` above ``max_retry_after`` is raised with the
+        advertised delay instead of blocking the turn for that long.
+        """
+        retry_after = getattr(exc, "retry_after", None)
+        return (
+            attempt >= max_retries
+            or (retry_after is not None and retry_after > self.max_retry_after)
+            or (give_up is not None and give_up(exc))
+        )
+
+    def backoff_delay(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            # Never retry earlier than the server asked; jitter on top spreads
+            # out clients that were throttled at the same moment.
+            delay = max(delay, retry_after) + random.uniform(0, self.backoff_base)
+        return delay
+
+    def _raise_for_status(self, response):
+        if response.status_code < 400:
+            return
+        message, body = _error_message(response)
+        if response.status_code == 429:
+            raise LLMRateLimitError(
+                429, message, body, retry_after=parse_retry_after(response.headers.get("Retry-After"))
+            )
+        if response.status_code >= 500:
+            raise LLMServerError(response.status_code, message, body)
+        raise LLMHTTPError(response.status_code, message, body)
+
+
+class LLMClient(_RetryPolicy):
+    """Long-lived, keep-alive HTTP client for the OpenAI-compatible endpoint.
+
+    One instance is shared by every front end so TCP/TLS connections are
+    reused across turns. Transient failures (429, 5xx, timeouts, dropped
+    connections) are retried with jittered exponential backoff, honouring
+    ``Retry-After`` when the server sends it.
+    """
+
+    def __init__(self, base_url, api_key, **settings):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        super().__init__(base_url, api_key, **settings)
+        self._requests = requests
+        self.timeout = (self.connect_timeout, self.read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(self.headers)
+
+    def _send(self, payload, stream=False):
+        try:
+            response = self.session.post(self.base_url, json=payload, timeout=self.timeout, stream=stream)
+        except self._requests.Timeout as exc:
+            raise LLMTimeoutError(str(exc)) from exc
+        except self._requests.ConnectionError as exc:
+            raise LLMConnectionError(str(exc)) from exc
+        _notify(payload, response)
+        if response.status_code >= 400:
+            try:
+                self._raise_for_status(response)
+            finally:
+                response.close()
+        return response
+
+    def post(self, payload, stream=False, max_retries=None, give_up=None):
+        """POST ``payload`` with retries and return the successful response.
+
+        With ``stream=True`` the body is left unread so the caller can
+        consume it incrementally; retries only cover the request up to the
+        response headers. ``max_retries`` overrides the client setting.
+        ``give_up`` is called with each retryable error; when it returns
+        True the error is raised at once, e.g. a 429 while the caller has
+        another model to fail over to.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            try:
+                return self._send(payload, stream=stream)
+            except RETRYABLE_ERRORS as exc:
+                if self.gives_up(attempt, max_retries, exc, give_up):
+                    raise
+                time.sleep(self.backoff_delay(attempt, getattr(exc, "retry_after", None)))
+                attempt += 1
+
+    def post_json(self, payload, max_retries=None, give_up=None):
+        response = self.post(payload, max_retries=max_retries, give_up=give_up)
+        try:
+            return response.json()
+        except ValueError as exc:
+            raise LLMResponseError(f"Invalid JSON from LLM endpoint: {response.text[:200]}") from exc
+
+    def stream_events(self, payload, max_retries=None, give_up=None):
+        """Yield the decoded JSON ``data:`` events of a server-sent event stream."""
+        response = self.post(payload, stream=True, max_retries=max_retries, give_up=give_up)
+        try:
+            for raw in response.iter_lines():
+                # Decode ourselves: text/event-stream often comes without a
+                # charset and requests would fall back to ISO-8859-1.
+                line = raw.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    return
+                try:
+                    event = json.loads(data)
+                except ValueError as exc:
+                    raise LLMResponseError(f"Invalid stream event: {data[:200]}") from exc
+                if isinstance(event, dict) and "error" in event:
+                    raise LLMResponseError(f"Stream error: {str(event['error'])[:200]}")
+                yield event
+        except self._requests.RequestException as exc:
+            raise LLMConnectionError(f"Stream interrupted: {exc}") from exc
+        finally:
+            response.close()
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncLLMClient(_RetryPolicy):
+    """asyncio counterpart of :class:`LLMClient` built on ``httpx.AsyncClient``."""
+
+    def __init__(self, base_url, api_key, **settings):
+        import httpx
+
+        super().__init__(base_url, api_key, **settings)
+        self._httpx = httpx
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+        )
+
+    async def _send(self, payload):
+        try:
+            response = await self.client.post(self.base_url, json=payload)
+        except self._httpx.TimeoutException as exc:
+            raise LLMTimeoutError(str(exc)) from exc
+        except self._httpx.TransportError as exc:
+            raise LLMConnectionError(str(exc)) from exc
+        _notify(payload, response)
+        self._raise_for_status(response)
+        return response
+
+    async def post(self, payload, max_retries=None, give_up=None):
+        import asyncio
+
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            try:
+                return await self._send(payload)
+            except RETRYABLE_ERRORS as exc:
+                if self.gives_up(attempt, max_retries, exc, give_up):
+                    raise
+                await asyncio.sleep(self.backoff_delay(attempt, getattr(exc, "retry_after", None)))
+                attempt += 1
+
+    async def post_json(self, payload, max_retries=None, give_up=None):
+        response = await self.post(payload, max_retries=max_retries, give_up=give_up)
+        try:
+            return response.json()
+        except ValueError as exc:
+            raise LLMResponseError(f"Invalid JSON from LLM endpoint: {response.text[:200]}") from exc
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client(base_url, api_key):
+    """Return the process-wide client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None or _client.base_url != base_url or _client.api_key != api_key:
+            if _client is not None:
+                _client.close()
+            _client = LLMClient.from_env(base_url, api_key)
+        return _client
+
+
+# httpx.AsyncClient is bound to the event loop it was first used on, so the
+# async client is shared per loop rather than per process.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client(base_url, api_key):
+    """Return the client shared by every coroutine on the running event loop."""
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.base_url != base_url or client.api_key != api_key:
+        client = AsyncLLMClient.from_env(base_url, api_key)
+        _async_clients[loop] = client
+    return client
+
+
+async def close_async_client():
+    import asyncio
+
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def reset_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
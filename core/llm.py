@@ -1,25 +1,270 @@
+import contextvars
 import os
-import requests
-from dotenv import load_dotenv
+import time
 
-load_dotenv()
+from core import config, metrics, routing, scheduler
+from core.cache import get_cache, make_key
+from core.http_client import (  # noqa: F401  (re-exported for callers)
+    RETRYABLE_ERRORS,
+    LLMError,
+    LLMHTTPError,
+    LLMRateLimitError,
+    LLMResponseError,
+    LLMServerError,
+    LLMTimeoutError,
+    LLMConnectionError,
+    get_async_client,
+    get_client,
+)
 
-API_KEY = os.getenv("GROQ_API_KEY")
-BASE_URL = "https://api.groq.com/openai/v1/chat/completions"
+DEFAULT_BASE_URL = "https://api.groq.com/openai/v1/chat/completions"
+DEFAULT_MODEL = config.DEFAULTS["MODEL_NAME"]
+# None means "read GROQ_API_KEY / LLM_BASE_URL (and .env) on the first call".
+API_KEY = None
+BASE_URL = None
+_dotenv_loaded = False
+# The model behind the last answer returned in this context; for a cache
+# hit, the model that produced the cached answer. batch.py records it.
+answered_by = contextvars.ContextVar("llm_answered_by", default=None)
+
+
+def _endpoint():
+    global _dotenv_loaded
+    if not _dotenv_loaded:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        _dotenv_loaded = True
+    return BASE_URL or os.getenv("LLM_BASE_URL", DEFAULT_BASE_URL), API_KEY or os.getenv("GROQ_API_KEY")
+
+
+def _models(model, role):
+    """An explicit ``model`` as is; otherwise the route for ``role``."""
+    return [model] if model else routing.plan(role)
+
+
+def _cache_key(model, role, messages, params):
+    """Cache key for a request: the explicit ``model``, else the role's whole route.
+
+    Keying on the configured route rather than the model that answered (or
+    the health-ordered plan) lets every model of the route serve and fill
+    the same entry, so a request answered by a fallback is still a hit
+    while the primary cools down.
+    """
+    if model:
+        return make_key(model, messages, params)
+    models = routing.route(role)
+    return make_key(models[0] if len(models) == 1 else models, messages, params)
 
-def call_llm(messages, model="llama-3.3-70b-versatile"):
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
 
-    payload = {
+def _payload(model, messages, params):
+    return {
         "model": model,
-        "messages": messages
+        "messages": messages,
+        **params,
     }
 
-    response = requests.post(BASE_URL, json=payload, headers=headers)
-    data = response.json()
-    print(data)  # Debug: print the full response
-    
-    return data["choices"][0]["message"]["content"]
\ No newline at end of file
+
+def _fail_fast(model, last):
+    """Retry predicate for ``models[i]``; None (retry as usual) on the last model.
+
+    While a fallback remains, transient errors are retried on the same model
+    but a 429, or a model the health tracker has put on cooldown, fails over
+    at once.
+    """
+    if last:
+        return None
+    health = routing.get_health()
+    return lambda exc: isinstance(exc, LLMRateLimitError) or not health.available(model)
+
+
+def _failover(role, model, models, i, exc):
+    """True if the call to ``model`` (``models[i]``) should be retried on the next one."""
+    if i + 1 >= len(models) or not isinstance(exc, RETRYABLE_ERRORS):
+        return False
+    metrics.get_metrics().record_failover(role, model, models[i + 1])
+    return True
+
+
+def call_llm(messages, model=None, stream=False, use_cache=True, role=None, topic=None, priority=None,
+             **params):
+    """Return the completion text, or a generator of text tokens if ``stream``.
+
+    Extra keyword arguments (``temperature``, ``max_tokens``, ...) are sent
+    as sampling parameters. When the response cache is enabled, identical
+    requests are answered from it; pass ``use_cache=False`` to bypass it.
+    ``role`` and ``topic`` tag the call in :mod:`core.metrics`.
+    Without ``model`` the role's route from :mod:`core.routing` picks the
+    model; if it is rate limited or failing, the next one in the route
+    answers instead. Every request first waits for :mod:`core.scheduler`
+    to admit it under the API's rate limits; ``priority`` ("interactive"
+    or "batch") defaults to :data:`core.scheduler.current_priority`.
+    """
+    models = _models(model, role)
+    cache = get_cache() if use_cache else None
+    key = _cache_key(model, role, messages, params) if cache else None
+    cached, cached_model = (cache.lookup(key) if cache else None) or (None, None)
+    if cached is not None:
+        metrics.get_metrics().record_cache_hit(role, models[0])
+        answered_by.set(cached_model or models[0])
+
+    if stream:
+        if cached is not None:
+            return _replay(cached)
+        return _stream_routed(models, messages, params, cache, key, role, topic, priority)
+
+    if cached is not None:
+        return cached
+
+    cost = scheduler.estimate_cost(messages, params)
+    for i, model in enumerate(models):
+        tags = (role, model, topic)
+        last = i + 1 == len(models)
+        scheduler.get_scheduler().acquire(model, cost, priority, topic)
+        start = time.perf_counter()
+        try:
+            data = get_client(*_endpoint()).post_json(
+                _payload(model, messages, params), give_up=_fail_fast(model, last),
+            )
+            text = _completion_text(data)
+        except LLMError as exc:
+            _record(tags, "error", start, error=exc)
+            if _failover(role, model, models, i, exc):
+                continue
+            raise
+        _record(tags, "ok", start, messages, text, data.get("usage"))
+        answered_by.set(model)
+        if cache:
+            cache.set(key, text, model)
+        return text
+
+
+async def acall_llm(messages, model=None, use_cache=True, role=None, topic=None, priority=None, **params):
+    """asyncio counterpart of :func:`call_llm` (non-streaming)."""
+    models = _models(model, role)
+    cache = get_cache() if use_cache else None
+    key = _cache_key(model, role, messages, params) if cache else None
+    cached, cached_model = (cache.lookup(key) if cache else None) or (None, None)
+    if cached is not None:
+        metrics.get_metrics().record_cache_hit(role, models[0])
+        answered_by.set(cached_model or models[0])
+        return cached
+
+    cost = scheduler.estimate_cost(messages, params)
+    for i, model in enumerate(models):
+        tags = (role, model, topic)
+        last = i + 1 == len(models)
+        await scheduler.get_scheduler().aacquire(model, cost, priority, topic)
+        start = time.perf_counter()
+        try:
+            data = await get_async_client(*_endpoint()).post_json(
+                _payload(model, messages, params), give_up=_fail_fast(model, last),
+            )
+            text = _completion_text(data)
+        except LLMError as exc:
+            _record(tags, "error", start, error=exc)
+            if _failover(role, model, models, i, exc):
+                continue
+            raise
+        _record(tags, "ok", start, messages, text, data.get("usage"))
+        answered_by.set(model)
+        if cache:
+            cache.set(key, text, model)
+        return text
+
+
+def _completion_text(data):
+    try:
+        return data["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError) as exc:
+        raise LLMResponseError(f"Unexpected completion payload: {str(data)[:200]}") from exc
+
+
+def _estimate_tokens(text):
+    return len(text) // 4 + 1 if text else 0
+
+
+def _record(tags, status, start, messages=(), text="", usage=None, ttft=None, error=None):
+    """Report one finished call; token counts fall back to a length estimate."""
+    role, model, topic = tags
+    usage = usage if isinstance(usage, dict) else {}
+    prompt_tokens = usage.get("prompt_tokens")
+    if prompt_tokens is None:
+        prompt_tokens = sum(_estimate_tokens(m.get("content") or "") for m in messages)
+    completion_tokens = usage.get("completion_tokens")
+    if completion_tokens is None:
+        completion_tokens = _estimate_tokens(text)
+    latency = time.perf_counter() - start
+    metrics.get_metrics().record(
+        role, model, topic, status, latency, ttft, prompt_tokens, completion_tokens,
+    )
+    if status != "cancelled":
+        # Streams are judged by time to first token, the wait a user sees.
+        routing.get_health().record(model, status == "ok", ttft if ttft is not None else latency, error)
+
+
+def _stream_usage(event):
+    # OpenAI sends "usage" on the last chunk; Groq nests it under "x_groq".
+    usage = event.get("usage") or (event.get("x_groq") or {}).get("usage")
+    return usage if isinstance(usage, dict) else None
+
+
+def _replay(text):
+    yield text
+
+
+def _stream_routed(models, messages, params, cache, key, role, topic, priority):
+    """Stream from the first model that starts answering; see :func:`call_llm`."""
+    cost = scheduler.estimate_cost(messages, params)
+    for i, model in enumerate(models):
+        scheduler.get_scheduler().acquire(model, cost, priority, topic)
+        tokens = _stream_tokens(
+            _payload(model, messages, params),
+            cache,
+            key,
+            (role, model, topic),
+            give_up=_fail_fast(model, i + 1 == len(models)),
+        )
+        started = False
+        try:
+            for token in tokens:
+                started = True
+                yield token
+            answered_by.set(model)
+            return
+        except LLMError as exc:
+            # Once tokens were shown, switching models would splice two answers.
+            if started or not _failover(role, model, models, i, exc):
+                raise
+        finally:
+            tokens.close()
+
+
+def _stream_tokens(payload, cache=None, key=None, tags=(None, None, None), give_up=None):
+    start = time.perf_counter()
+    tokens = []
+    ttft = None
+    usage = None
+    try:
+        for event in get_client(*_endpoint()).stream_events({**payload, "stream": True}, give_up=give_up):
+            try:
+                token = event["choices"][0].get("delta", {}).get("content") if event.get("choices") else None
+            except (KeyError, IndexError, TypeError, AttributeError) as exc:
+                raise LLMResponseError(f"Unexpected stream chunk: {str(event)[:200]}") from exc
+            usage = _stream_usage(event) or usage
+            if token:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                tokens.append(token)
+                yield token
+    except GeneratorExit:
+        _record(tags, "cancelled", start, payload["messages"], "".join(tokens), usage, ttft)
+        raise
+    except LLMError as exc:
+        _record(tags, "error", start, ttft=ttft, error=exc)
+        raise
+    text = "".join(tokens)
+    _record(tags, "ok", start, payload["messages"], text, usage, ttft)
+    # Only a fully consumed stream is a complete answer worth caching.
+    if cache:
+        cache.set(key, text, payload["model"])
@@ -0,0 +1,349 @@
+"""In-process metrics for LLM calls.
+
+:func:`core.llm.call_llm` records every request here: latency,
+time to first token (streaming), prompt/completion tokens and outcome,
+tagged by role, model and topic. Latency histograms are kept per
+role/model; request and token counters also carry the topic (capped at
+``MAX_TOPICS`` distinct values, the rest are reported as ``other``).
+:mod:`core.llm` also counts failovers between the models of a route,
+:mod:`core.scheduler` reports queue depth and wait times per priority,
+and :mod:`core.repetition` adds stalled conversations and the LLM calls
+saved by ending them early.
+
+Read them with :func:`snapshot` (JSON-friendly dict), :func:`to_prometheus`
+(text exposition format) or over HTTP with :func:`start_server`, which
+serves ``/metrics`` and ``/metrics.json``. ``METRICS_PORT`` makes the
+Streamlit app start that server.
+"""
+import json
+import os
+import threading
+import time
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192)
+MAX_TOPICS = int(os.getenv("METRICS_MAX_TOPICS", "100"))
+METRICS_PORT = os.getenv("METRICS_PORT")
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate like Prometheus' ``histogram_quantile`` (linear within a bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, n in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if n and seen + n >= rank:
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = upper
+        return self.buckets[-1]
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+        }
+
+
+class Metrics:
+    def __init__(self, max_topics=MAX_TOPICS):
+        self.max_topics = max_topics
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}       # (role, model, topic, status) -> count
+            self.tokens = {}         # (role, model, topic, kind) -> count
+            self.cache_hits = {}     # (role, model) -> count
+            self.latency = {}        # (role, model) -> Histogram
+            self.ttft = {}           # (role, model) -> Histogram
+            self.completion = {}     # (role, model) -> Histogram of completion tokens
+            self.stalls = {}         # action -> count
+            self.failovers = {}      # (role, from model, to model) -> count
+            self.queue_wait = {}     # (priority,) -> Histogram of seconds before a request was sent
+            self.queue_depth = {}    # (priority,) -> requests waiting now
+            self.saved_calls = 0
+            self._topics = set()
+
+    def _topic_label(self, topic):
+        if not topic:
+            return ""
+        if topic in self._topics:
+            return topic
+        if len(self._topics) < self.max_topics:
+            self._topics.add(topic)
+            return topic
+        return "other"
+
+    def record(self, role, model, topic, status, latency, ttft=None,
+               prompt_tokens=0, completion_tokens=0):
+        role = role or "unknown"
+        with self._lock:
+            topic = self._topic_label(topic)
+            key = (role, model, topic, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for kind, n in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+                if n:
+                    tkey = (role, model, topic, kind)
+                    self.tokens[tkey] = self.tokens.get(tkey, 0) + n
+            series = (role, model)
+            self.latency.setdefault(series, Histogram(LATENCY_BUCKETS)).observe(latency)
+            if ttft is not None:
+                self.ttft.setdefault(series, Histogram(LATENCY_BUCKETS)).observe(ttft)
+            if status == "ok" and completion_tokens:
+                self.completion.setdefault(series, Histogram(TOKEN_BUCKETS)).observe(completion_tokens)
+
+    def record_cache_hit(self, role, model):
+        with self._lock:
+            key = (role or "unknown", model)
+            self.cache_hits[key] = self.cache_hits.get(key, 0) + 1
+
+    def record_failover(self, role, from_model, to_model):
+        """A call moved to the next model in its route (see core.routing)."""
+        with self._lock:
+            key = (role or "unknown", from_model, to_model)
+            self.failovers[key] = self.failovers.get(key, 0) + 1
+
+    def record_queue_wait(self, priority, seconds):
+        with self._lock:
+            self.queue_wait.setdefault((priority,), Histogram(LATENCY_BUCKETS)).observe(seconds)
+
+    def set_queue_depth(self, priority, depth):
+        with self._lock:
+            self.queue_depth[(priority,)] = depth
+
+    def record_stall(self, action, saved_calls=0):
+        """A repeating conversation was flagged, re-prompted or stopped early."""
+        with self._lock:
+            self.stalls[action] = self.stalls.get(action, 0) + 1
+            self.saved_calls += saved_calls
+
+    def summary(self):
+        """Totals across every label, for compact displays."""
+        with self._lock:
+            calls = sum(self.requests.values())
+            errors = sum(n for k, n in self.requests.items() if k[3] == "error")
+            latency = _merged(self.latency.values(), LATENCY_BUCKETS)
+            ttft = _merged(self.ttft.values(), LATENCY_BUCKETS)
+            return {
+                "calls": calls,
+                "errors": errors,
+                "error_rate": errors / calls if calls else 0.0,
+                "cache_hits": sum(self.cache_hits.values()),
+                "prompt_tokens": sum(n for k, n in self.tokens.items() if k[3] == "prompt"),
+                "completion_tokens": sum(n for k, n in self.tokens.items() if k[3] == "completion"),
+                "latency_p50": latency.quantile(0.5),
+                "latency_p95": latency.quantile(0.95),
+                "ttft_p50": ttft.quantile(0.5),
+                "failovers": sum(self.failovers.values()),
+                "queue": {
+                    p: {
+                        "waiting": self.queue_depth.get((p,), 0),
+                        "wait_p50": h.quantile(0.5),
+                        "wait_p95": h.quantile(0.95),
+                    }
+                    for (p,), h in sorted(self.queue_wait.items())
+                },
+                "by_model": _by_model(self.requests),
+                "stalls": sum(self.stalls.values()),
+                "saved_calls": self.saved_calls,
+                "by_role": _by_role(self.requests),
+            }
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started, 3),
+                "requests": [
+                    {"role": r, "model": m, "topic": t, "status": s, "count": n}
+                    for (r, m, t, s), n in sorted(self.requests.items())
+                ],
+                "tokens": [
+                    {"role": r, "model": m, "topic": t, "kind": k, "count": n}
+                    for (r, m, t, k), n in sorted(self.tokens.items())
+                ],
+                "cache_hits": [
+                    {"role": r, "model": m, "count": n} for (r, m), n in sorted(self.cache_hits.items())
+                ],
+                "latency_seconds": _series(self.latency),
+                "ttft_seconds": _series(self.ttft),
+                "completion_tokens": _series(self.completion),
+                "failovers": [
+                    {"role": r, "from_model": f, "to_model": t, "count": n}
+                    for (r, f, t), n in sorted(self.failovers.items())
+                ],
+                "queue_wait_seconds": [{"priority": p, **h.to_dict()} for (p,), h in sorted(self.queue_wait.items())],
+                "queue_depth": [{"priority": p, "waiting": n} for (p,), n in sorted(self.queue_depth.items())],
+                "stalls": [{"action": a, "count": n} for a, n in sorted(self.stalls.items())],
+                "saved_calls": self.saved_calls,
+            }
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            _counter(lines, "llm_requests_total", "LLM requests by outcome.",
+                     ("role", "model", "topic", "status"), self.requests)
+            _counter(lines, "llm_tokens_total", "Prompt and completion tokens.",
+                     ("role", "model", "topic", "kind"), self.tokens)
+            _counter(lines, "llm_cache_hits_total", "Requests answered from the response cache.",
+                     ("role", "model"), self.cache_hits)
+            _counter(lines, "llm_failovers_total", "Calls moved to the next model in their route.",
+                     ("role", "from_model", "to_model"), self.failovers)
+            _counter(lines, "conversation_stalls_total", "Repeating conversations by action taken.",
+                     ("action",), {(a,): n for a, n in self.stalls.items()})
+            lines.append("# HELP llm_calls_saved_total LLM calls skipped by ending repeating conversations early.")
+            lines.append("# TYPE llm_calls_saved_total counter")
+            lines.append(f"llm_calls_saved_total {self.saved_calls}")
+            _histogram(lines, "llm_request_latency_seconds", "Wall time of an LLM request.", self.latency)
+            _histogram(lines, "llm_time_to_first_token_seconds", "Time to the first streamed token.", self.ttft)
+            _histogram(lines, "llm_completion_tokens", "Completion tokens per request.", self.completion)
+            _histogram(lines, "llm_queue_wait_seconds", "Time a request waited for the rate-limit scheduler.",
+                       self.queue_wait, ("priority",))
+            lines.append("# HELP llm_queue_depth Requests waiting for the rate-limit scheduler.")
+            lines.append("# TYPE llm_queue_depth gauge")
+            for key, n in sorted(self.queue_depth.items()):
+                lines.append(f"llm_queue_depth{_labels(('priority',), key)} {n}")
+        return "\n".join(lines) + "\n"
+
+
+def _merged(histograms, buckets):
+    merged = Histogram(buckets)
+    for h in histograms:
+        merged.counts = [a + b for a, b in zip(merged.counts, h.counts)]
+        merged.count += h.count
+        merged.total += h.total
+    return merged
+
+
+def _by_role(requests):
+    roles = {}
+    for (role, _, _, status), n in requests.items():
+        entry = roles.setdefault(role, {"calls": 0, "errors": 0})
+        entry["calls"] += n
+        if status == "error":
+            entry["errors"] += n
+    return roles
+
+
+def _by_model(requests):
+    models = {}
+    for (role, model, _, status), n in requests.items():
+        entry = models.setdefault(model, {"calls": 0, "errors": 0, "roles": []})
+        entry["calls"] += n
+        if status == "error":
+            entry["errors"] += n
+        if role not in entry["roles"]:
+            entry["roles"].append(role)
+    return models
+
+
+def _series(histograms):
+    return [{"role": r, "model": m, **h.to_dict()} for (r, m), h in sorted(histograms.items())]
+
+
+def _labels(names, values):
+    pairs = (f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + ",".join(pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _counter(lines, name, help_text, label_names, values):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} counter")
+    for key, n in sorted(values.items()):
+        lines.append(f"{name}{_labels(label_names, key)} {n}")
+
+
+def _histogram(lines, name, help_text, histograms, label_names=("role", "model")):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for key, h in sorted(histograms.items()):
+        cumulative = 0
+        for bound, n in zip(list(h.buckets) + ["+Inf"], h.counts):
+            cumulative += n
+            labels = _labels(label_names + ("le",), key + (bound,))
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _labels(label_names, key)
+        lines.append(f"{name}_sum{labels} {h.total}")
+        lines.append(f"{name}_count{labels} {h.count}")
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    return _metrics
+
+
+def snapshot():
+    return _metrics.snapshot()
+
+
+def to_prometheus():
+    return _metrics.to_prometheus()
+
+
+def _handler_class():
+    # http.server pulls in email/html parsing; only load it when serving.
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/metrics":
+                body, content_type = to_prometheus(), "text/plain; version=0.0.4"
+            elif path == "/metrics.json":
+                body, content_type = json.dumps(snapshot()), "application/json"
+            else:
+                self.send_error(404)
+                return
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsHandler
+
+
+def start_server(port=None, host="127.0.0.1"):
+    """Serve ``/metrics`` and ``/metrics.json`` from a daemon thread; returns the server."""
+    from http.server import ThreadingHTTPServer
+
+    port = int(port if port is not None else METRICS_PORT or 9464)
+    server = ThreadingHTTPServer((host, port), _handler_class())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,178 @@
+"""Spot a student that keeps asking the same question.
+
+Each student message is reduced to a MinHash signature of its word
+shingles (``SHINGLE_WORDS``-word windows of lowercased words with plain
+plurals folded, hashed with CRC32), computed for all ``NUM_HASHES`` hash
+functions in one NumPy pass. The last
+``LOOP_WINDOW`` signatures of every topic are kept in memory, so comparing
+a new message against them is a single vectorized equality count; the
+fraction of matching slots estimates the Jaccard similarity of the
+shingle sets.
+
+A follow-up at least ``LOOP_SIMILARITY`` similar to a recent one is a
+stall. ``LOOP_ACTION`` decides what the drivers do about it:
+
+* ``reprompt`` (default): ask the student once more with
+  :data:`REPROMPT_TEXT` appended; if the new question still repeats, stop.
+* ``stop``: end the conversation with status ``stalled``.
+* ``flag``: only count it in :mod:`core.metrics`.
+* ``off``: don't check.
+
+Stopping early skips every remaining turn, one LLM call each; the
+savings are reported by :meth:`core.metrics.Metrics.summary`.
+"""
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict, deque
+
+from core import metrics
+
+LOOP_ACTION = os.getenv("LOOP_ACTION", "reprompt")
+LOOP_SIMILARITY = float(os.getenv("LOOP_SIMILARITY", "0.7"))
+LOOP_WINDOW = int(os.getenv("LOOP_WINDOW", "4"))
+SHINGLE_WORDS = 3
+NUM_HASHES = 64
+MAX_TOPICS = 256
+
+OK, FLAG, REPROMPT, STOP = "ok", "flag", "reprompt", "stop"
+REPROMPT_TEXT = (
+    "You have already asked that. Ask about an aspect of the topic that has not "
+    "been covered yet, or say that you have no further questions."
+)
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_PRIME = 4294967311  # smallest prime above 2**32: (a * h + b) stays below 2**64
+_params = None
+
+
+def _fold(word):
+    # "forces" and "force" are the same question.
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def shingles(text, n=SHINGLE_WORDS):
+    """CRC32 hashes of the ``n``-word windows of ``text`` (the words themselves if shorter)."""
+    words = [_fold(w.lower()) for w in _WORD.findall(text or "")]
+    if len(words) < n:
+        grams = words
+    else:
+        grams = (" ".join(words[i:i + n]) for i in range(len(words) - n + 1))
+    return {zlib.crc32(g.encode("utf-8")) for g in grams}
+
+
+def signature(text):
+    """MinHash signature of ``text``: ``NUM_HASHES`` uint64 minima, or None for empty text."""
+    import numpy as np
+
+    global _params
+    hashes = shingles(text)
+    if not hashes:
+        return None
+    if _params is None:
+        rng = np.random.RandomState(1)
+        _params = (
+            rng.randint(1, 2 ** 32, size=(NUM_HASHES, 1), dtype=np.uint64),
+            rng.randint(0, 2 ** 32, size=(NUM_HASHES, 1), dtype=np.uint64),
+        )
+    a, b = _params
+    h = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+    return ((a * h + b) % np.uint64(_PRIME)).min(axis=1)
+
+
+class LoopDetector:
+    """Recent student signatures per conversation key, least recently used dropped first."""
+
+    def __init__(self, window=LOOP_WINDOW, threshold=LOOP_SIMILARITY, max_topics=MAX_TOPICS):
+        self.window = window
+        self.threshold = threshold
+        self.max_topics = max_topics
+        self._lock = threading.Lock()
+        self._recent = OrderedDict()     # key -> deque of signatures
+
+    def tracking(self, key):
+        return key in self._recent
+
+    def _signatures(self, key):
+        recent = self._recent.get(key)
+        if recent is None:
+            recent = self._recent[key] = deque(maxlen=self.window)
+            while len(self._recent) > self.max_topics:
+                self._recent.popitem(last=False)
+        else:
+            self._recent.move_to_end(key)
+        return recent
+
+    def seed(self, key, history):
+        """Start tracking ``key`` from stored ``{"role", "message"}`` dicts, unless already tracked."""
+        if self.tracking(key):
+            return
+        sigs = [signature(m.get("message", "")) for m in history if m.get("role") == "student"]
+        with self._lock:
+            recent = self._signatures(key)
+            recent.extend(s for s in sigs[-self.window:] if s is not None)
+
+    def similarity(self, key, text):
+        """(highest similarity to a recent message of ``key``, signature of ``text``)."""
+        import numpy as np
+
+        sig = signature(text)
+        with self._lock:
+            recent = list(self._recent.get(key, ()))
+        if sig is None or not recent:
+            return 0.0, sig
+        return float((np.stack(recent) == sig).mean(axis=1).max()), sig
+
+    def observe(self, key, sig):
+        if sig is None:
+            return
+        with self._lock:
+            self._signatures(key).append(sig)
+
+    def forget(self, key):
+        with self._lock:
+            self._recent.pop(key, None)
+
+
+_detector = LoopDetector()
+
+
+def get_detector():
+    return _detector
+
+
+def review(key, text, history=(), retried=False, action=None):
+    """What to do with a new student follow-up: OK, FLAG, REPROMPT or STOP.
+
+    ``history`` seeds a conversation the detector has not seen yet (e.g.
+    after a restart). Pass ``retried=True`` for the answer to a re-prompt.
+    Accepted messages are remembered for the next comparison.
+    """
+    action = action or LOOP_ACTION
+    if action == "off":
+        return OK
+    _detector.seed(key, history)
+    score, sig = _detector.similarity(key, text)
+    if score < _detector.threshold:
+        _detector.observe(key, sig)
+        return OK
+    if action == "flag":
+        metrics.get_metrics().record_stall("flag")
+        _detector.observe(key, sig)
+        return FLAG
+    if action == REPROMPT and not retried:
+        metrics.get_metrics().record_stall("reprompt")
+        return REPROMPT
+    return STOP
+
+
+def reprompt(messages):
+    """``messages`` with the instruction to move on from the repeated question."""
+    return list(messages) + [{"role": "user", "content": REPROMPT_TEXT}]
+
+
+def forget(key):
+    _detector.forget(key)
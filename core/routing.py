@@ -0,0 +1,135 @@
+"""Per-role model routing with failover to a backup model.
+
+``syestem/config.txt`` names model tiers and the tiers each role uses,
+primary first::
+
+    TIER_FAST = llama-3.1-8b-instant
+    TIER_QUALITY = llama-3.3-70b-versatile
+    ROUTE_STUDENT = fast, quality
+    ROUTE_TEACHER = quality, fast
+
+``TIER_QUALITY`` defaults to ``MODEL_NAME``. A route entry that is not a
+tier is taken as a model id. Roles without a ``ROUTE_<ROLE>`` line use the
+quality tier only.
+
+:class:`ModelHealth` keeps the last ``ROUTE_WINDOW`` outcomes of every
+model. A model is skipped for ``ROUTE_COOLDOWN`` seconds (or as long as
+``Retry-After`` asks) after a rate limit, or when its recent error rate
+reaches ``ROUTE_MAX_ERROR_RATE`` or its median latency (time to first
+token when streaming) exceeds ``ROUTE_MAX_LATENCY`` seconds. After the
+cooldown it gets traffic again with a clean window. If every model of a
+route is cooling down, the primary is used anyway.
+"""
+import statistics
+import threading
+import time
+from collections import deque
+
+from core import config
+from core.http_client import LLMRateLimitError
+
+MIN_SAMPLES = 3
+
+
+def _float_setting(key, default):
+    try:
+        return float(config.get_setting(key, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def tier_model(name):
+    name = name.strip()
+    if name.lower() == "quality":
+        return config.get_setting("TIER_QUALITY") or config.model_name()
+    return config.get_setting(f"TIER_{name.upper()}") or name
+
+
+def route(role):
+    """Models for ``role`` in order of preference, without duplicates."""
+    spec = config.get_setting(f"ROUTE_{(role or '').upper()}") or "quality"
+    models = []
+    for name in str(spec).split(","):
+        if name.strip():
+            model = tier_model(name)
+            if model not in models:
+                models.append(model)
+    return models or [config.model_name()]
+
+
+class ModelHealth:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}         # model -> deque of (ok, latency)
+        self._down_until = {}    # model -> monotonic time
+        self._reasons = {}       # model -> why it is cooling down
+
+    def available(self, model, now=None):
+        return (now or time.monotonic()) >= self._down_until.get(model, 0.0)
+
+    def _cool_down(self, model, seconds, reason):
+        self._down_until[model] = time.monotonic() + seconds
+        self._reasons[model] = reason
+        self._calls.pop(model, None)
+
+    def record(self, model, ok, latency=None, error=None):
+        cooldown = _float_setting("ROUTE_COOLDOWN", 30.0)
+        with self._lock:
+            if isinstance(error, LLMRateLimitError):
+                self._cool_down(model, max(cooldown, error.retry_after or 0.0), "rate limited")
+                return
+            window = self._calls.get(model)
+            if window is None:
+                window = self._calls[model] = deque(maxlen=config.get_registry().get_int("ROUTE_WINDOW", 20))
+            window.append((ok, latency))
+            if len(window) < MIN_SAMPLES:
+                return
+            error_rate = sum(1 for ok, _ in window if not ok) / len(window)
+            latencies = [lat for ok, lat in window if ok and lat is not None]
+            p50 = statistics.median(latencies) if len(latencies) >= MIN_SAMPLES else 0.0
+            if error_rate >= _float_setting("ROUTE_MAX_ERROR_RATE", 0.5):
+                self._cool_down(model, cooldown, f"error rate {error_rate:.0%}")
+            elif p50 > _float_setting("ROUTE_MAX_LATENCY", 10.0):
+                self._cool_down(model, cooldown, f"slow (p50 {p50:.1f} s)")
+
+    def candidates(self, models):
+        """``models`` that are not cooling down, in order; the primary if none are."""
+        now = time.monotonic()
+        healthy = [m for m in models if self.available(m, now)]
+        return healthy or models[:1]
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            models = set(self._calls) | set(self._down_until)
+            result = {}
+            for model in sorted(models):
+                window = self._calls.get(model, ())
+                latencies = [lat for ok, lat in window if ok and lat is not None]
+                down = self._down_until.get(model, 0.0) - now
+                result[model] = {
+                    "calls": len(window),
+                    "error_rate": sum(1 for ok, _ in window if not ok) / len(window) if window else 0.0,
+                    "latency_p50": statistics.median(latencies) if latencies else None,
+                    "cooldown_seconds": round(down, 1) if down > 0 else 0.0,
+                    "reason": self._reasons.get(model, "") if down > 0 else "",
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+            self._down_until.clear()
+            self._reasons.clear()
+
+
+_health = ModelHealth()
+
+
+def get_health():
+    return _health
+
+
+def plan(role):
+    """Models to try for one ``role`` call, healthiest route order first."""
+    return _health.candidates(route(role))
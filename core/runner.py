@@ -0,0 +1,148 @@
+"""Run many topic conversations concurrently on one asyncio event loop.
+
+Wall-clock time for N topics becomes roughly the slowest topic instead of
+the sum of every LLM round trip. Turn limits and stop handling follow
+``ConversationWorker.process_next_turn`` via :mod:`core.conversation`.
+"""
+import asyncio
+
+from core import repetition, scheduler
+from core.conversation import (
+    STUDENT_OPENER,
+    ConversationState,
+    can_start_turn,
+    continues_after_teacher,
+    end_stalled,
+    record_student_turn,
+)
+from core.config import get_prompt
+from core.context import build_messages
+from core.http_client import close_async_client
+from core.llm import acall_llm, answered_by
+from utils.topic_manager import add_message, create_topic
+
+DEFAULT_CONCURRENCY = 4
+
+
+def _store_message(state, role, message):
+    add_message(state.topic_id, role, message)
+
+
+def _append(state, history, role, text, on_message):
+    # acall_llm ran in this task, so answered_by names the model behind ``text``.
+    history.append({"role": role, "message": text, "model": answered_by.get()})
+    on_message(state, role, text)
+
+
+async def _reply(state, history, role, messages, on_message):
+    text = await acall_llm(messages, role=role, topic=state.topic_id)
+    _append(state, history, role, text, on_message)
+    return text
+
+
+async def _follow_up(state, history, prompts, on_message):
+    """The student's next question, re-asked once or flagged if it repeats an earlier one."""
+    messages = await _context(state, history, "student", prompts)
+    text = await acall_llm(messages, role="student", topic=state.topic_id)
+    verdict = repetition.review(state.topic_id, text, history)
+    if verdict == repetition.REPROMPT:
+        text = await acall_llm(repetition.reprompt(messages), role="student", topic=state.topic_id)
+        verdict = repetition.review(state.topic_id, text, retried=True)
+    _append(state, history, "student", text, on_message)
+    return text, verdict
+
+
+async def _context(state, history, role, prompts):
+    # Folding old turns into the summary is a blocking LLM call; keep it off the loop.
+    return await asyncio.to_thread(build_messages, prompts[role], list(history), role, state.topic_id)
+
+
+async def aprocess_next_turn(state, prompts, history, on_message=_store_message):
+    """One teacher answer plus one student follow-up, like ``ConversationWorker.process_next_turn``."""
+    if not can_start_turn(state):
+        return
+
+    await _reply(state, history, "teacher", await _context(state, history, "teacher", prompts), on_message)
+    if not continues_after_teacher(state):
+        return
+
+    student_msg, verdict = await _follow_up(state, history, prompts, on_message)
+    state.last_student = student_msg
+    record_student_turn(state)
+    if verdict == repetition.STOP and state.auto_run:
+        end_stalled(state)
+
+
+async def arun_topic(topic, max_turns, prompts, semaphore, stop_event=None,
+                     history=None, topic_id=None, on_message=None):
+    """Drive one topic from its opening question until it completes or is stopped.
+
+    The semaphore is held for the whole conversation, so it bounds how many
+    topics are in flight at once (and therefore concurrent LLM requests).
+
+    By default the conversation is saved to the topic store. Passing
+    ``on_message(state, role, message)`` (with an optional ``topic_id``)
+    reports each reply to the caller instead. ``history`` is a list of
+    ``{"role", "message"}`` dicts from an interrupted run; the conversation
+    resumes after its last message, and the list is extended in place.
+    """
+    # Bulk conversations queue behind interactive users for the API's rate limits.
+    scheduler.current_priority.set(scheduler.BATCH)
+    async with semaphore:
+        state = ConversationState(topic_id=topic_id, topic=topic, max_turns=max_turns, auto_run=True, status="running")
+        if on_message is None:
+            state.topic_id = create_topic(topic, max_turns)
+            on_message = _store_message
+        history = [] if history is None else history
+        state.turn_count = len(history)
+
+        if not history:
+            await _reply(state, history, "student", [
+                {"role": "system", "content": prompts["student"]},
+                {"role": "user", "content": STUDENT_OPENER.format(topic=topic)},
+            ], on_message)
+            state.turn_count += 1
+        elif history[-1]["role"] == "teacher" and state.turn_count < max_turns:
+            # Interrupted between the teacher's answer and the student's follow-up.
+            _, verdict = await _follow_up(state, history, prompts, on_message)
+            record_student_turn(state)
+            if verdict == repetition.STOP and state.auto_run:
+                end_stalled(state)
+        state.last_student = next((m["message"] for m in reversed(history) if m["role"] == "student"), "")
+
+        while state.auto_run:
+            if stop_event is not None and stop_event.is_set():
+                state.stop_requested = True
+            await aprocess_next_turn(state, prompts, history, on_message)
+        repetition.forget(state.topic_id)
+        return state
+
+
+def load_prompts():
+    return {
+        "student": get_prompt("student"),
+        "teacher": get_prompt("teacher"),
+    }
+
+
+async def arun_topics(topics, max_turns, concurrency=DEFAULT_CONCURRENCY, stop_event=None):
+    """Run every topic with at most ``concurrency`` conversations in flight.
+
+    Returns one entry per topic, in input order: the final
+    :class:`ConversationState`, or the exception that ended that topic.
+    Setting ``stop_event`` stops every topic at its next turn boundary.
+    """
+    prompts = load_prompts()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    try:
+        return await asyncio.gather(
+            *(arun_topic(topic, max_turns, prompts, semaphore, stop_event) for topic in topics),
+            return_exceptions=True,
+        )
+    finally:
+        await close_async_client()
+
+
+def run_topics(topics, max_turns, concurrency=DEFAULT_CONCURRENCY):
+    """Blocking wrapper around :func:`arun_topics` for scripts."""
+    return asyncio.run(arun_topics(topics, max_turns, concurrency))
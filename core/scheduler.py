@@ -0,0 +1,304 @@
+"""Rate-limit-aware admission of LLM requests, interactive traffic first.
+
+:func:`core.llm.call_llm` and :func:`core.llm.acall_llm` ask
+:func:`get_scheduler` for a slot before every request. The scheduler
+keeps two token buckets per model, requests and tokens, and sets them
+from the ``x-ratelimit-limit-*``, ``x-ratelimit-remaining-*`` and
+``x-ratelimit-reset-*`` headers of every response: the bucket holds what
+the server says remains and refills so that it is full again at the
+reset time. The headers count everything sent with the API key, so
+every process that shares the key follows the same budget. A 429 pauses
+the model for its ``Retry-After``.
+
+A request costs one request and its estimated tokens (prompt length plus
+``max_tokens``, or ``SCHED_COMPLETION_TOKENS``). Waiting requests are
+granted by priority class, ``interactive`` before ``batch``, and round
+robin across topics within a class, so one long batch topic can't starve
+the others. Batch requests also leave ``SCHED_BATCH_RESERVE`` of each
+bucket untouched, which keeps headroom for interactive users even when
+the batch runs in another process. A request that waited
+``SCHED_MAX_WAIT`` seconds goes out anyway.
+
+The priority comes from the ``priority`` argument or, by default, from
+:data:`current_priority`, which :mod:`core.runner` sets to ``batch`` for
+its tasks. Queue depth and wait times are reported by :meth:`Scheduler.stats`
+and in :mod:`core.metrics`.
+"""
+import contextvars
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from core import metrics
+from core.http_client import RESPONSE_HOOKS, parse_retry_after
+
+INTERACTIVE, BATCH = "interactive", "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+BATCH_RESERVE = float(os.getenv("SCHED_BATCH_RESERVE", "0.2"))
+MAX_WAIT = float(os.getenv("SCHED_MAX_WAIT", "120"))
+COMPLETION_TOKENS = int(os.getenv("SCHED_COMPLETION_TOKENS", "400"))
+RECHECK_SECONDS = 1.0
+
+current_priority = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset(value):
+    """Seconds in an ``x-ratelimit-reset-*`` value such as ``7.66s``, ``2m59.56s`` or ``120ms``."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _UNITS[unit] for n, unit in parts)
+
+
+def estimate_cost(messages, params):
+    prompt = sum(len(m.get("content") or "") // 4 + 1 for m in messages)
+    return prompt + int(params.get("max_tokens") or COMPLETION_TOKENS)
+
+
+class Bucket:
+    """What remains of one limit; unlimited until the server reports one."""
+
+    def __init__(self):
+        self.limit = None
+        self.level = 0.0
+        self.rate = 0.0
+        self.updated = 0.0
+
+    def update(self, limit, remaining, reset, now):
+        self.limit = limit
+        self.level = float(min(remaining, limit))
+        if reset:
+            self.rate = (limit - self.level) / reset
+        else:
+            self.level, self.rate = float(limit), 0.0
+        self.updated = now
+
+    def available(self, now):
+        if self.limit is None:
+            return float("inf")
+        return min(self.limit, self.level + self.rate * (now - self.updated))
+
+    def take(self, n, now):
+        if self.limit is not None:
+            self.level = self.available(now) - n
+            self.updated = now
+
+    def wait(self, n, reserve, now):
+        """Seconds until ``n`` can be taken leaving ``reserve`` of the limit; 0 if now."""
+        if self.limit is None:
+            return 0.0
+        floor = self.limit * reserve
+        short = min(n, self.limit - floor) + floor - self.available(now)
+        if short <= 0:
+            return 0.0
+        return short / self.rate if self.rate > 0 else RECHECK_SECONDS
+
+
+class _ModelLimits:
+    def __init__(self):
+        self.requests = Bucket()
+        self.tokens = Bucket()
+        self.paused_until = 0.0
+
+
+class _Ticket:
+    __slots__ = ("model", "cost", "priority", "topic", "enqueued", "granted", "retry", "wake")
+
+    def __init__(self, model, cost, priority, topic, wake):
+        self.model = model
+        self.cost = cost
+        self.priority = priority
+        self.topic = topic
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.retry = 0.0
+        self.wake = wake
+
+
+class Scheduler:
+    def __init__(self, batch_reserve=BATCH_RESERVE, max_wait=MAX_WAIT):
+        self.batch_reserve = batch_reserve
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._limits = {}                                   # model -> _ModelLimits
+        self._queues = {p: OrderedDict() for p in PRIORITIES}  # priority -> topic -> deque of tickets
+        self._granted = {p: 0 for p in PRIORITIES}
+
+    # ---- rate-limit headers ---------------------------------------------
+
+    def observe(self, model, status_code, headers):
+        """Response hook: follow the server's view of the limits for ``model``."""
+        now = time.monotonic()
+        with self._lock:
+            limits = self._limits.setdefault(model, _ModelLimits())
+            for kind, bucket in (("requests", limits.requests), ("tokens", limits.tokens)):
+                try:
+                    limit = int(headers.get(f"x-ratelimit-limit-{kind}"))
+                    remaining = int(headers.get(f"x-ratelimit-remaining-{kind}"))
+                except (TypeError, ValueError):
+                    continue
+                bucket.update(limit, remaining, parse_reset(headers.get(f"x-ratelimit-reset-{kind}")), now)
+            if status_code == 429:
+                pause = parse_retry_after(headers.get("Retry-After")) or RECHECK_SECONDS
+                limits.paused_until = max(limits.paused_until, now + pause)
+            self._dispatch(now)
+
+    # ---- admission ------------------------------------------------------
+
+    def _wait(self, ticket, now):
+        limits = self._limits.get(ticket.model)
+        if limits is None:
+            return 0.0
+        reserve = self.batch_reserve if ticket.priority == BATCH else 0.0
+        return max(
+            limits.paused_until - now,
+            limits.requests.wait(1, reserve, now),
+            limits.tokens.wait(ticket.cost, reserve, now),
+        )
+
+    def _grant(self, ticket, now):
+        limits = self._limits.get(ticket.model)
+        if limits is not None:
+            limits.requests.take(1, now)
+            limits.tokens.take(ticket.cost, now)
+        ticket.granted = True
+        self._granted[ticket.priority] += 1
+        ticket.wake()
+
+    def _dispatch(self, now):
+        """Grant every waiting ticket that fits, by priority then round robin by topic."""
+        progress = True
+        while progress:
+            progress = False
+            blocked = {}        # model -> seconds until its head ticket may fit
+            for priority in PRIORITIES:
+                queue = self._queues[priority]
+                for topic in list(queue):
+                    tickets = queue[topic]
+                    ticket = tickets[0]
+                    if ticket.model in blocked:
+                        # Nothing jumps a higher-priority or older request for the same model.
+                        ticket.retry = blocked[ticket.model]
+                        continue
+                    wait = self._wait(ticket, now)
+                    if wait > 0 and now - ticket.enqueued < self.max_wait:
+                        blocked[ticket.model] = ticket.retry = max(wait, 0.005)
+                        continue
+                    tickets.popleft()
+                    if tickets:
+                        queue.move_to_end(topic)
+                    else:
+                        del queue[topic]
+                    self._grant(ticket, now)
+                    progress = True
+            for priority in PRIORITIES:
+                metrics.get_metrics().set_queue_depth(priority, self._depth(priority))
+
+    def _depth(self, priority):
+        return sum(len(t) for t in self._queues[priority].values())
+
+    def _enqueue(self, ticket):
+        now = time.monotonic()
+        with self._lock:
+            self._queues[ticket.priority].setdefault(ticket.topic or "", deque()).append(ticket)
+            self._dispatch(now)
+
+    def _poll(self, ticket):
+        """Re-run admission for a waiting ticket; returns how long to sleep before the next check."""
+        now = time.monotonic()
+        with self._lock:
+            if not ticket.granted:
+                self._dispatch(now)
+            # Tickets behind another of the same topic have no estimate of their own.
+            return min(ticket.retry or RECHECK_SECONDS, RECHECK_SECONDS)
+
+    def _cancel(self, ticket):
+        with self._lock:
+            if ticket.granted:
+                return
+            queue = self._queues[ticket.priority]
+            tickets = queue.get(ticket.topic or "")
+            if tickets is not None and ticket in tickets:
+                tickets.remove(ticket)
+                if not tickets:
+                    del queue[ticket.topic or ""]
+            self._dispatch(time.monotonic())
+
+    def _ticket(self, model, cost, priority, topic, wake):
+        priority = priority or current_priority.get()
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority: {priority!r} (expected one of {', '.join(PRIORITIES)})")
+        return _Ticket(model, cost, priority, topic, wake)
+
+    def acquire(self, model, cost, priority=None, topic=None):
+        """Block until a request to ``model`` costing ``cost`` tokens may be sent."""
+        event = threading.Event()
+        ticket = self._ticket(model, cost, priority, topic, event.set)
+        self._enqueue(ticket)
+        try:
+            while not ticket.granted:
+                event.wait(self._poll(ticket))
+        finally:
+            self._cancel(ticket)
+        metrics.get_metrics().record_queue_wait(ticket.priority, time.monotonic() - ticket.enqueued)
+
+    async def aacquire(self, model, cost, priority=None, topic=None):
+        """asyncio counterpart of :meth:`acquire`."""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        ticket = self._ticket(model, cost, priority, topic, lambda: loop.call_soon_threadsafe(event.set))
+        self._enqueue(ticket)
+        try:
+            while not ticket.granted:
+                try:
+                    await asyncio.wait_for(event.wait(), self._poll(ticket))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._cancel(ticket)
+        metrics.get_metrics().record_queue_wait(ticket.priority, time.monotonic() - ticket.enqueued)
+
+    # ---- reporting ------------------------------------------------------
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "queued": {p: self._depth(p) for p in PRIORITIES},
+                "granted": dict(self._granted),
+                "models": {
+                    model: {
+                        "requests_remaining": _remaining(limits.requests, now),
+                        "requests_limit": limits.requests.limit,
+                        "tokens_remaining": _remaining(limits.tokens, now),
+                        "tokens_limit": limits.tokens.limit,
+                        "paused_seconds": round(max(0.0, limits.paused_until - now), 1),
+                    }
+                    for model, limits in sorted(self._limits.items())
+                },
+            }
+
+
+def _remaining(bucket, now):
+    return None if bucket.limit is None else int(bucket.available(now))
+
+
+_scheduler = Scheduler()
+RESPONSE_HOOKS.append(_scheduler.observe)
+
+
+def get_scheduler():
+    return _scheduler
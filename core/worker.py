@@ -0,0 +1,242 @@
+"""Server-side owner of running conversations, keyed by ``topic_id``.
+
+The Streamlit page no longer advances a conversation inside its script
+run. It sends start/stop/step/resume commands here and polls
+:meth:`ConversationWorker.snapshot`. Turns run on a thread pool, so one
+server process can drive many conversations, and a conversation keeps
+going if the browser tab disconnects.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core import config, llm, repetition
+from core.context import build_messages
+from core.conversation import (
+    STUDENT_OPENER,
+    ConversationState,
+    can_start_turn,
+    continues_after_teacher,
+    end_stalled,
+    record_student_turn,
+)
+from utils import memory_manager, topic_manager
+
+WORKER_THREADS = int(os.getenv("CONVERSATION_WORKERS", "8"))
+MAX_FINISHED_SESSIONS = 256
+TERMINAL_STATUSES = frozenset({"complete", "stalled", "stopped", "error"})
+
+
+class _Session:
+    def __init__(self, state):
+        self.state = state
+        self.lock = threading.Lock()
+        self.busy = False
+        self.step_pending = False
+        self.partial_role = None
+        self.partial_text = ""
+        self.error = ""
+        self.updated = time.time()
+
+
+class ConversationWorker:
+    def __init__(self, max_workers=WORKER_THREADS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="conversation")
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    # ---- commands -------------------------------------------------------
+
+    def start(self, topic, max_turns, manual_mode=False):
+        """Create the topic and ask the opening question in the background."""
+        topic_id = topic_manager.create_topic(topic, max_turns)
+        state = ConversationState(
+            topic_id=topic_id,
+            topic=topic,
+            max_turns=max_turns,
+            auto_run=not manual_mode,
+            status="running",
+        )
+        session = _Session(state)
+        with self._lock:
+            self._prune()
+            self._sessions[topic_id] = session
+        self._submit(session, opening=True)
+        return topic_id
+
+    def stop(self, topic_id):
+        session = self._sessions.get(topic_id)
+        if session is None:
+            return
+        with session.lock:
+            session.state.stop_requested = True
+            session.state.auto_run = False
+            session.step_pending = False
+            session.state.status = "stopped"
+
+    def step(self, topic_id):
+        """Run exactly one teacher+student round, after the one in flight if any."""
+        session = self._sessions.get(topic_id)
+        if session is None:
+            return
+        with session.lock:
+            session.state.auto_run = False
+            session.state.stop_requested = False
+            if session.state.status == "error":
+                session.state.status = "running"
+        self._submit(session, single_step=True)
+
+    def resume(self, topic_id):
+        session = self._sessions.get(topic_id)
+        if session is None:
+            return
+        with session.lock:
+            session.state.stop_requested = False
+            session.state.auto_run = True
+            session.state.status = "running"
+        self._submit(session)
+
+    def forget(self, topic_id):
+        self.stop(topic_id)
+        with self._lock:
+            self._sessions.pop(topic_id, None)
+        repetition.forget(topic_id)
+
+    # ---- queries --------------------------------------------------------
+
+    def snapshot(self, topic_id):
+        """Plain-dict view of a conversation for the UI; None if unknown."""
+        session = self._sessions.get(topic_id)
+        if session is None:
+            return None
+        with session.lock:
+            state = session.state
+            return {
+                "topic_id": state.topic_id,
+                "topic": state.topic,
+                "max_turns": state.max_turns,
+                "turn_count": state.turn_count,
+                "status": state.status,
+                "auto_run": state.auto_run,
+                "stop_requested": state.stop_requested,
+                "busy": session.busy,
+                "partial_role": session.partial_role,
+                "partial_text": session.partial_text,
+                "error": session.error,
+                "saved_calls": state.saved_calls,
+            }
+
+    def active_count(self):
+        return sum(1 for s in list(self._sessions.values()) if s.busy)
+
+    # ---- execution ------------------------------------------------------
+
+    def _prune(self):
+        # Paused and manual conversations are still driven by an open page.
+        idle = [
+            tid for tid, s in self._sessions.items()
+            if not s.busy and s.state.status in TERMINAL_STATUSES
+        ]
+        excess = len(idle) - MAX_FINISHED_SESSIONS
+        if excess > 0:
+            for tid in sorted(idle, key=lambda t: self._sessions[t].updated)[:excess]:
+                del self._sessions[tid]
+
+    def _submit(self, session, opening=False, single_step=False):
+        with session.lock:
+            if session.busy:
+                # The running loop re-checks auto_run and step_pending before it exits.
+                session.step_pending = session.step_pending or single_step
+                return
+            session.busy = True
+            session.error = ""
+        self._executor.submit(self._drive, session, opening, single_step)
+
+    def _drive(self, session, opening, single_step):
+        state = session.state
+        try:
+            if opening:
+                self._opening_question(session)
+            elif single_step:
+                self.process_next_turn(session)
+            while True:
+                with session.lock:
+                    stepping, session.step_pending = session.step_pending, False
+                    if not state.auto_run and not stepping:
+                        session.busy = False
+                        return
+                self.process_next_turn(session)
+        except Exception as exc:
+            with session.lock:
+                state.auto_run = False
+                state.status = "error"
+                session.step_pending = False
+                session.error = str(exc)
+                session.busy = False
+        finally:
+            session.partial_role = None
+            session.partial_text = ""
+            session.updated = time.time()
+
+    def _generate(self, session, role, messages):
+        session.partial_role = role
+        session.partial_text = ""
+        parts = []
+        for token in llm.call_llm(messages, stream=True, role=role, topic=session.state.topic_id):
+            parts.append(token)
+            session.partial_text += token
+        return "".join(parts)
+
+    def _record(self, session, role, message):
+        topic_manager.add_message(session.state.topic_id, role, message)
+        memory_manager.append_message(role, message)
+        session.partial_role = None
+        session.partial_text = ""
+        session.updated = time.time()
+
+    def _context(self, state, role, history=None):
+        if history is None:
+            history = topic_manager.get_topic_messages(state.topic_id)
+        return build_messages(config.get_prompt(role), history, role, key=state.topic_id)
+
+    def _opening_question(self, session):
+        state = session.state
+        student_msg = self._generate(session, "student", [
+            {"role": "system", "content": config.get_prompt("student")},
+            {"role": "user", "content": STUDENT_OPENER.format(topic=state.topic)},
+        ])
+        self._record(session, "student", student_msg)
+        with session.lock:
+            state.turn_count += 1
+
+    def process_next_turn(self, session):
+        """One teacher answer plus one student follow-up."""
+        state = session.state
+        with session.lock:
+            if not can_start_turn(state):
+                return
+
+        teacher_msg = self._generate(session, "teacher", self._context(state, "teacher"))
+        self._record(session, "teacher", teacher_msg)
+        with session.lock:
+            stopped = state.stop_requested
+            if not continues_after_teacher(state):
+                if stopped:
+                    state.status = "stopped"
+                return
+
+        history = topic_manager.get_topic_messages(state.topic_id)
+        messages = self._context(state, "student", history)
+        student_msg = self._generate(session, "student", messages)
+        verdict = repetition.review(state.topic_id, student_msg, history)
+        if verdict == repetition.REPROMPT:
+            student_msg = self._generate(session, "student", repetition.reprompt(messages))
+            verdict = repetition.review(state.topic_id, student_msg, retried=True)
+        self._record(session, "student", student_msg)
+        with session.lock:
+            record_student_turn(state)
+            if state.stop_requested:
+                state.status = "stopped"
+            elif verdict == repetition.STOP and state.auto_run:
+                end_stalled(state)
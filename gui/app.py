@@ -1,11 +1,22 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import customtkinter as ctk
+from core import metrics, repetition
+from core.config import get_prompt, max_turns
+from core.context import build_messages
 from core.llm import call_llm
-from utils.topic_manager import create_topic, add_message
+from utils.topic_manager import create_topic, add_message, get_last_message, get_topic_messages
 from utils.memory_manager import save_memory
 
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("blue")
 
+POLL_MS = 100
+ROLE_LABELS = {"student": "👦 Student", "teacher": "👨‍🏫 Teacher"}
+
+
 class ChatApp(ctk.CTk):
     def __init__(self):
         super().__init__()
@@ -18,7 +29,7 @@ class ChatApp(ctk.CTk):
         self.topic_entry.pack(pady=10, fill="x", padx=20)
 
         # Max turns
-        self.turn_entry = ctk.CTkEntry(self, placeholder_text="Max Turns (e.g., 6)")
+        self.turn_entry = ctk.CTkEntry(self, placeholder_text=f"Max Turns (default {max_turns()})")
         self.turn_entry.pack(pady=10, fill="x", padx=20)
 
         # Start button
@@ -34,11 +45,21 @@ class ChatApp(ctk.CTk):
         self.chat_box = ctk.CTkTextbox(self, width=650, height=400)
         self.chat_box.pack(pady=10, padx=20)
 
+        self.status_label = ctk.CTkLabel(self, text="")
+        self.status_label.pack(pady=(0, 10))
+
         self.topic_id = None
         self.turn_count = 0
         self.max_turns = 0
         self.stop_requested = False
 
+        # LLM calls and storage writes run on a worker thread; finished turns
+        # come back through this queue, which the Tk loop polls with after().
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-turn")
+        self.results = queue.Queue()
+        self.cancel_event = threading.Event()
+        self._poll_id = self.after(POLL_MS, self.poll_results)
+
     def safe_call(self, fn):
         try:
             fn()
@@ -58,6 +79,7 @@ class ChatApp(ctk.CTk):
             self.safe_after(300, self.destroy)
 
     def reset_state(self):
+        self.cancel_turn()
         self.topic_id = None
         self.turn_count = 0
         self.max_turns = 0
@@ -75,7 +97,7 @@ class ChatApp(ctk.CTk):
             self.add_chat("System", "Please enter a topic.")
             return
 
-        turn_value = self.turn_entry.get().strip()
+        turn_value = self.turn_entry.get().strip() or str(max_turns())
         try:
             parsed_turns = int(turn_value)
             if parsed_turns <= 0:
@@ -90,16 +112,7 @@ class ChatApp(ctk.CTk):
         self.topic_id = create_topic(topic, self.max_turns)
 
         # First student question
-        student_msg = call_llm([
-            {"role": "system", "content": open("agents/student.txt").read()},
-            {"role": "user", "content": f"Ask your first question about: {topic}"}
-        ])
-
-        add_message(self.topic_id, "student", student_msg)
-        self.add_chat("👦 Student", student_msg)
-
-        self.turn_count += 1
-        self.safe_after(500, self.teacher_turn)
+        self.run_turn("student", self.teacher_turn, opener=f"Ask your first question about: {topic}")
 
     def teacher_turn(self):
         if self.stop_requested:
@@ -110,16 +123,7 @@ class ChatApp(ctk.CTk):
             self.end_conversation("Topic completed.")
             return
 
-        teacher_msg = call_llm([
-            {"role": "system", "content": open("agents/teacher.txt", "r", encoding="utf-8").read()},
-            {"role": "user", "content": f"Student asked: {self.get_last_student()}"}
-        ])
-
-        add_message(self.topic_id, "teacher", teacher_msg)
-        self.add_chat("👨‍🏫 Teacher", teacher_msg)
-
-        self.turn_count += 1
-        self.safe_after(500, self.student_turn)
+        self.run_turn("teacher", self.student_turn)
 
     def student_turn(self):
 
@@ -130,43 +134,101 @@ class ChatApp(ctk.CTk):
             self.end_conversation("Topic completed.")
             return
 
-        student_msg = call_llm([
-            {"role": "system", "content": open("agents/student.txt", "r", encoding="utf-8").read()},
-            {"role": "user", "content": f"Teacher replied: {self.get_last_teacher()}"}
-        ])
-
-        add_message(self.topic_id, "student", student_msg)
-        self.add_chat("👦 Student", student_msg)
-
-        self.turn_count += 1
-        self.safe_after(500, self.teacher_turn)
+        self.run_turn("student", self.teacher_turn)
+
+    def run_turn(self, role, next_step, opener=None):
+        """Generate and store one reply off the UI thread, then continue with next_step."""
+        self.cancel_event = cancel = threading.Event()
+        topic_id = self.topic_id
+
+        def generate(messages):
+            parts = []
+            tokens = call_llm(messages, stream=True, role=role, topic=topic_id)
+            try:
+                for token in tokens:
+                    if cancel.is_set():
+                        return None
+                    parts.append(token)
+            finally:
+                tokens.close()
+            return None if cancel.is_set() else "".join(parts)
+
+        def job():
+            system_prompt = get_prompt(role)
+            if opener:
+                messages = [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": opener},
+                ]
+                history = []
+            else:
+                history = get_topic_messages(topic_id)
+                messages = build_messages(system_prompt, history, role, key=topic_id)
+            reply = generate(messages)
+            verdict = repetition.OK
+            if reply is not None and role == "student" and not opener:
+                verdict = repetition.review(topic_id, reply, history)
+                if verdict == repetition.REPROMPT:
+                    reply = generate(repetition.reprompt(messages))
+                    if reply is not None:
+                        verdict = repetition.review(topic_id, reply, retried=True)
+            if reply is None:
+                return None
+            add_message(topic_id, role, reply)
+            return reply, verdict
+
+        self.status_label.configure(text=f"{ROLE_LABELS[role]} is thinking…")
+        future = self.executor.submit(job)
+        future.add_done_callback(lambda f: self.results.put((cancel, role, next_step, f)))
+
+    def cancel_turn(self):
+        self.cancel_event.set()
+        self.status_label.configure(text="")
+
+    def poll_results(self):
+        try:
+            while True:
+                cancel, role, next_step, future = self.results.get_nowait()
+                if cancel.is_set():
+                    continue
+                self.status_label.configure(text="")
+                exc = future.exception()
+                if exc is not None:
+                    self.add_chat("System", f"Error: {exc}")
+                    continue
+                reply, verdict = future.result()
+                self.add_chat(ROLE_LABELS[role], reply)
+                self.turn_count += 1
+                if verdict == repetition.STOP and self.turn_count < self.max_turns:
+                    saved = self.max_turns - self.turn_count
+                    metrics.get_metrics().record_stall("stop", saved)
+                    self.end_conversation(
+                        f"The student keeps repeating itself; stopped early ({saved} LLM calls saved).",
+                        auto_close=False,
+                    )
+                    continue
+                self.safe_after(500, next_step)
+        except queue.Empty:
+            pass
+        self._poll_id = self.after(POLL_MS, self.poll_results)
 
     def get_last_student(self):
-        data = open("data/topics_memory.json", "r", encoding="utf-8").read()
-        # quick parse
-        import json
-        topics = json.loads(data)
-        for t in topics["topics"]:
-            if t["topic_id"] == self.topic_id:
-                for m in reversed(t["messages"]):
-                    if m["role"] == "student":
-                        return m["message"]
+        return get_last_message(self.topic_id, "student")
 
     def get_last_teacher(self):
-        import json
-        with open("data/topics_memory.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
-            
-        for t in data["topics"]:
-            if t["topic_id"] == self.topic_id:
-                for m in reversed(t["messages"]):
-                    if m["role"] == "teacher":
-                        return m["message"]
-                    
+        return get_last_message(self.topic_id, "teacher")
+
     def stop_conversation(self):
         if self.topic_id is not None:
+            self.cancel_turn()
             self.end_conversation("Conversation stopped by user.")
 
+    def destroy(self):
+        self.cancel_event.set()
+        self.after_cancel(self._poll_id)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        super().destroy()
+
 
 if __name__ == "__main__":
     app = ChatApp()
@@ -1,22 +1,17 @@
-from core.llm import call_llm
-from utils.memory_manager import load_memory, append_message, get_turn_count
-from gui.app import ChatApp
+from core import metrics, repetition
+from core.config import get_prompt, max_turns
+from core.llm import call_llm, LLMError
+from core.context import build_messages
+from utils.memory_manager import append_message, get_turn_count, messages_since
 
-if __name__ == "__main__":
-    app = ChatApp()
-    app.mainloop()
-
-MAX_TURNS = 10  # total turns (student + teacher)
-STUDENT_PROMPT_FILE = "agents/student.txt"
-TEACHER_PROMPT_FILE = "agents/teacher.txt"
-
-def read_file(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
+MAX_TURNS = max_turns()  # total turns (student + teacher), from syestem/config.txt
 
 def run_conversation(topic):
-    student_role = read_file(STUDENT_PROMPT_FILE)
-    teacher_role = read_file(TEACHER_PROMPT_FILE)
+    student_role = get_prompt("student")
+    teacher_role = get_prompt("teacher")
+    # Shared memory holds earlier sessions too; only this run's entries are context.
+    start = get_turn_count()
+    context_key = f"cli-{start}"
 
     # --- Student first question ---
     student_messages = [
@@ -24,37 +19,54 @@ def run_conversation(topic):
         {"role": "user", "content": f"Ask a question about this topic: {topic}"}
     ]
 
-    student_q = call_llm(student_messages)
+    student_q = call_llm(student_messages, role="student")
     print("\n👦 Student:", student_q)
     append_message("student", student_q)
+    # Turns of this run; the shared memory count includes earlier sessions.
+    turns = 1
 
     # --- Main loop ---
-    while get_turn_count() < MAX_TURNS:
-        memory = load_memory()
-
+    while turns < MAX_TURNS:
         # Teacher responds
-        teacher_messages = [
-            {"role": "system", "content": teacher_role},
-            {"role": "user", "content": memory["conversation"][-1]["message"]}
-        ]
+        teacher_messages = build_messages(teacher_role, messages_since(start), "teacher", key=context_key)
 
-        teacher_answer = call_llm(teacher_messages)
+        teacher_answer = call_llm(teacher_messages, role="teacher")
         print("\n👨‍🏫 Teacher:", teacher_answer)
         append_message("teacher", teacher_answer)
+        turns += 1
 
-        if get_turn_count() >= MAX_TURNS:
+        if turns >= MAX_TURNS:
             break
 
         # Student follow-up
-        student_follow_messages = [
-            {"role": "system", "content": student_role},
-            {"role": "user", "content": teacher_answer}
-        ]
+        history = messages_since(start)
+        student_follow_messages = build_messages(student_role, history, "student", key=context_key)
 
-        student_follow = call_llm(student_follow_messages)
+        student_follow = call_llm(student_follow_messages, role="student")
+        verdict = repetition.review(context_key, student_follow, history)
+        if verdict == repetition.REPROMPT:
+            student_follow = call_llm(repetition.reprompt(student_follow_messages), role="student")
+            verdict = repetition.review(context_key, student_follow, retried=True)
         print("\n👦 Student:", student_follow)
         append_message("student", student_follow)
+        turns += 1
+
+        if verdict == repetition.STOP and turns < MAX_TURNS:
+            saved = MAX_TURNS - turns
+            metrics.get_metrics().record_stall("stop", saved)
+            print(f"\n⏹️ The student keeps repeating itself; stopping early ({saved} LLM calls saved).")
+            break
 
 # ---- RUN SYSTEM ----
-topic = input("Enter a topic: ")
-run_conversation(topic)
\ No newline at end of file
+if __name__ == "__main__":
+    # Imported here so scripts importing run_conversation don't load Tk.
+    from gui.app import ChatApp
+
+    app = ChatApp()
+    app.mainloop()
+
+    topic = input("Enter a topic: ")
+    try:
+        run_conversation(topic)
+    except LLMError as exc:
+        print("\n⚠️ Conversation stopped, LLM request failed:", exc)
\ No newline at end of file
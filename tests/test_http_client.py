@@ -0,0 +1,52 @@
+import pytest
+
+from core.http_client import LLMClient, LLMRateLimitError, LLMTimeoutError, _RetryPolicy
+
+
+def make_client(responses, **settings):
+    """An LLMClient whose transport replays ``responses`` (exceptions are raised)."""
+    client = LLMClient.__new__(LLMClient)
+    _RetryPolicy.__init__(client, "http://llm.test", "key", backoff_base=0.001, **settings)
+    calls = []
+
+    def send(payload, stream=False):
+        calls.append(payload)
+        result = responses[len(calls) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    client._send = send
+    return client, calls
+
+
+def test_retry_after_above_cap_is_raised_without_waiting(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("core.http_client.time.sleep", sleeps.append)
+    client, calls = make_client(
+        [LLMRateLimitError(429, "slow down", retry_after=300), "ok"], max_retry_after=60,
+    )
+    with pytest.raises(LLMRateLimitError) as info:
+        client.post({})
+    assert info.value.retry_after == 300
+    assert "retry after 300 s" in str(info.value)
+    assert len(calls) == 1
+    assert sleeps == []
+
+
+def test_retry_after_within_cap_is_waited_out(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("core.http_client.time.sleep", sleeps.append)
+    client, calls = make_client(
+        [LLMRateLimitError(429, "slow down", retry_after=30), "ok"], max_retry_after=60,
+    )
+    assert client.post({}) == "ok"
+    assert len(calls) == 2
+    assert sleeps[0] >= 30
+
+
+def test_transient_errors_are_retried(monkeypatch):
+    monkeypatch.setattr("core.http_client.time.sleep", lambda seconds: None)
+    client, calls = make_client([LLMTimeoutError("t"), LLMTimeoutError("t"), "ok"])
+    assert client.post({}) == "ok"
+    assert len(calls) == 3
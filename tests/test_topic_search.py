@@ -0,0 +1,33 @@
+import time
+
+import pytest
+
+from utils import topic_manager
+from utils.topic_archive import TopicArchive
+from utils.topic_backends import JsonTopicBackend, SqliteTopicBackend
+
+
+@pytest.fixture(params=["sqlite", "json"])
+def store(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(topic_manager, "_backend", None)
+    monkeypatch.setattr(topic_manager, "_cache", None)
+    monkeypatch.setattr(topic_manager, "_archive", TopicArchive(tmp_path / "archive"))
+    if request.param == "sqlite":
+        topic_manager.set_backend(SqliteTopicBackend(tmp_path / "topics.db"))
+    else:
+        topic_manager.set_backend(JsonTopicBackend(tmp_path / "topics.json"))
+    return topic_manager
+
+
+def test_search_returns_hot_and_archived_hits(store):
+    old = store.create_topic("photosynthesis", 4)
+    store.add_message(old, "teacher", "Chlorophyll absorbs red and blue light.")
+    store.add_message(old, "student", "Why are leaves green then?")
+    assert store.compact(0, time.time() + 2 * 86400)["archived"] == 1
+
+    hot = store.create_topic("pools", 4)
+    store.add_message(hot, "teacher", "Chlorine keeps swimming pools clean.")
+
+    hits = store.search_messages("chlor")
+    assert [(h["topic_id"], bool(h.get("archived"))) for h in hits] == [(hot, False), (old, True)]
+    assert store.search_messages("chlor", limit=1)[0]["topic_id"] == hot
@@ -0,0 +1,405 @@
+"""Local retrieval index over uploaded documents.
+
+Uploaded PDFs (and ``.txt``/``.md`` files) are split into overlapping
+word windows. Each chunk becomes a hashed bag-of-words vector: every word
+maps to one of ``RETRIEVAL_DIM`` signed buckets through a stable CRC32
+hash, so no vocabulary is stored and no network model is needed. Queries
+are scored against all chunks in one matrix-vector product, using TF-IDF
+cosine similarity with document frequencies kept per bucket.
+
+On disk (``DOC_INDEX_DIR``):
+
+* ``vectors.<gen>.f32``: an append-only float32 matrix, one row per
+  chunk, opened with ``numpy.memmap``. It loads instantly, and every
+  process shares the same page cache.
+* ``chunks.<gen>.jsonl`` with ``offsets.<gen>.i64``: the chunk texts, and
+  the byte offset of each row's line, so a hit is read without a scan.
+* ``meta.json``: the generation, row count, the documents with their row
+  ranges and checksums, and the per-bucket document frequencies. It is
+  written last, with an atomic rename, so readers never see a
+  half-appended document.
+
+Adding a document appends rows; re-uploading an unchanged file is a
+no-op, and replacing or removing one only marks its rows dead. Dead rows
+are dropped once they make up half the index by copying the live rows
+into the next generation's files. ``meta.json`` then switches to the new
+generation and only after that are the old files deleted, so a reader
+still on the previous ``meta.json`` keeps reading consistent files.
+Generation 0 uses the unsuffixed names of indexes built before
+generations existed.
+"""
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from utils.file_lock import FileLock, atomic_write_json, file_token
+from utils.search_index import tokenize
+
+DOC_INDEX_DIR = Path(os.getenv("DOC_INDEX_DIR", "data/doc_index"))
+DIM = int(os.getenv("RETRIEVAL_DIM", "2048"))
+CHUNK_WORDS = int(os.getenv("RETRIEVAL_CHUNK_WORDS", "160"))
+CHUNK_OVERLAP = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP", "40"))
+NORM_BLOCK = 8192  # rows per block when computing row norms
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in into is it its "
+    "of on or our she so than that the their them then there these they this to was we "
+    "were what when which who will with you your".split()
+)
+
+
+def _empty_meta(dim):
+    return {"dim": dim, "gen": 0, "rows": 0, "dead": 0, "docs": {}, "df": [0] * dim}
+
+
+def extract_pages(path):
+    """Text of each page of a PDF, or the whole file as one page for text files."""
+    path = Path(path)
+    if path.suffix.lower() != ".pdf":
+        return [path.read_text(encoding="utf-8", errors="replace")]
+    from pypdf import PdfReader
+
+    return [page.extract_text() or "" for page in PdfReader(str(path)).pages]
+
+
+def chunk_pages(pages, size=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """(page number, text) windows of ``size`` words, ``overlap`` words apart from the next."""
+    step = max(1, size - overlap)
+    chunks = []
+    for number, text in enumerate(pages, 1):
+        words = re.sub(r"\s+", " ", text).split()
+        for start in range(0, max(1, len(words) - overlap), step):
+            window = words[start:start + size]
+            if window:
+                chunks.append((number, " ".join(window)))
+    return chunks
+
+
+def _term(word):
+    # Fold plain plurals ("orbits" -> "orbit") so they match the singular.
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _buckets(text, dim):
+    """{bucket: signed sublinear tf} for ``text``."""
+    counts = {}
+    for word in tokenize(text):
+        if word not in STOPWORDS and len(word) > 1:
+            word = _term(word)
+            counts[word] = counts.get(word, 0) + 1
+    buckets = {}
+    for word, tf in counts.items():
+        h = zlib.crc32(word.encode("utf-8"))
+        sign = 1.0 if h & 0x80000000 else -1.0
+        index = h % dim
+        buckets[index] = buckets.get(index, 0.0) + sign * (1.0 + math.log(tf))
+    return buckets
+
+
+def vectorize(texts, dim=DIM):
+    import numpy as np
+
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for index, value in _buckets(text, dim).items():
+            matrix[row, index] = value
+    return matrix
+
+
+class DocIndex:
+    def __init__(self, root=DOC_INDEX_DIR, dim=DIM):
+        self.root = Path(root)
+        self.dim = dim
+        self.meta_path = self.root / "meta.json"
+        self.lock = FileLock(self.meta_path)
+        self._mutex = threading.Lock()
+        self._meta = (None, None)   # (meta token, parsed meta)
+        self._view = None   # (meta token, meta, vectors memmap, offsets, chunks mmap, alive mask, weighting)
+
+    def version(self):
+        return file_token(self.meta_path)
+
+    def files(self, gen):
+        """(vectors, chunks, offsets) paths of generation ``gen``."""
+        tag = f".{gen}" if gen else ""
+        return (self.root / f"vectors{tag}.f32", self.root / f"chunks{tag}.jsonl",
+                self.root / f"offsets{tag}.i64")
+
+    def _read_meta(self):
+        try:
+            meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return _empty_meta(self.dim)
+        return meta
+
+    def meta(self):
+        """``meta.json``, parsed again only when it changed; treat as read-only."""
+        token = self.version()
+        with self._mutex:
+            if self._meta[0] == token and token is not None:
+                return self._meta[1]
+        meta = self._read_meta()
+        with self._mutex:
+            self._meta = (token, meta)
+        return meta
+
+    def documents(self):
+        """{doc id: {name, sha256, chunks, pages, added}} for every indexed document."""
+        return {
+            doc_id: {k: v for k, v in doc.items() if k != "rows"}
+            for doc_id, doc in self.meta()["docs"].items()
+        }
+
+    def __len__(self):
+        meta = self.meta()
+        return meta["rows"] - meta["dead"]
+
+    # -- writes ---------------------------------------------------------
+    def add(self, path, doc_id=None):
+        """Index ``path`` under ``doc_id`` (default: its file name); returns chunks added.
+
+        A file whose checksum is already indexed under the same id is skipped;
+        a changed one replaces the old rows.
+        """
+        import numpy as np
+
+        path = Path(path)
+        doc_id = doc_id or path.name
+        sha = hashlib.sha256(path.read_bytes()).hexdigest()
+        if self.meta()["docs"].get(doc_id, {}).get("sha256") == sha:
+            return 0
+        # Extraction and vectorizing happen outside the lock.
+        pages = extract_pages(path)
+        chunks = chunk_pages(pages)
+        vectors = vectorize([text for _, text in chunks], self.dim)
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            meta = self._read_meta()
+            if meta["dim"] != self.dim:
+                raise ValueError(f"{self.root} was built with RETRIEVAL_DIM={meta['dim']}")
+            if meta["docs"].get(doc_id, {}).get("sha256") == sha:
+                return 0
+            if doc_id in meta["docs"]:
+                self._drop(meta, doc_id)
+            start = meta["rows"]
+            self._append(meta.get("gen", 0), start, vectors, [
+                {"doc": doc_id, "page": page, "text": text} for page, text in chunks
+            ])
+            df = np.asarray(meta["df"], dtype=np.int64) + (vectors != 0).sum(axis=0)
+            meta["df"] = df.tolist()
+            meta["rows"] = start + len(chunks)
+            meta["docs"][doc_id] = {
+                "name": path.name,
+                "sha256": sha,
+                "rows": [start, start + len(chunks)],
+                "chunks": len(chunks),
+                "pages": len(pages),
+                "added": time.time(),
+            }
+            atomic_write_json(self.meta_path, meta, indent=None)
+            if meta["dead"] * 2 > meta["rows"]:
+                self._rewrite(meta)
+        return len(chunks)
+
+    def _append(self, gen, start, vectors, records):
+        """Append rows ``start..`` to generation ``gen``'s files, truncating any torn tail first."""
+        import numpy as np
+
+        vectors_path, chunks_path, offsets_path = self.files(gen)
+        row_bytes = self.dim * 4
+        offsets = []
+        with open(chunks_path, "ab") as f:
+            f.truncate(self._text_end(gen, start))
+            f.seek(0, os.SEEK_END)
+            for record in records:
+                offsets.append(f.tell())
+                f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        for path, data, width in ((vectors_path, vectors, row_bytes),
+                                  (offsets_path, np.asarray(offsets, dtype=np.int64), 8)):
+            with open(path, "ab") as f:
+                f.truncate(start * width)
+                f.seek(0, os.SEEK_END)
+                f.write(data.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _text_end(self, gen, rows):
+        """Byte length of the first ``rows`` chunk lines of generation ``gen``."""
+        if not rows:
+            return 0
+        import numpy as np
+
+        _, chunks_path, offsets_path = self.files(gen)
+        offsets = np.fromfile(offsets_path, dtype=np.int64, count=rows)
+        with open(chunks_path, "rb") as f:
+            f.seek(int(offsets[-1]))
+            return int(offsets[-1]) + len(f.readline())
+
+    def _drop(self, meta, doc_id):
+        import numpy as np
+
+        doc = meta["docs"].pop(doc_id)
+        start, end = doc["rows"]
+        vectors_path = self.files(meta.get("gen", 0))[0]
+        rows = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(meta["rows"], self.dim))[start:end]
+        meta["df"] = (np.asarray(meta["df"], dtype=np.int64) - (rows != 0).sum(axis=0)).clip(0).tolist()
+        meta["dead"] += end - start
+
+    def remove(self, doc_id):
+        with self.lock:
+            meta = self._read_meta()
+            if doc_id not in meta["docs"]:
+                return False
+            self._drop(meta, doc_id)
+            atomic_write_json(self.meta_path, meta, indent=None)
+            if meta["dead"] * 2 > meta["rows"]:
+                self._rewrite(meta)
+        return True
+
+    def _rewrite(self, meta):
+        """Copy the live rows into the next generation's files (caller holds the lock)."""
+        import numpy as np
+
+        old = meta.get("gen", 0)
+        gen = old + 1
+        vectors = np.memmap(self.files(old)[0], dtype=np.float32, mode="r", shape=(meta["rows"], self.dim))
+        records = list(self._records(meta))
+        keep = [(doc_id, doc) for doc_id, doc in sorted(meta["docs"].items(), key=lambda d: d[1]["rows"][0])]
+        parts = [np.array(vectors[doc["rows"][0]:doc["rows"][1]]) for _, doc in keep]
+        live_records = []
+        row = 0
+        for doc_id, doc in keep:
+            start, end = doc["rows"]
+            live_records.extend(records[start:end])
+            doc["rows"] = [row, row + end - start]
+            row += end - start
+        del vectors
+        for path in self.files(gen):
+            path.unlink(missing_ok=True)   # left over from an interrupted rewrite
+        matrix = np.concatenate(parts) if parts else np.zeros((0, self.dim), dtype=np.float32)
+        self._append(gen, 0, matrix, live_records)
+        meta.update(gen=gen, rows=row, dead=0)
+        atomic_write_json(self.meta_path, meta, indent=None)
+        # Readers switch with meta.json; older generations can go now. On
+        # Windows a file still mapped by a reader can't be deleted, so
+        # whatever is left is retried on the next rewrite.
+        for stale in range(gen):
+            for path in self.files(stale):
+                try:
+                    path.unlink(missing_ok=True)
+                except OSError:
+                    pass
+
+    def _records(self, meta):
+        with open(self.files(meta.get("gen", 0))[1], "rb") as f:
+            for _ in range(meta["rows"]):
+                yield json.loads(f.readline())
+
+    # -- reads ----------------------------------------------------------
+    def _load(self):
+        """Memory-mapped view of the index, reopened only when ``meta.json`` changes."""
+        import numpy as np
+
+        token = self.version()
+        with self._mutex:
+            if self._view is not None and self._view[0] == token:
+                return self._view
+        meta = self._read_meta()
+        rows = meta["rows"]
+        if not rows or meta["dim"] != self.dim:
+            view = (token, meta, None, None, None, None, None)
+        else:
+            vectors_path, chunks_path, offsets_path = self.files(meta.get("gen", 0))
+            try:
+                vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+                offsets = np.memmap(offsets_path, dtype=np.int64, mode="r", shape=(rows,))
+                # Mapped rather than reopened per search, so hits stay readable
+                # after a rewrite deletes this generation.
+                with open(chunks_path, "rb") as f:
+                    chunks = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # This generation was just replaced; the next call sees the new meta.json.
+                return (None, meta, None, None, None, None, None)
+            alive = np.zeros(rows, dtype=bool)
+            for doc in meta["docs"].values():
+                alive[doc["rows"][0]:doc["rows"][1]] = True
+            live = rows - meta["dead"]
+            idf = np.log((1.0 + live) / (1.0 + np.asarray(meta["df"], dtype=np.float32))) + 1.0
+            weights = (idf * idf).astype(np.float32)
+            # |x * idf| per row, computed once per index version in bounded blocks.
+            norms = np.empty(rows, dtype=np.float32)
+            for block in range(0, rows, NORM_BLOCK):
+                part = vectors[block:block + NORM_BLOCK]
+                norms[block:block + NORM_BLOCK] = np.sqrt((part * part) @ weights)
+            norms[norms == 0] = 1.0
+            view = (token, meta, vectors, offsets, chunks, alive, (weights, norms))
+        with self._mutex:
+            self._view = view
+        return view
+
+    def search(self, query, k=3):
+        """Top ``k`` chunks for ``query``: dicts with doc, name, page, text and score."""
+        import numpy as np
+
+        _, meta, vectors, offsets, chunks, alive, weighting = self._load()
+        if vectors is None or not query or k <= 0:
+            return []
+        weights, norms = weighting
+        q = vectorize([query], self.dim)[0]
+        q_norm = float(np.sqrt((q * q) @ weights))
+        if not q_norm:
+            return []
+        scores = (vectors @ (q * weights)) / (norms * q_norm)
+        scores[~alive] = -1.0
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for row in top:
+            if scores[row] <= 0:
+                break
+            start = int(offsets[row])
+            end = chunks.find(b"\n", start)
+            record = json.loads(chunks[start:end if end >= 0 else len(chunks)])
+            doc = meta["docs"].get(record["doc"], {})
+            results.append(dict(record, name=doc.get("name", record["doc"]), score=float(scores[row])))
+        return results
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = DocIndex()
+    return _index
+
+
+def has_documents():
+    """Cheap check (a stat, plus a parse when the index changed) that keeps NumPy
+    off the turn path until a document is uploaded."""
+    return get_index().version() is not None and len(get_index()) > 0
+
+
+def ingest(path, doc_id=None):
+    return get_index().add(path, doc_id)
+
+
+def search(query, k=3):
+    return get_index().search(query, k)
@@ -0,0 +1,241 @@
+"""Export conversations to Markdown, JSONL and PDF.
+
+Messages are streamed from the topic store one at a time, so Markdown and
+JSONL exports use constant memory however long the topic is. PDF pages
+are built by fpdf, which keeps the document in memory until it is saved.
+Every file is written to a temp name and renamed into place.
+
+:func:`artifact` backs the Streamlit download button. It keeps one
+rendered file per topic and format under ``EXPORT_CACHE_DIR``, named
+after the topic's message count and last activity, and renders again only
+when the topic changed. :func:`export_all` writes every topic over a
+process pool, one file per topic and format, plus a ``manifest.json``.
+It skips topics that are unchanged since the manifest was written:
+
+    python -m utils.exporter -o exports --format md,jsonl,pdf --workers 4
+    python -m utils.exporter -o exports --topic <topic_id>
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_all_start_methods, get_context
+from pathlib import Path
+
+from utils.file_lock import atomic_write_json
+from utils import topic_manager
+
+EXPORT_CACHE_DIR = Path(os.getenv("EXPORT_CACHE_DIR", "data/exports"))
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+FORMATS = ("md", "jsonl", "pdf")
+MIME_TYPES = {"md": "text/markdown", "jsonl": "application/x-ndjson", "pdf": "application/pdf"}
+
+# The PDF core fonts only cover Latin-1.
+_LATIN1 = str.maketrans({
+    "‘": "'", "’": "'", "“": '"', "”": '"',
+    "–": "-", "—": "-", "…": "...", " ": " ", "•": "*",
+})
+
+
+def _role_label(role):
+    return (role or "?").capitalize()
+
+
+def write_markdown(entry, messages, f):
+    f.write(f"# {entry['topic']}\n\n")
+    f.write(f"_Topic {entry['topic_id']} · {entry['turns']} messages_\n")
+    for msg in messages:
+        stamp = f" · {msg['time']}" if msg.get("time") else ""
+        f.write(f"\n## {_role_label(msg.get('role'))}{stamp}\n\n{msg.get('message', '')}\n")
+
+
+def write_jsonl(entry, messages, f):
+    header = {k: entry.get(k) for k in ("topic_id", "topic", "max_turns", "created", "last_activity")}
+    f.write(json.dumps(dict(header, type="topic"), ensure_ascii=False) + "\n")
+    for i, msg in enumerate(messages):
+        f.write(json.dumps({"type": "message", "index": i, **msg}, ensure_ascii=False) + "\n")
+
+
+def _pdf_text(text):
+    return (text or "").translate(_LATIN1).encode("latin-1", "replace").decode("latin-1")
+
+
+def write_pdf(entry, messages, path):
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.set_auto_page_break(True, margin=15)
+    pdf.add_page()
+    pdf.set_font("Helvetica", "B", 16)
+    pdf.multi_cell(0, 8, _pdf_text(entry["topic"]))
+    pdf.set_font("Helvetica", "", 9)
+    pdf.multi_cell(0, 5, _pdf_text(f"Topic {entry['topic_id']} - {entry['turns']} messages"))
+    for msg in messages:
+        pdf.ln(4)
+        pdf.set_font("Helvetica", "B", 11)
+        stamp = f"  ({msg['time']})" if msg.get("time") else ""
+        pdf.multi_cell(0, 6, _pdf_text(_role_label(msg.get("role")) + stamp))
+        pdf.set_font("Helvetica", "", 11)
+        pdf.multi_cell(0, 6, _pdf_text(msg.get("message", "")))
+    pdf.output(str(path))
+
+
+def _write(entry, fmt, path):
+    """Render one topic to ``path`` atomically."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    messages = topic_manager.iter_topic_messages(entry["topic_id"])
+    try:
+        if fmt == "pdf":
+            write_pdf(entry, messages, tmp)
+        else:
+            writer = write_markdown if fmt == "md" else write_jsonl
+            with open(tmp, "w", encoding="utf-8") as f:
+                writer(entry, messages, f)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return path
+
+
+def _check_format(fmt):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt!r} (expected one of {', '.join(FORMATS)})")
+
+
+def _revision(entry):
+    """Changes whenever a message is added to the topic."""
+    return f"{entry['turns']}-{int((entry['last_activity'] or 0) * 1000)}"
+
+
+def artifact(topic_id, fmt, cache_dir=EXPORT_CACHE_DIR):
+    """Path of an up-to-date rendering of ``topic_id``, or None if the topic is gone."""
+    _check_format(fmt)
+    entry = topic_manager.get_topic_entry(topic_id)
+    if entry is None:
+        return None
+    cache_dir = Path(cache_dir)
+    path = cache_dir / f"{topic_id}.{_revision(entry)}.{fmt}"
+    if path.exists():
+        return path
+    _write(entry, fmt, path)
+    for stale in cache_dir.glob(f"{topic_id}.*.{fmt}"):
+        if stale != path:
+            try:
+                stale.unlink()
+            except OSError:
+                pass
+    return path
+
+
+def _safe_name(text, limit=40):
+    return re.sub(r"[^A-Za-z0-9]+", "-", text or "").strip("-")[:limit].lower() or "topic"
+
+
+def _init_worker():
+    # A forked child must not share the parent's SQLite connections: reopen the store.
+    backend = topic_manager.get_backend()
+    topic_manager.set_backend(type(backend)(backend.path))
+
+
+def _export_one(job):
+    """Process-pool task: write every format of one topic; returns its manifest entry."""
+    entry, out_dir, formats = job
+    files = {}
+    for fmt in formats:
+        path = Path(out_dir) / f"{_safe_name(entry['topic'])}-{entry['topic_id'][:8]}.{fmt}"
+        _write(entry, fmt, path)
+        data = path.read_bytes()
+        files[fmt] = {"path": path.name, "bytes": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+    return dict(entry, revision=_revision(entry), files=files)
+
+
+def _all_entries():
+    page = 0
+    while True:
+        entries, total = topic_manager.list_topics(page, 500)
+        yield from entries
+        page += 1
+        if page * 500 >= total:
+            return
+
+
+def export_all(out_dir, formats=FORMATS, workers=EXPORT_WORKERS, topic_ids=None):
+    """Export topics (all, or ``topic_ids``) to ``out_dir``; returns the manifest.
+
+    Topics whose revision and files match the previous manifest are kept as is.
+    """
+    for fmt in formats:
+        _check_format(fmt)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = out_dir / "manifest.json"
+    try:
+        previous = {t["topic_id"]: t for t in json.loads(manifest_path.read_text(encoding="utf-8"))["topics"]}
+    except (OSError, ValueError, KeyError):
+        previous = {}
+
+    if topic_ids is None:
+        entries = list(_all_entries())
+    else:
+        entries = [e for e in map(topic_manager.get_topic_entry, topic_ids) if e is not None]
+    done, jobs = [], []
+    for entry in entries:
+        old = previous.get(entry["topic_id"])
+        if (old and old["revision"] == _revision(entry) and set(formats) <= set(old["files"])
+                and all((out_dir / old["files"][f]["path"]).exists() for f in formats)):
+            done.append(old)
+        else:
+            jobs.append((entry, str(out_dir), tuple(formats)))
+
+    if jobs and workers > 1:
+        method = "fork" if "fork" in get_all_start_methods() else "spawn"
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context(method),
+                                 initializer=_init_worker) as pool:
+            done.extend(pool.map(_export_one, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        done.extend(map(_export_one, jobs))
+
+    manifest = {
+        "generated_at": time.time(),
+        "formats": list(formats),
+        "exported": len(jobs),
+        "unchanged": len(entries) - len(jobs),
+        "topics": sorted(done, key=lambda e: e["last_activity"] or 0, reverse=True),
+    }
+    atomic_write_json(manifest_path, manifest)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export conversations to Markdown, JSONL and PDF.")
+    parser.add_argument("-o", "--output", default="exports", help="directory for the files and manifest.json")
+    parser.add_argument("--format", default=",".join(FORMATS), help="comma-separated: md, jsonl, pdf")
+    parser.add_argument("--topic", action="append", dest="topics", help="export only this topic id (repeatable)")
+    parser.add_argument("--workers", type=int, default=EXPORT_WORKERS, help="processes for bulk export")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    manifest = export_all(args.output, [f.strip() for f in args.format.split(",") if f.strip()],
+                          args.workers, args.topics)
+    print(
+        f"{manifest['exported']} exported, {manifest['unchanged']} unchanged "
+        f"in {time.perf_counter() - start:.1f} s -> {args.output}/manifest.json",
+        file=sys.stderr,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""Inter-process locking and crash-safe writes for the JSON files under data/.
+
+``FileLock`` takes an exclusive OS lock on a ``<file>.lock`` sidecar:
+``fcntl.flock`` on POSIX and ``msvcrt.locking`` on Windows. Every
+read-modify-write of a shared JSON file runs under it. ``atomic_write_json``
+writes a temp file, fsyncs it and renames it over the target, so readers
+only ever see the old or the new file, never a torn one.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """Exclusive lock shared by every thread and process that uses the same path.
+
+    Not reentrant: nesting two ``FileLock`` blocks for one path in the same
+    thread deadlocks.
+    """
+
+    _thread_locks = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, path, timeout=30.0):
+        self.lock_path = Path(f"{path}.lock")
+        self.timeout = timeout
+        self._fd = None
+        with self._registry_lock:
+            key = str(self.lock_path.resolve())
+            # flock also excludes other fds in this process, but a thread lock
+            # keeps same-process contention off the OS lock path.
+            self._thread_lock = self._thread_locks.setdefault(key, threading.Lock())
+
+    def acquire(self):
+        if not self._thread_lock.acquire(timeout=self.timeout):
+            raise TimeoutError(f"Timed out waiting for {self.lock_path}")
+        try:
+            self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(str(self.lock_path), os.O_RDWR | os.O_CREAT, 0o644)
+            self._os_lock()
+        except BaseException:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._thread_lock.release()
+            raise
+
+    def _os_lock(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(self._fd, msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Timed out waiting for {self.lock_path}")
+                time.sleep(0.005)
+
+    def release(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def atomic_write_json(path, data, indent=4):
+    """Write ``data`` as JSON to a temp file, fsync, then rename it over ``path``."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def quarantine(path):
+    """Move an unreadable file aside instead of silently overwriting it."""
+    path = Path(path)
+    target = path.with_name(f"{path.name}.corrupt-{int(time.time())}")
+    try:
+        os.replace(path, target)
+    except OSError:
+        return None
+    return target
+
+
+def file_token(path):
+    """(inode, mtime_ns, size) of ``path``, or None if it does not exist.
+
+    The inode tells apart two atomic renames that land in the same clock
+    tick with the same size.
+    """
+    try:
+        stat = Path(path).stat()
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
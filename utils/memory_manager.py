@@ -1,53 +1,239 @@
+import atexit
 import json
+import os
+import threading
 from pathlib import Path
 from datetime import datetime
 
-MEMORY_FILE = Path("data/shared_memory.json")
+from core.config import get_setting
+from utils.file_lock import FileLock, atomic_write_json, file_token, quarantine
+from utils.topic_archive import window_of
+
+MEMORY_FILE = Path(get_setting("MEMORY_FILE"))
 DEFAULT_PAYLOAD = {"conversation": []}
 
+# Write-behind settings: flush after this many seconds or unflushed
+# messages, whichever comes first. MEMORY_SYNC=1 writes on every append.
+FLUSH_INTERVAL = float(os.getenv("MEMORY_FLUSH_INTERVAL", "1.0"))
+FLUSH_BATCH = int(os.getenv("MEMORY_FLUSH_BATCH", "20"))
+SYNC_WRITES = os.getenv("MEMORY_SYNC", "").lower() in ("1", "true", "yes", "on")
+
 
 def _ensure_memory_file():
     MEMORY_FILE.parent.mkdir(parents=True, exist_ok=True)
     if not MEMORY_FILE.exists():
-        MEMORY_FILE.write_text(json.dumps(DEFAULT_PAYLOAD, indent=4), encoding="utf-8")
+        with FileLock(MEMORY_FILE):
+            if not MEMORY_FILE.exists():
+                atomic_write_json(MEMORY_FILE, DEFAULT_PAYLOAD)
 
 
-def _safe_load():
-    _ensure_memory_file()
+def _read_disk():
     try:
         return json.loads(MEMORY_FILE.read_text(encoding="utf-8"))
-    except Exception:
-        MEMORY_FILE.write_text(json.dumps(DEFAULT_PAYLOAD, indent=4), encoding="utf-8")
-        return DEFAULT_PAYLOAD.copy()
+    except FileNotFoundError:
+        return {"conversation": []}
+    except ValueError:
+        # Saves are atomic renames, so this is genuine corruption rather than
+        # a concurrent write: keep the bad file for inspection.
+        quarantine(MEMORY_FILE)
+        return {"conversation": []}
+
+
+def _entry_time(entry):
+    try:
+        return datetime.strptime(entry.get("time") or "", "%Y-%m-%d %H:%M").timestamp()
+    except ValueError:
+        return 0
+
+
+def _safe_load():
+    _ensure_memory_file()
+    return _read_disk()
+
+
+class ConversationBuffer:
+    """Authoritative in-memory copy of the shared conversation.
+
+    Appends and counts are O(1) and never touch the disk; a background
+    thread flushes the whole list with an atomic rename once
+    ``flush_interval`` seconds pass or ``flush_batch`` messages are
+    pending, and again at interpreter exit. ``sync=True`` flushes on
+    every append, like the original implementation.
+
+    Flushes hold an inter-process lock. If another process rewrote the file
+    since this buffer last synced, its entries are kept and only this
+    process's unflushed appends are added after them.
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, flush_batch=FLUSH_BATCH, sync=SYNC_WRITES):
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.sync = sync
+        self._lock = threading.RLock()
+        self._conversation = None
+        self._pending = 0
+        self._overwrite = False
+        self._disk_token = None
+        self._wakeup = threading.Event()
+        self._flusher = None
+
+    def _loaded(self):
+        if self._conversation is None:
+            _ensure_memory_file()
+            # Read and stat under the lock, so the token is the one of the content read.
+            with FileLock(MEMORY_FILE):
+                self._conversation = _read_disk().get("conversation", [])
+                self._disk_token = file_token(MEMORY_FILE)
+        return self._conversation
+
+    def append(self, role, message):
+        with self._lock:
+            conversation = self._loaded()
+            conversation.append({
+                "role": role,
+                "message": message,
+                "turn": len(conversation) + 1,
+                "time": datetime.now().strftime("%Y-%m-%d %H:%M"),
+            })
+            self._pending += 1
+            if self.sync or self._pending >= self.flush_batch:
+                self.flush()
+            else:
+                self._start_flusher()
+
+    def count(self):
+        with self._lock:
+            return len(self._loaded())
+
+    def last(self):
+        with self._lock:
+            conversation = self._loaded()
+            return conversation[-1] if conversation else None
+
+    def snapshot(self):
+        with self._lock:
+            return {"conversation": list(self._loaded())}
+
+    def since(self, start):
+        """Entries from index ``start`` on; copies only that tail."""
+        with self._lock:
+            return self._loaded()[start:]
+
+    def replace(self, data):
+        with self._lock:
+            self._conversation = list(data.get("conversation", []))
+            self._pending = 1
+            self._overwrite = True
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending or self._conversation is None:
+                return
+            with FileLock(MEMORY_FILE):
+                if not self._overwrite and file_token(MEMORY_FILE) != self._disk_token:
+                    self._merge_from_disk()
+                atomic_write_json(MEMORY_FILE, {"conversation": self._conversation})
+                self._disk_token = file_token(MEMORY_FILE)
+            self._pending = 0
+            self._overwrite = False
+
+    def archive_older(self, archive, cutoff):
+        """Move entries stamped before ``cutoff`` (epoch seconds) into ``archive``.
+
+        Entries are stored as ``memory`` segments, one per archive window, and
+        the rest stay here. Returns how many entries moved.
+        """
+        stamp = datetime.fromtimestamp(cutoff).strftime("%Y-%m-%d %H:%M")
+        with self._lock:
+            self.flush()
+            with FileLock(MEMORY_FILE):
+                conversation = _read_disk().get("conversation", [])
+                count = 0
+                while count < len(conversation) and (conversation[count].get("time") or "") < stamp:
+                    count += 1
+                if not count:
+                    return 0
+                windows = {}
+                for entry in conversation[:count]:
+                    windows.setdefault(window_of(_entry_time(entry)), []).append(entry)
+                for window, entries in windows.items():
+                    archive.store("memory", window, entries, newest=_entry_time(entries[-1]))
+                self._conversation = conversation[count:]
+                atomic_write_json(MEMORY_FILE, {"conversation": self._conversation})
+                self._disk_token = file_token(MEMORY_FILE)
+            return count
+
+    def _merge_from_disk(self):
+        ours = self._conversation[len(self._conversation) - self._pending:]
+        merged = _read_disk().get("conversation", [])
+        for entry in ours:
+            entry["turn"] = len(merged) + 1
+            merged.append(entry)
+        self._conversation = merged
+
+    def _start_flusher(self):
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(target=self._flush_loop, name="memory-flusher", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._wakeup.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError:
+                # Keep the data in memory and retry on the next tick.
+                pass
+
+
+_buffer = ConversationBuffer()
+atexit.register(_buffer.flush)
+
+
+def get_buffer():
+    return _buffer
+
+
+def set_sync_mode(sync=True):
+    """Flush on every append (True) or write behind (False)."""
+    _buffer.sync = sync
+    if sync:
+        _buffer.flush()
+
+
+def flush_memory():
+    _buffer.flush()
 
 
 def load_memory():
-    return _safe_load()
+    return _buffer.snapshot()
+
+
+def messages_since(start):
+    return _buffer.since(start)
 
 
 def save_memory(data):
-    _ensure_memory_file()
-    MEMORY_FILE.write_text(json.dumps(data, indent=4), encoding="utf-8")
+    _buffer.replace(data)
 
 
 def append_message(role, message):
-    mem = _safe_load()
-    turn_number = len(mem["conversation"]) + 1
+    _buffer.append(role, message)
 
-    mem["conversation"].append({
-        "role": role,
-        "message": message,
-        "turn": turn_number,
-        "time": datetime.now().strftime("%Y-%m-%d %H:%M"),
-    })
 
-    save_memory(mem)
+def get_turn_count():
+    return _buffer.count()
 
 
-def get_turn_count():
-    return len(_safe_load()["conversation"])
+def get_last_entry():
+    return _buffer.last()
+
+
+def archive_memory(archive, cutoff):
+    """Move shared-memory entries older than ``cutoff`` (epoch seconds) into ``archive``."""
+    return _buffer.archive_older(archive, cutoff)
 
 
 def ensure_memory_store():
     """Public helper to ensure memory file exists; safe to call at startup."""
-    _ensure_memory_file()
\ No newline at end of file
+    _ensure_memory_file()
@@ -0,0 +1,174 @@
+"""In-memory inverted index over topic messages.
+
+The SQLite backend searches with FTS5; this index serves the JSON backend
+(and SQLite builds without FTS5). Postings map each lowercased word to the
+messages containing it, results are ranked with BM25 and the last query
+word also matches as a prefix, so results update while typing.
+"""
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+SNIPPET_WORDS = 16
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text):
+    return [w.lower() for w in _WORD.findall(text or "")]
+
+
+def query_terms(query):
+    """(exact terms, prefix term or None) for a free-text query."""
+    words = tokenize(query)
+    if not words:
+        return [], None
+    return words[:-1], words[-1]
+
+
+def fts_query(query):
+    """Free text as an FTS5 MATCH expression: every word quoted, last one a prefix."""
+    terms, prefix = query_terms(query)
+    if prefix is None:
+        return None
+    return " ".join([f'"{t}"' for t in terms] + [f'"{prefix}"*'])
+
+
+def make_snippet(text, terms, prefix=None, words=SNIPPET_WORDS):
+    """A window of ``text`` around the first hit, with matches in **bold**."""
+    text = text or ""
+    tokens = list(_WORD.finditer(text))
+    if not tokens:
+        return text[:80]
+
+    def hit(word):
+        word = word.lower()
+        return word in terms or (prefix is not None and word.startswith(prefix))
+
+    first = next((i for i, m in enumerate(tokens) if hit(m.group())), 0)
+    start = max(0, first - words // 4)
+    end = min(len(tokens), start + words)
+    pos = tokens[start].start() if start else 0
+    parts = ["…"] if start else []
+    for m in tokens[start:end]:
+        parts.append(text[pos:m.start()])
+        parts.append(f"**{m.group()}**" if hit(m.group()) else m.group())
+        pos = m.end()
+    parts.append("…" if end < len(tokens) else text[pos:])
+    return "".join(parts)
+
+
+class InvertedIndex:
+    """Word -> {doc: term frequency}; a doc is ``(topic_id, position)``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.clear()
+
+    def clear(self):
+        self.postings = {}
+        self.docs = {}          # doc -> (role, message, length)
+        self.titles = {}        # topic_id -> [title, message count]
+        self.total_length = 0
+
+    def rebuild(self, data, version):
+        with self._lock:
+            self.clear()
+            for topic in data.get("topics", []):
+                self._add_topic(topic)
+            self.version = version
+
+    def _add_topic(self, topic):
+        self.titles[topic["topic_id"]] = [topic.get("topic", ""), 0]
+        for message in topic.get("messages", []):
+            self._add_message(topic["topic_id"], message)
+
+    def _add_message(self, topic_id, message):
+        entry = self.titles.get(topic_id)
+        if entry is None:
+            return
+        doc = (topic_id, entry[1])
+        entry[1] += 1
+        words = tokenize(message.get("message", ""))
+        self.docs[doc] = (message.get("role", ""), message.get("message", ""), len(words))
+        self.total_length += len(words)
+        for word, tf in Counter(words).items():
+            self.postings.setdefault(word, {})[doc] = tf
+
+    def _drop_topic(self, topic_id):
+        entry = self.titles.pop(topic_id, None)
+        if entry is None:
+            return
+        for position in range(entry[1]):
+            _, message, length = self.docs.pop((topic_id, position))
+            self.total_length -= length
+            for word in set(tokenize(message)):
+                postings = self.postings.get(word)
+                if postings is not None:
+                    postings.pop((topic_id, position), None)
+                    if not postings:
+                        del self.postings[word]
+
+    def apply(self, before, after, change):
+        """Patch the index in place if it was current at ``before``; else mark it stale."""
+        with self._lock:
+            if self.version is not None and self.version == before:
+                change()
+                self.version = after
+            else:
+                self.version = None
+
+    def on_create(self, topic):
+        return lambda: self._add_topic(topic)
+
+    def on_message(self, topic_id, message):
+        return lambda: self._add_message(topic_id, message)
+
+    def on_delete(self, topic_id):
+        return lambda: self._drop_topic(topic_id)
+
+    def search(self, query, limit=20):
+        terms, prefix = query_terms(query)
+        if prefix is None:
+            return []
+        with self._lock:
+            # Each query word must match; the last may be any word it prefixes.
+            groups = [[t] for t in terms]
+            groups.append([w for w in self.postings if w.startswith(prefix)])
+            scores = None
+            n_docs = len(self.docs) or 1
+            avg_length = self.total_length / n_docs or 1
+            for words in groups:
+                group_scores = {}
+                for word in words:
+                    postings = self.postings.get(word, {})
+                    idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for doc, tf in postings.items():
+                        length = self.docs[doc][2]
+                        norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                        group_scores[doc] = group_scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+                if scores is None:
+                    scores = group_scores
+                else:
+                    scores = {d: s + group_scores[d] for d, s in scores.items() if d in group_scores}
+                if not scores:
+                    return []
+            ranked = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            results = []
+            for (topic_id, position), score in ranked:
+                role, message, _ = self.docs[(topic_id, position)]
+                title, count = self.titles[topic_id]
+                results.append({
+                    "topic_id": topic_id,
+                    "topic": title,
+                    "turns": count,
+                    "position": position,
+                    "role": role,
+                    "snippet": make_snippet(message, set(terms), prefix),
+                    "score": round(score, 4),
+                })
+            return results
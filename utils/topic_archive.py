@@ -0,0 +1,258 @@
+"""Compressed, read-only archive for inactive topics and old shared memory.
+
+``utils.topic_manager.compact`` moves topics whose last activity is older
+than ``ARCHIVE_AFTER_DAYS`` out of the hot store into segment files under
+``ARCHIVE_DIR``: compressed JSON lines, one topic per line, grouped by the
+``ARCHIVE_WINDOW`` (a strftime pattern, monthly by default) of their last
+activity. Segments are written once through a temp file and a rename and
+never modified afterwards; a later run for the same window adds a new one.
+
+``catalog.json`` maps every archived topic to its segment and carries the
+same catalog entry as the hot store, so archived topics can be listed
+without decompressing anything. A segment is only read when one of its
+topics is opened, and the last few decoded segments stay cached. Full-text
+search decodes every topic segment once into an in-memory
+:class:`~utils.search_index.InvertedIndex`, rebuilt when the catalog changes.
+
+Retention: segments whose newest content is older than
+``ARCHIVE_RETENTION_DAYS`` are deleted, then the oldest segments are
+dropped until the archive fits in ``ARCHIVE_MAX_MB``. Zero disables either
+limit.
+"""
+import copy
+import gzip
+import json
+import lzma
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+
+from utils.file_lock import FileLock, atomic_write_json, file_token
+from utils.search_index import InvertedIndex
+
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", "data/archive"))
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_WINDOW = os.getenv("ARCHIVE_WINDOW", "%Y-%m")
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "gzip")
+ARCHIVE_RETENTION_DAYS = float(os.getenv("ARCHIVE_RETENTION_DAYS", "0"))
+ARCHIVE_MAX_MB = float(os.getenv("ARCHIVE_MAX_MB", "0"))
+CACHED_SEGMENTS = 4
+
+_CODECS = {"gzip": (".gz", gzip.open), "lzma": (".xz", lzma.open)}
+
+
+def window_of(timestamp, pattern=ARCHIVE_WINDOW):
+    return datetime.fromtimestamp(timestamp or 0).strftime(pattern)
+
+
+def _open_segment(path, mode):
+    for suffix, opener in _CODECS.values():
+        if path.name.endswith(suffix):
+            return opener(path, mode)
+    raise ValueError(f"Unknown archive segment type: {path.name}")
+
+
+class TopicArchive:
+    def __init__(self, root=ARCHIVE_DIR, compression=ARCHIVE_COMPRESSION):
+        if compression not in _CODECS:
+            raise ValueError(f"Unknown ARCHIVE_COMPRESSION: {compression!r}")
+        self.root = Path(root)
+        self.compression = compression
+        self.catalog_path = self.root / "catalog.json"
+        self.lock = FileLock(self.catalog_path)
+        self._mutex = threading.Lock()
+        self._catalog = None
+        self._token = None
+        self._segments = OrderedDict()   # segment name -> {topic_id: topic}
+        self._index = InvertedIndex()
+        self._index_lock = threading.Lock()
+
+    def version(self):
+        return file_token(self.catalog_path)
+
+    def _read(self):
+        """The catalog, re-read only when the file changed."""
+        token = self.version()
+        with self._mutex:
+            if self._catalog is None or token != self._token:
+                try:
+                    self._catalog = json.loads(self.catalog_path.read_text(encoding="utf-8"))
+                except (OSError, ValueError):
+                    self._catalog = {"segments": {}, "topics": {}}
+                self._token = token
+            return self._catalog
+
+    def _write(self, catalog):
+        atomic_write_json(self.catalog_path, catalog, indent=None)
+        with self._mutex:
+            self._catalog = catalog
+            self._token = self.version()
+
+    def count(self):
+        return len(self._read()["topics"])
+
+    def contains(self, topic_id):
+        return topic_id in self._read()["topics"]
+
+    def entry(self, topic_id):
+        return self._read()["topics"].get(topic_id)
+
+    def list_topics(self, offset=0, limit=20):
+        """(catalog entries, total), most recently active first."""
+        entries = sorted(self._read()["topics"].values(), key=lambda e: e["last_activity"], reverse=True)
+        return entries[offset:offset + limit], len(entries)
+
+    def read_segment(self, name):
+        """Every record in segment ``name``, in the order written."""
+        with _open_segment(self.root / name, "rt") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def get_topic(self, topic_id):
+        entry = self.entry(topic_id)
+        if entry is None:
+            return None
+        name = entry["segment"]
+        with self._mutex:
+            topics = self._segments.get(name)
+            if topics is not None:
+                self._segments.move_to_end(name)
+        if topics is None:
+            try:
+                records = self.read_segment(name)
+            except OSError:
+                return None
+            topics = {t["topic_id"]: t for t in records}
+            with self._mutex:
+                self._segments[name] = topics
+                while len(self._segments) > CACHED_SEGMENTS:
+                    self._segments.popitem(last=False)
+        return topics.get(topic_id)
+
+    def search(self, query, limit=20):
+        """Archived messages matching ``query``, best first, marked ``archived``.
+
+        Hits have the same fields as :meth:`SqliteTopicBackend.search`.
+        """
+        with self._index_lock:
+            version = self.version()
+            if self._index.version is None or self._index.version != version:
+                catalog = self._read()
+                topics = []
+                for name, segment in catalog["segments"].items():
+                    if segment["kind"] != "topics":
+                        continue
+                    try:
+                        records = self.read_segment(name)
+                    except OSError:
+                        continue
+                    # Only the copy the catalog points at; older ones are superseded.
+                    topics.extend(
+                        t for t in records
+                        if catalog["topics"].get(t["topic_id"], {}).get("segment") == name
+                    )
+                self._index.rebuild({"topics": topics}, version)
+        return [dict(hit, archived=True) for hit in self._index.search(query, limit)]
+
+    def store(self, kind, window, records, entries=(), newest=None):
+        """Write ``records`` as a new segment and register it; returns its name.
+
+        ``entries`` are catalog entries (with ``topic_id``) for archived topics;
+        any older copy of the same topic in another segment is superseded.
+        """
+        suffix, opener = _CODECS[self.compression]
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            catalog = copy.deepcopy(self._read())
+            seq = 1
+            name = f"{kind}-{window}-{seq:03d}.jsonl{suffix}"
+            while name in catalog["segments"] or (self.root / name).exists():
+                seq += 1
+                name = f"{kind}-{window}-{seq:03d}.jsonl{suffix}"
+            tmp = self.root / f".{name}.tmp"
+            with opener(tmp, "wt", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            with open(tmp, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(tmp, self.root / name)
+
+            ids = [e["topic_id"] for e in entries]
+            for topic_id in ids:
+                self._unlink_topic(catalog, topic_id)
+            catalog["segments"][name] = {
+                "kind": kind,
+                "window": window,
+                "bytes": (self.root / name).stat().st_size,
+                "created": time.time(),
+                "newest": newest if newest is not None else max((e["last_activity"] for e in entries), default=time.time()),
+                "topics": ids,
+            }
+            for entry in entries:
+                catalog["topics"][entry["topic_id"]] = dict(entry, segment=name, archived=True)
+            self._write(catalog)
+        return name
+
+    def _unlink_topic(self, catalog, topic_id):
+        entry = catalog["topics"].pop(topic_id, None)
+        if entry is None:
+            return
+        segment = catalog["segments"].get(entry["segment"])
+        if segment is None:
+            return
+        segment["topics"] = [t for t in segment["topics"] if t != topic_id]
+        if segment["kind"] == "topics" and not segment["topics"]:
+            self._drop_segment(catalog, entry["segment"])
+
+    def _drop_segment(self, catalog, name):
+        segment = catalog["segments"].pop(name)
+        for topic_id in segment["topics"]:
+            catalog["topics"].pop(topic_id, None)
+        try:
+            (self.root / name).unlink()
+        except OSError:
+            pass
+        with self._mutex:
+            self._segments.pop(name, None)
+
+    def remove(self, topic_id):
+        """Forget an archived topic; its segment is deleted once nothing in it is live."""
+        if not self.contains(topic_id):
+            return False
+        with self.lock:
+            catalog = copy.deepcopy(self._read())
+            self._unlink_topic(catalog, topic_id)
+            self._write(catalog)
+        return True
+
+    def enforce_retention(self, now=None, retention_days=ARCHIVE_RETENTION_DAYS, max_mb=ARCHIVE_MAX_MB):
+        """Delete expired segments, then the oldest ones over the size cap; returns their names."""
+        now = now or time.time()
+        dropped = []
+        with self.lock:
+            catalog = copy.deepcopy(self._read())
+            by_age = sorted(catalog["segments"], key=lambda n: catalog["segments"][n]["newest"])
+            if retention_days:
+                cutoff = now - retention_days * 86400
+                for name in by_age:
+                    if catalog["segments"][name]["newest"] < cutoff:
+                        self._drop_segment(catalog, name)
+                        dropped.append(name)
+            if max_mb:
+                limit = max_mb * 1024 * 1024
+                total = sum(s["bytes"] for s in catalog["segments"].values())
+                for name in by_age:
+                    if total <= limit:
+                        break
+                    if name in catalog["segments"]:
+                        total -= catalog["segments"][name]["bytes"]
+                        self._drop_segment(catalog, name)
+                        dropped.append(name)
+            if dropped:
+                self._write(catalog)
+        return dropped
+
+    def size(self):
+        return sum(s["bytes"] for s in self._read()["segments"].values())
@@ -0,0 +1,619 @@
+"""Storage engines behind ``utils.topic_manager``.
+
+``JsonTopicBackend`` is the original single-file layout, where every
+write rewrites the whole file. ``SqliteTopicBackend`` keeps topics and
+messages in a WAL-mode SQLite database, so appending a message is one
+indexed insert no matter how much history is stored.
+
+Both also maintain a topic catalog (id, title, created time, message
+count, last activity) alongside the messages, so ``list_topics`` can page
+through topics by recency without reading any message bodies, and a
+full-text index, so ``search`` ranks matching messages without a scan:
+an FTS5 table kept in sync by triggers for SQLite, an in-memory
+:class:`~utils.search_index.InvertedIndex` for JSON.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from utils.file_lock import FileLock, atomic_write_json, file_token, quarantine
+from utils.search_index import InvertedIndex, fts_query, make_snippet, query_terms
+
+DEFAULT_DATA = {"topics": []}
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "2000"))
+
+
+def _message_time(message):
+    """Epoch seconds of a message's local "YYYY-MM-DD HH:MM" time, or None."""
+    try:
+        return datetime.strptime(message.get("time") or "", "%Y-%m-%d %H:%M").timestamp()
+    except ValueError:
+        return None
+
+
+def catalog_entry(topic, created=None, updated=None):
+    # Imported and rebuilt topics keep the age of their messages, so
+    # compaction still sees them as old; only empty topics are "now".
+    times = [t for t in map(_message_time, topic.get("messages", [])) if t is not None]
+    now = time.time()
+    created = created or (min(times) if times else None)
+    updated = updated or (max(times) if times else None)
+    return {
+        "topic_id": topic["topic_id"],
+        "topic": topic.get("topic", ""),
+        "max_turns": topic.get("max_turns"),
+        "created": created or now,
+        "last_activity": updated or created or now,
+        "turns": len(topic.get("messages", [])),
+    }
+
+
+def _entry_from_row(row):
+    return {
+        "topic_id": row["topic_id"],
+        "topic": row["topic"],
+        "max_turns": row["max_turns"],
+        "created": row["created_at"],
+        "last_activity": row["updated_at"],
+        "turns": row["message_count"],
+    }
+
+
+def slice_bounds(total, offset, limit):
+    """(start, stop) of ``offset``/``limit`` over ``total`` items; a negative offset counts from the end."""
+    start = max(0, total + offset) if offset < 0 else min(offset, total)
+    stop = total if limit is None else min(total, start + limit)
+    return start, stop
+
+
+def _page(entries, offset, limit):
+    entries = sorted(entries, key=lambda e: e["last_activity"], reverse=True)
+    return entries[offset:offset + limit], len(entries)
+
+
+class JsonTopicBackend:
+    """Single JSON file; read-modify-write runs under an inter-process lock
+    and every save is an atomic rename, so concurrent writers never lose or
+    tear each other's updates."""
+
+    name = "json"
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = FileLock(self.path)
+        # Sidecar catalog, tagged with the file token of the data it describes.
+        self.catalog_path = self.path.with_name(f"{self.path.stem}.catalog.json")
+        self.index = InvertedIndex()
+
+    def ensure(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if not self.path.exists():
+            with self.lock:
+                if not self.path.exists():
+                    atomic_write_json(self.path, DEFAULT_DATA)
+
+    def version(self):
+        """Cheap change token: the file's mtime and size."""
+        return file_token(self.path)
+
+    def _read(self):
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return {"topics": []}
+        except ValueError:
+            # Atomic saves mean this is real corruption, not a torn write:
+            # keep the evidence and start a fresh store.
+            quarantine(self.path)
+            atomic_write_json(self.path, DEFAULT_DATA)
+            return {"topics": []}
+
+    def load_all(self):
+        self.ensure()
+        return self._read()
+
+    # Write methods return the (before, after) change tokens observed under
+    # the lock so TopicCache can tell whether anyone else wrote in between.
+    def save_all(self, data):
+        with self.lock:
+            before = self.version()
+            atomic_write_json(self.path, data)
+            self._write_catalog({t["topic_id"]: catalog_entry(t) for t in data.get("topics", [])})
+            self.index.version = None
+            return before, self.version()
+
+    def _read_catalog(self, data=None):
+        """Catalog entries by topic id, rebuilt from ``data`` if the sidecar is stale."""
+        try:
+            catalog = json.loads(self.catalog_path.read_text(encoding="utf-8"))
+            if tuple(catalog.get("source") or ()) == self.version():
+                return catalog["topics"]
+        except (OSError, ValueError, KeyError):
+            pass
+        data = data if data is not None else self._read()
+        return {t["topic_id"]: catalog_entry(t) for t in data.get("topics", [])}
+
+    def _write_catalog(self, entries):
+        atomic_write_json(self.catalog_path, {"source": self.version(), "topics": entries}, indent=None)
+
+    def _update(self, change, catalog_change=None, index_change=None):
+        self.ensure()
+        with self.lock:
+            before = self.version()
+            data = self._read()
+            catalog = self._read_catalog(data)
+            change(data)
+            atomic_write_json(self.path, data)
+            if catalog_change is not None:
+                catalog_change(catalog, data)
+            self._write_catalog(catalog)
+            after = self.version()
+            if index_change is not None:
+                self.index.apply(before, after, index_change)
+            return before, after
+
+    def create_topic(self, topic):
+        def catalog_change(catalog, data):
+            catalog[topic["topic_id"]] = catalog_entry(topic)
+        return self._update(lambda data: data["topics"].append(topic), catalog_change,
+                            self.index.on_create(topic))
+
+    def add_message(self, topic_id, message):
+        def change(data):
+            for topic in data["topics"]:
+                if topic["topic_id"] == topic_id:
+                    topic["messages"].append(message)
+
+        def catalog_change(catalog, data):
+            entry = catalog.get(topic_id)
+            if entry is not None:
+                entry["turns"] += 1
+                entry["last_activity"] = time.time()
+        return self._update(change, catalog_change, self.index.on_message(topic_id, message))
+
+    def list_topics(self, offset=0, limit=20):
+        """(catalog entries, total) ordered by last activity, newest first."""
+        self.ensure()
+        try:
+            catalog = json.loads(self.catalog_path.read_text(encoding="utf-8"))
+            if tuple(catalog.get("source") or ()) == self.version():
+                return _page(catalog["topics"].values(), offset, limit)
+        except (OSError, ValueError, KeyError):
+            pass
+        # Missing or stale (e.g. written by an older version): rebuild once.
+        with self.lock:
+            entries = self._read_catalog()
+            self._write_catalog(entries)
+        return _page(entries.values(), offset, limit)
+
+    def get_topic(self, topic_id):
+        for topic in self.load_all().get("topics", []):
+            if topic.get("topic_id") == topic_id:
+                return topic
+        return None
+
+    def get_entry(self, topic_id):
+        """Catalog entry for one topic, or None."""
+        self.list_topics(0, 0)  # rebuilds a stale sidecar
+        try:
+            catalog = json.loads(self.catalog_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        return catalog.get("topics", {}).get(topic_id)
+
+    def iter_messages(self, topic_id):
+        topic = self.get_topic(topic_id)
+        yield from (topic or {}).get("messages", [])
+
+    def get_messages(self, topic_id, offset=0, limit=None):
+        """(messages in ``offset``/``limit``, total) for a topic, or None if it is missing."""
+        topic = self.get_topic(topic_id)
+        if topic is None:
+            return None
+        messages = topic.get("messages", [])
+        start, stop = slice_bounds(len(messages), offset, limit)
+        return messages[start:stop], len(messages)
+
+    def delete_topic(self, topic_id):
+        def change(data):
+            data["topics"] = [t for t in data.get("topics", []) if t.get("topic_id") != topic_id]
+        return self._update(change, lambda catalog, data: catalog.pop(topic_id, None),
+                            self.index.on_delete(topic_id))
+
+    def evict_topic(self, topic_id, turns):
+        """Delete ``topic_id`` only if it still has ``turns`` messages.
+
+        Check and delete happen under one lock; returns the (before, after)
+        change tokens and the topic's message count (None if it is missing).
+        """
+        found = []
+
+        def matches():
+            return bool(found) and found[0] == turns
+
+        def change(data):
+            for topic in data.get("topics", []):
+                if topic.get("topic_id") == topic_id:
+                    found.append(len(topic.get("messages", [])))
+            if matches():
+                data["topics"] = [t for t in data["topics"] if t.get("topic_id") != topic_id]
+
+        def catalog_change(catalog, data):
+            if matches():
+                catalog.pop(topic_id, None)
+
+        drop = self.index.on_delete(topic_id)
+
+        def index_change():
+            if matches():
+                drop()
+
+        before, after = self._update(change, catalog_change, index_change)
+        return before, after, found[0] if found else None
+
+    def vacuum(self):
+        """Nothing to reclaim: every save rewrites the whole file."""
+
+    def search(self, query, limit=20):
+        """Messages matching every word of ``query``, best first (see :meth:`SqliteTopicBackend.search`)."""
+        self.ensure()
+        if self.index.version is None or self.index.version != self.version():
+            with self.lock:
+                self.index.rebuild(self._read(), self.version())
+        return self.index.search(query, limit)
+
+
+class SqliteTopicBackend:
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._local = threading.local()
+        self._fts = True
+        self._index = None  # fallback when FTS5 is unavailable
+
+    def _conn(self):
+        # sqlite3 connections must not be shared across threads, and the
+        # Streamlit server runs each session on its own thread.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS topics (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    topic_id TEXT NOT NULL UNIQUE,
+                    topic TEXT NOT NULL,
+                    max_turns INTEGER,
+                    created_at REAL,
+                    updated_at REAL,
+                    message_count INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS messages (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    topic_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    time TEXT
+                );
+                CREATE INDEX IF NOT EXISTS messages_topic ON messages(topic_id, seq);
+                CREATE TABLE IF NOT EXISTS meta (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    version INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO meta (id, version) VALUES (1, 0);
+                """
+            )
+            self._migrate_catalog(conn)
+            conn.execute("CREATE INDEX IF NOT EXISTS topics_recent ON topics(updated_at)")
+            self._fts = self._ensure_fts(conn)
+            self._local.conn = conn
+        return conn
+
+    def _migrate_catalog(self, conn):
+        """Add and backfill the catalog columns on databases created before them."""
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(topics)")}
+        if "message_count" in columns:
+            return
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(topics)")}
+            if "message_count" in columns:
+                return  # another process migrated while we waited
+            conn.execute("ALTER TABLE topics ADD COLUMN created_at REAL")
+            conn.execute("ALTER TABLE topics ADD COLUMN updated_at REAL")
+            conn.execute("ALTER TABLE topics ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+            # Message times are "YYYY-MM-DD HH:MM" strings; good enough to order old topics.
+            conn.execute(
+                """
+                UPDATE topics SET
+                    message_count = (SELECT COUNT(*) FROM messages m WHERE m.topic_id = topics.topic_id),
+                    created_at = (SELECT CAST(strftime('%s', MIN(m.time)) AS REAL)
+                                  FROM messages m WHERE m.topic_id = topics.topic_id),
+                    updated_at = (SELECT CAST(strftime('%s', MAX(m.time)) AS REAL)
+                                  FROM messages m WHERE m.topic_id = topics.topic_id)
+                """
+            )
+            conn.execute("UPDATE topics SET created_at = COALESCE(created_at, 0), updated_at = COALESCE(updated_at, created_at, 0)")
+
+    def _ensure_fts(self, conn):
+        """Create (and on existing databases, backfill) the full-text index.
+
+        ``messages_fts`` is an external-content FTS5 table over ``messages``:
+        it stores only the index, and the triggers update it in the same
+        transaction as every insert and delete. Returns False when this
+        SQLite build lacks FTS5; ``search`` then falls back to an in-memory
+        index.
+        """
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        ).fetchone()
+        if exists:
+            return True
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                if conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+                ).fetchone():
+                    return True  # another process created it while we waited
+                conn.execute(
+                    "CREATE VIRTUAL TABLE messages_fts USING fts5("
+                    "message, content='messages', content_rowid='seq',"
+                    " tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+                )
+                conn.execute(
+                    "CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN"
+                    " INSERT INTO messages_fts(rowid, message) VALUES (new.seq, new.message); END"
+                )
+                conn.execute(
+                    "CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN"
+                    " INSERT INTO messages_fts(messages_fts, rowid, message)"
+                    " VALUES ('delete', old.seq, old.message); END"
+                )
+                conn.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError as exc:
+            if "fts5" not in str(exc):
+                raise
+            return False
+        return True
+
+    def ensure(self):
+        self._conn()
+
+    def version(self):
+        """Write counter bumped in the same transaction as every change."""
+        return self._conn().execute("SELECT version FROM meta WHERE id = 1").fetchone()[0]
+
+    def _bump(self, conn):
+        """Advance the write counter; returns the (before, after) versions."""
+        conn.execute("UPDATE meta SET version = version + 1 WHERE id = 1")
+        after = conn.execute("SELECT version FROM meta WHERE id = 1").fetchone()[0]
+        return after - 1, after
+
+    def load_all(self):
+        conn = self._conn()
+        topics = {}
+        for row in conn.execute("SELECT topic_id, topic, max_turns FROM topics ORDER BY seq"):
+            topics[row["topic_id"]] = {
+                "topic_id": row["topic_id"],
+                "topic": row["topic"],
+                "max_turns": row["max_turns"],
+                "messages": [],
+            }
+        for row in conn.execute("SELECT topic_id, role, message, time FROM messages ORDER BY seq"):
+            topic = topics.get(row["topic_id"])
+            if topic is not None:
+                topic["messages"].append({"role": row["role"], "message": row["message"], "time": row["time"]})
+        return {"topics": list(topics.values())}
+
+    def save_all(self, data):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM messages")
+            conn.execute("DELETE FROM topics")
+            for topic in data.get("topics", []):
+                self._insert_topic(conn, topic)
+            return self._bump(conn)
+
+    def _insert_topic(self, conn, topic):
+        entry = catalog_entry(topic)
+        conn.execute(
+            "INSERT INTO topics (topic_id, topic, max_turns, created_at, updated_at, message_count)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (topic["topic_id"], entry["topic"], entry["max_turns"], entry["created"],
+             entry["last_activity"], entry["turns"]),
+        )
+        conn.executemany(
+            "INSERT INTO messages (topic_id, role, message, time) VALUES (?, ?, ?, ?)",
+            [
+                (topic["topic_id"], m.get("role", ""), m.get("message", ""), m.get("time"))
+                for m in topic.get("messages", [])
+            ],
+        )
+
+    def create_topic(self, topic):
+        conn = self._conn()
+        with conn:
+            self._insert_topic(conn, topic)
+            return self._bump(conn)
+
+    def add_message(self, topic_id, message):
+        conn = self._conn()
+        with conn:
+            # Same semantics as the JSON store: messages for unknown topics are dropped.
+            conn.execute(
+                "INSERT INTO messages (topic_id, role, message, time)"
+                " SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM topics WHERE topic_id = ?)",
+                (topic_id, message["role"], message["message"], message.get("time"), topic_id),
+            )
+            conn.execute(
+                "UPDATE topics SET message_count = message_count + 1, updated_at = ? WHERE topic_id = ?",
+                (time.time(), topic_id),
+            )
+            return self._bump(conn)
+
+    def list_topics(self, offset=0, limit=20):
+        """(catalog entries, total) ordered by last activity, newest first."""
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT topic_id, topic, max_turns, created_at, updated_at, message_count FROM topics"
+            " ORDER BY updated_at DESC, seq DESC LIMIT ? OFFSET ?",
+            (limit, offset),
+        ).fetchall()
+        total = conn.execute("SELECT COUNT(*) FROM topics").fetchone()[0]
+        return [_entry_from_row(row) for row in rows], total
+
+    def get_topic(self, topic_id):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT topic_id, topic, max_turns FROM topics WHERE topic_id = ?", (topic_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        messages = conn.execute(
+            "SELECT role, message, time FROM messages WHERE topic_id = ? ORDER BY seq", (topic_id,)
+        ).fetchall()
+        return {
+            "topic_id": row["topic_id"],
+            "topic": row["topic"],
+            "max_turns": row["max_turns"],
+            "messages": [dict(m) for m in messages],
+        }
+
+    def get_entry(self, topic_id):
+        """Catalog entry for one topic, or None."""
+        row = self._conn().execute(
+            "SELECT topic_id, topic, max_turns, created_at, updated_at, message_count FROM topics"
+            " WHERE topic_id = ?",
+            (topic_id,),
+        ).fetchone()
+        return _entry_from_row(row) if row is not None else None
+
+    def iter_messages(self, topic_id):
+        """A topic's messages in order, read from a cursor rather than all at once."""
+        cursor = self._conn().execute(
+            "SELECT role, message, time FROM messages WHERE topic_id = ? ORDER BY seq", (topic_id,)
+        )
+        for row in cursor:
+            yield dict(row)
+
+    def get_messages(self, topic_id, offset=0, limit=None):
+        """(messages in ``offset``/``limit``, total) read with LIMIT/OFFSET; see :meth:`JsonTopicBackend.get_messages`."""
+        conn = self._conn()
+        row = conn.execute("SELECT message_count FROM topics WHERE topic_id = ?", (topic_id,)).fetchone()
+        if row is None:
+            return None
+        total = row["message_count"]
+        start, stop = slice_bounds(total, offset, limit)
+        rows = conn.execute(
+            "SELECT role, message, time FROM messages WHERE topic_id = ? ORDER BY seq LIMIT ? OFFSET ?",
+            (topic_id, stop - start, start),
+        ).fetchall()
+        return [dict(m) for m in rows], total
+
+    def delete_topic(self, topic_id):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM messages WHERE topic_id = ?", (topic_id,))
+            conn.execute("DELETE FROM topics WHERE topic_id = ?", (topic_id,))
+            return self._bump(conn)
+
+    def evict_topic(self, topic_id, turns):
+        """Delete ``topic_id`` only if it still has ``turns`` messages; see :meth:`JsonTopicBackend.evict_topic`."""
+        conn = self._conn()
+        with conn:
+            # Take the write lock before counting so no message can land in between.
+            conn.execute("BEGIN IMMEDIATE")
+            count = None
+            if conn.execute("SELECT 1 FROM topics WHERE topic_id = ?", (topic_id,)).fetchone():
+                count = conn.execute(
+                    "SELECT COUNT(*) FROM messages WHERE topic_id = ?", (topic_id,)
+                ).fetchone()[0]
+            if count != turns:
+                version = conn.execute("SELECT version FROM meta WHERE id = 1").fetchone()[0]
+                return version, version, count
+            conn.execute("DELETE FROM messages WHERE topic_id = ?", (topic_id,))
+            conn.execute("DELETE FROM topics WHERE topic_id = ?", (topic_id,))
+            return (*self._bump(conn), count)
+
+    def search(self, query, limit=20):
+        """Messages matching every word of ``query`` (the last also as a prefix).
+
+        Returns up to ``limit`` dicts, best BM25 match first, with
+        ``topic_id``, ``topic`` (title), ``turns`` (messages in the topic),
+        ``position`` (index of the message within its topic), ``role``,
+        ``snippet`` (matches in **bold**) and ``score``.
+        """
+        conn = self._conn()
+        if not self._fts:
+            if self._index is None:
+                self._index = InvertedIndex()
+            index = self._index
+            version = self.version()
+            if index.version != version:
+                index.rebuild(self.load_all(), version)
+            return index.search(query, limit)
+        match = fts_query(query)
+        if match is None:
+            return []
+        # BM25 costs a little per matching row, so a word found in most
+        # messages is ranked among its newest SEARCH_CANDIDATES matches only.
+        rows = conn.execute(
+            """
+            SELECT m.seq, m.topic_id, m.role, m.message, t.topic, t.message_count, hits.rank
+            FROM (
+                SELECT rowid, bm25(messages_fts) AS rank FROM messages_fts
+                WHERE messages_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+            ) AS hits
+            JOIN messages m ON m.seq = hits.rowid
+            JOIN topics t ON t.topic_id = m.topic_id
+            ORDER BY hits.rank LIMIT ?
+            """,
+            (match, SEARCH_CANDIDATES, limit),
+        ).fetchall()
+        terms, prefix = query_terms(query)
+        return [
+            {
+                "topic_id": row["topic_id"],
+                "topic": row["topic"],
+                "turns": row["message_count"],
+                "position": conn.execute(
+                    "SELECT COUNT(*) FROM messages WHERE topic_id = ? AND seq < ?",
+                    (row["topic_id"], row["seq"]),
+                ).fetchone()[0],
+                "role": row["role"],
+                "snippet": make_snippet(row["message"], set(terms), prefix),
+                "score": round(-row["rank"], 4),
+            }
+            for row in rows
+        ]
+
+    def vacuum(self):
+        """Return the pages freed by deletions to the filesystem."""
+        conn = self._conn()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+
+    def import_data(self, data):
+        """Append topics from a JSON-layout dict, skipping ids that already exist."""
+        conn = self._conn()
+        imported = 0
+        with conn:
+            for topic in data.get("topics", []):
+                exists = conn.execute(
+                    "SELECT 1 FROM topics WHERE topic_id = ?", (topic.get("topic_id"),)
+                ).fetchone()
+                if topic.get("topic_id") and not exists:
+                    self._insert_topic(conn, topic)
+                    imported += 1
+            self._bump(conn)
+        return imported
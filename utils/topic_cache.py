@@ -0,0 +1,148 @@
+"""Process-wide read cache in front of a topic storage backend.
+
+Reads are served from memory until the backend's change token
+(``backend.version()``) moves. For SQLite that token is a write counter,
+and for JSON it is the file's mtime and size. Writes made through this
+process update the cached view in place instead of dropping it, so
+``messages_for`` and ``last_message`` stay O(1) across reruns.
+
+Returned lists and dicts are shared with the cache; treat them as read-only.
+"""
+import threading
+
+from utils.topic_backends import slice_bounds
+
+MAX_CACHED_SEARCHES = 64
+
+
+class TopicCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.RLock()
+        self._reset(None)
+
+    def _reset(self, version):
+        self._version = version
+        self._topics = {}      # topic_id -> topic dict (None when known missing)
+        self._last = {}        # topic_id -> {role: message}
+        self._complete = False  # True once _topics holds every topic, in order
+        self._pages = {}        # (offset, limit) -> backend.list_topics result
+        self._searches = {}     # (query, limit) -> backend.search result
+
+    def _check(self):
+        """Drop everything if another process/thread changed the store."""
+        current = self.backend.version()
+        if current is None or current != self._version:
+            self._reset(current)
+
+    def _remember(self, topic_id, topic):
+        self._topics[topic_id] = topic
+        last = {}
+        for msg in (topic or {}).get("messages", []):
+            last[msg.get("role")] = msg.get("message")
+        self._last[topic_id] = last
+
+    def topic(self, topic_id):
+        with self._lock:
+            self._check()
+            if topic_id not in self._topics:
+                if self._complete:
+                    return None
+                self._remember(topic_id, self.backend.get_topic(topic_id))
+            return self._topics[topic_id]
+
+    def messages_for(self, topic_id):
+        topic = self.topic(topic_id)
+        return topic["messages"] if topic else []
+
+    def message_page(self, topic_id, offset, limit):
+        """(messages, total) for one window of a topic, or None if it is not stored.
+
+        Sliced from memory when the topic is cached; otherwise only the
+        window is read from the backend.
+        """
+        with self._lock:
+            self._check()
+            if topic_id in self._topics or self._complete:
+                topic = self._topics.get(topic_id)
+                if topic is None:
+                    return None
+                messages = topic["messages"]
+                start, stop = slice_bounds(len(messages), offset, limit)
+                return messages[start:stop], len(messages)
+        return self.backend.get_messages(topic_id, offset, limit)
+
+    def last_message(self, topic_id, role):
+        with self._lock:
+            if self.topic(topic_id) is None:
+                return ""
+            return self._last[topic_id].get(role, "")
+
+    def all_topics(self):
+        with self._lock:
+            self._check()
+            if not self._complete:
+                data = self.backend.load_all()
+                self._topics = {}
+                self._last = {}
+                for topic in data.get("topics", []):
+                    self._remember(topic["topic_id"], topic)
+                self._complete = True
+            return {"topics": [t for t in self._topics.values() if t is not None]}
+
+    def catalog_page(self, offset, limit):
+        with self._lock:
+            self._check()
+            key = (offset, limit)
+            if key not in self._pages:
+                self._pages[key] = self.backend.list_topics(offset, limit)
+            return self._pages[key]
+
+    def search(self, query, limit):
+        # Streamlit reruns the script on every interaction with the same query.
+        with self._lock:
+            self._check()
+            key = (query, limit)
+            if key not in self._searches:
+                if len(self._searches) >= MAX_CACHED_SEARCHES:
+                    self._searches.clear()
+                self._searches[key] = self.backend.search(query, limit)
+            return self._searches[key]
+
+    def write(self, write_fn, update_fn=None):
+        """Run a backend write and keep the cache coherent.
+
+        ``write_fn`` returns the backend's (before, after) change tokens.
+        If the cache matched ``before``, nobody else wrote in between and
+        ``update_fn`` patches it in place; otherwise it is dropped.
+        """
+        with self._lock:
+            before, after = write_fn()
+            # Any write can reorder the catalog by recency or add search hits.
+            self._pages = {}
+            self._searches = {}
+            if update_fn is not None and self._version is not None and before == self._version:
+                update_fn()
+                self._version = after
+            else:
+                self._reset(None)
+
+    def on_create(self, topic):
+        def update():
+            self._remember(topic["topic_id"], topic)
+        return update
+
+    def on_message(self, topic_id, message):
+        def update():
+            topic = self._topics.get(topic_id)
+            if topic is not None:
+                topic["messages"].append(message)
+                self._last[topic_id][message["role"]] = message["message"]
+        return update
+
+    def on_delete(self, topic_id):
+        def update():
+            if topic_id in self._topics:
+                self._topics[topic_id] = None
+                self._last.pop(topic_id, None)
+        return update
@@ -1,57 +1,338 @@
+import copy
 import json
+import os
+import sys
+import threading
+import time
 import uuid
 from datetime import datetime
 from pathlib import Path
 
+from utils.file_lock import FileLock
+from utils.topic_archive import ARCHIVE_AFTER_DAYS, TopicArchive, window_of
+from utils.topic_backends import JsonTopicBackend, SqliteTopicBackend, slice_bounds
+from utils.topic_cache import TopicCache
+
 TOPIC_FILE = Path("data/topics_memory.json")
-DEFAULT_DATA = {"topics": []}
+TOPIC_DB = Path("data/topics.db")
+# "sqlite" (default) or "json" for the original single-file store.
+TOPIC_BACKEND = os.getenv("TOPIC_BACKEND", "sqlite")
+
+# Topics per archive segment, so compaction never holds a whole month in memory.
+SEGMENT_TOPICS = 500
+
+_backend = None
+_cache = None
+_archive = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend, _cache
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _open_backend(TOPIC_BACKEND)
+                _cache = TopicCache(_backend)
+    return _backend
+
+
+def get_cache():
+    """The process-wide cached view of the topic store."""
+    get_backend()
+    return _cache
+
+
+def set_backend(backend):
+    """Swap the storage engine (e.g. ``JsonTopicBackend(path)``) for this process."""
+    global _backend, _cache
+    with _backend_lock:
+        _backend = backend
+        _cache = TopicCache(backend)
+
+
+def get_archive():
+    """Compressed store for topics moved out by :func:`compact`."""
+    global _archive
+    if _archive is None:
+        with _backend_lock:
+            if _archive is None:
+                _archive = TopicArchive()
+    return _archive
+
+
+def _open_backend(name):
+    if name == "json":
+        return JsonTopicBackend(TOPIC_FILE)
+    if name != "sqlite":
+        raise ValueError(f"Unknown TOPIC_BACKEND: {name!r}")
+    with FileLock(TOPIC_DB):
+        fresh = not TOPIC_DB.exists()
+        backend = SqliteTopicBackend(TOPIC_DB)
+        backend.ensure()
+        if fresh and TOPIC_FILE.exists():
+            # One-shot upgrade: carry existing history over the first time the
+            # database is created.
+            migrate_json_to_sqlite(TOPIC_FILE, backend)
+    return backend
+
+
+def migrate_json_to_sqlite(json_path=TOPIC_FILE, backend=None):
+    """Copy topics from the JSON file into SQLite; returns the number imported."""
+    backend = backend or SqliteTopicBackend(TOPIC_DB)
+    try:
+        data = json.loads(Path(json_path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return 0
+    return backend.import_data(data)
 
 
 def _ensure_topic_file():
-    TOPIC_FILE.parent.mkdir(parents=True, exist_ok=True)
-    if not TOPIC_FILE.exists():
-        TOPIC_FILE.write_text(json.dumps(DEFAULT_DATA, indent=4), encoding="utf-8")
+    get_backend().ensure()
 
 
 def load_topics():
-    _ensure_topic_file()
-    try:
-        return json.loads(TOPIC_FILE.read_text(encoding="utf-8"))
-    except Exception:
-        TOPIC_FILE.write_text(json.dumps(DEFAULT_DATA, indent=4), encoding="utf-8")
-        return DEFAULT_DATA.copy()
+    """Every topic in the hot store; archived topics are left on disk."""
+    return get_cache().all_topics()
 
 
 def save_topics(data):
-    _ensure_topic_file()
-    TOPIC_FILE.write_text(json.dumps(data, indent=4), encoding="utf-8")
+    get_cache().write(lambda: get_backend().save_all(data))
 
 
 def create_topic(topic_text, max_turns):
     topic_id = str(uuid.uuid4())
-    data = load_topics()
-    data["topics"].append({
+    topic = {
         "topic_id": topic_id,
         "topic": topic_text,
         "max_turns": max_turns,
         "messages": [],
-    })
-    save_topics(data)
+    }
+    cache = get_cache()
+    cache.write(lambda: get_backend().create_topic(topic), cache.on_create(topic))
     return topic_id
 
 
 def add_message(topic_id, role, message):
-    data = load_topics()
-    for topic in data["topics"]:
-        if topic["topic_id"] == topic_id:
-            topic["messages"].append({
-                "role": role,
-                "message": message,
-                "time": datetime.now().strftime("%Y-%m-%d %H:%M"),
-            })
-    save_topics(data)
+    entry = {
+        "role": role,
+        "message": message,
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M"),
+    }
+    cache = get_cache()
+    if cache.topic(topic_id) is None:
+        _restore(topic_id)
+    cache.write(lambda: get_backend().add_message(topic_id, dict(entry)), cache.on_message(topic_id, entry))
+
+
+def _restore(topic_id):
+    """Move an archived topic back into the hot store so it can grow again."""
+    archive = get_archive()
+    topic = archive.get_topic(topic_id)
+    if topic is None:
+        return
+    topic = copy.deepcopy(topic)
+    cache = get_cache()
+    cache.write(lambda: get_backend().create_topic(topic), cache.on_create(topic))
+    archive.remove(topic_id)
+
+
+def get_topic(topic_id):
+    return get_cache().topic(topic_id) or get_archive().get_topic(topic_id)
+
+
+def get_topic_messages(topic_id):
+    topic = get_topic(topic_id)
+    return topic["messages"] if topic else []
+
+
+def get_messages_page(topic_id, offset=0, limit=None):
+    """``(messages, total)`` for ``limit`` messages from ``offset``; a negative
+    offset counts from the end, so ``(-n, n)`` is the newest page.
+
+    Only that window is read from the store, unless the topic is cached or
+    archived; an unknown topic gives ``([], 0)``.
+    """
+    page = get_cache().message_page(topic_id, offset, limit)
+    if page is not None:
+        return page
+    messages = get_topic_messages(topic_id)
+    start, stop = slice_bounds(len(messages), offset, limit)
+    return messages[start:stop], len(messages)
+
+
+def get_last_message(topic_id, role):
+    cache = get_cache()
+    if cache.topic(topic_id) is not None:
+        return cache.last_message(topic_id, role)
+    for msg in reversed(get_topic_messages(topic_id)):
+        if msg.get("role") == role:
+            return msg.get("message", "")
+    return ""
+
+
+def get_topic_entry(topic_id):
+    """Catalog entry (no messages) for a hot or archived topic, or None."""
+    return get_backend().get_entry(topic_id) or get_archive().entry(topic_id)
+
+
+def iter_topic_messages(topic_id):
+    """Yield a topic's messages without caching them; for exports of long topics."""
+    if get_backend().get_entry(topic_id) is not None:
+        yield from get_backend().iter_messages(topic_id)
+    else:
+        yield from get_topic_messages(topic_id)
+
+
+def delete_topic(topic_id):
+    cache = get_cache()
+    cache.write(lambda: get_backend().delete_topic(topic_id), cache.on_delete(topic_id))
+    get_archive().remove(topic_id)
+
+
+def list_topics(page=0, page_size=20):
+    """One page of the topic catalog, most recently active first.
+
+    Returns ``(entries, total)``; entries carry ``topic_id``, ``topic``,
+    ``created``, ``last_activity`` (epoch seconds) and ``turns`` (message
+    count) but no messages. Archived topics follow the hot ones and are
+    marked ``archived``.
+    """
+    offset = page * page_size
+    entries, hot_total = get_cache().catalog_page(offset, page_size)
+    archive = get_archive()
+    archived_total = archive.count()
+    if len(entries) < page_size and archived_total:
+        more, _ = archive.list_topics(max(0, offset - hot_total), page_size - len(entries))
+        entries = entries + more
+    return entries, hot_total + archived_total
+
+
+def _evict(topic_id, turns):
+    """Drop an archived topic from the hot store unless it grew meanwhile."""
+    counts = []
+
+    def write():
+        # Count check and delete are one backend transaction, so a message
+        # added after the topic was archived can't be deleted with it.
+        before, after, count = get_backend().evict_topic(topic_id, turns)
+        counts.append(count)
+        return before, after
+
+    cache = get_cache()
+    drop = cache.on_delete(topic_id)
+
+    def update():
+        if counts[0] == turns:
+            drop()
+
+    cache.write(write, update)
+    if counts[0] is None:
+        return False
+    if counts[0] != turns:
+        # The hot copy is newer; drop the archived one so the topic isn't listed twice.
+        get_archive().remove(topic_id)
+        return False
+    return True
+
+
+def compact(max_age_days=ARCHIVE_AFTER_DAYS, now=None):
+    """Move topics idle for more than ``max_age_days`` into the archive.
+
+    Topics are written to compressed segments grouped by the window of their
+    last activity, then removed from the hot store, which is vacuumed
+    afterwards; archive retention and size caps are applied last. Rerunning
+    after a crash is safe: a topic already archived with the same messages
+    is only removed from the hot store. Returns a summary dict.
+    """
+    now = now or time.time()
+    cutoff = now - max_age_days * 86400
+    backend = get_backend()
+    archive = get_archive()
+    _, total = backend.list_topics(0, 0)
+    catalog, _ = backend.list_topics(0, total)
+    windows = {}
+    for entry in catalog:
+        if entry["last_activity"] < cutoff:
+            windows.setdefault(window_of(entry["last_activity"]), []).append(entry)
+
+    archived = 0
+    segments = []
+    for window, entries in sorted(windows.items()):
+        for start in range(0, len(entries), SEGMENT_TOPICS):
+            pending = []
+            for entry in entries[start:start + SEGMENT_TOPICS]:
+                topic = backend.get_topic(entry["topic_id"])
+                if topic is None:
+                    continue
+                entry = dict(entry, turns=len(topic["messages"]))
+                stored = archive.entry(entry["topic_id"])
+                if stored is not None and stored["turns"] == entry["turns"]:
+                    archived += _evict(entry["topic_id"], entry["turns"])
+                else:
+                    pending.append((entry, topic))
+            if not pending:
+                continue
+            segments.append(archive.store(
+                "topics", window, [topic for _, topic in pending], [entry for entry, _ in pending],
+            ))
+            for entry, _ in pending:
+                archived += _evict(entry["topic_id"], entry["turns"])
+    if archived:
+        backend.vacuum()
+    dropped = archive.enforce_retention(now)
+    return {
+        "archived": archived,
+        "segments": segments,
+        "dropped_segments": dropped,
+        "hot_topics": backend.list_topics(0, 0)[1],
+        "archived_topics": archive.count(),
+        "archive_bytes": archive.size(),
+    }
+
+
+def search_messages(query, limit=20):
+    """Full-text search over every stored message, best match first.
+
+    Each hit carries ``topic_id``, ``topic``, ``turns``, ``position`` (the
+    message's index within its topic), ``role``, ``snippet`` (matches in
+    ``**bold**``) and ``score``. Hits in archived topics are marked
+    ``archived``.
+    """
+    query = (query or "").strip()
+    if not query:
+        return []
+    hits = get_cache().search(query, limit)
+    archive = get_archive()
+    if archive.count():
+        # FTS5 bm25 and the archive's in-memory BM25 are on different
+        # scales, so the two lists are interleaved by rank, hot hits first.
+        archived = archive.search(query, limit)
+        ranked = [(rank, 0, hit) for rank, hit in enumerate(hits)]
+        ranked += [(rank, 1, hit) for rank, hit in enumerate(archived)]
+        hits = [hit for _, _, hit in sorted(ranked, key=lambda r: r[:2])][:limit]
+    return hits
 
 
 def ensure_topic_store():
     """Public helper to ensure topic file exists; safe to call at startup."""
-    _ensure_topic_file()
\ No newline at end of file
+    _ensure_topic_file()
+
+
+if __name__ == "__main__":
+    # python -m utils.topic_manager migrate [path/to/topics_memory.json]
+    # python -m utils.topic_manager compact [max_age_days]
+    if len(sys.argv) >= 2 and sys.argv[1] == "migrate":
+        source = Path(sys.argv[2]) if len(sys.argv) > 2 else TOPIC_FILE
+        print(f"Imported {migrate_json_to_sqlite(source)} topics from {source} into {TOPIC_DB}")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "compact":
+        from utils.memory_manager import archive_memory
+
+        days = float(sys.argv[2]) if len(sys.argv) > 2 else ARCHIVE_AFTER_DAYS
+        now = time.time()
+        stats = compact(days, now)
+        stats["archived_memory_entries"] = archive_memory(get_archive(), now - days * 86400)
+        print(json.dumps(stats, indent=2))
+    else:
+        print("usage: python -m utils.topic_manager migrate [topics_memory.json]")
+        print("       python -m utils.topic_manager compact [max_age_days]")